@@ -0,0 +1,108 @@
+"""
+Generates scaled restraint configurations for the benchmarks. The scale is set with configure_scale before
+the configuration is loaded, and the RESTRAINT_CONFIGURATION setting points at get_configuration.
+"""
+from django.contrib.auth.models import User
+
+
+# The number of perms, levels per perm and perm sets in the generated configuration
+SCALE = {
+    'perms': 100,
+    'levels': 5,
+    'perm_sets': 20,
+}
+
+
+# Perms used to compare id filters that return lists of ids with ones that return subqueries
+ID_LIST_PERM = 'filter_id_list'
+SUBQUERY_PERM = 'filter_subquery'
+
+
+def configure_scale(perms, levels, perm_sets):
+    SCALE.update(perms=perms, levels=levels, perm_sets=perm_sets)
+
+
+def get_perm_set_name(index):
+    return f'perm_set_{index}'
+
+
+def get_perm_name(index):
+    return f'perm_{index}'
+
+
+def get_level_name(index):
+    return f'level_{index}'
+
+
+def perm_set_getter(user):
+    return [get_perm_set_name(user.id % SCALE['perm_sets'])]
+
+
+def user_id_filter(user):
+    return User.objects.filter(id=user.id).values_list('id', flat=True)
+
+
+def staff_id_list_filter(user):
+    return list(User.objects.filter(is_staff=True).values_list('id', flat=True))
+
+
+def staff_subquery_filter(user):
+    return User.objects.filter(is_staff=True).values_list('id', flat=True)
+
+
+def get_configuration():
+    perms = {
+        get_perm_name(i): {
+            'display_name': f'Perm {i}',
+            'levels': {
+                get_level_name(j): {
+                    'display_name': f'Level {j}',
+                    'id_filter': user_id_filter if j else None,
+                }
+                for j in range(SCALE['levels'])
+            },
+        }
+        for i in range(SCALE['perms'])
+    }
+    perms[ID_LIST_PERM] = {
+        'display_name': 'Filter With An Id List',
+        'levels': {
+            'staff': {
+                'display_name': 'Staff',
+                'id_filter': staff_id_list_filter,
+            },
+        },
+    }
+    perms[SUBQUERY_PERM] = {
+        'display_name': 'Filter With A Subquery',
+        'levels': {
+            'staff': {
+                'display_name': 'Staff',
+                'id_filter': staff_subquery_filter,
+            },
+        },
+    }
+
+    # Each perm set has every level of every other perm, offset by the index of the perm set
+    default_access = {
+        get_perm_set_name(k): {
+            get_perm_name(i): [get_level_name(j) for j in range(SCALE['levels'])]
+            for i in range(k % 2, SCALE['perms'], 2)
+        }
+        for k in range(SCALE['perm_sets'])
+    }
+    for perm_set_access in default_access.values():
+        perm_set_access[ID_LIST_PERM] = ['staff']
+        perm_set_access[SUBQUERY_PERM] = ['staff']
+
+    return {
+        'perm_set_getter': perm_set_getter,
+        'perm_sets': {
+            get_perm_set_name(k): {
+                'display_name': f'Perm Set {k}',
+            }
+            for k in range(SCALE['perm_sets'])
+        },
+        'perms': perms,
+        'default_access': default_access,
+    }
@@ -0,0 +1,184 @@
+"""
+Runs the restraint benchmarks against a throwaway database and prints the results as JSON.
+
+The database is chosen the same way as for the tests, with the DB and DB_SETTINGS environment variables.
+Run from the root of the repository:
+
+    DB=sqlite python -m benchmarks.run --users 1000 --output results.json
+"""
+import argparse
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+
+from settings import configure_settings
+
+
+def measure(func, repeat):
+    """
+    Calls a function repeatedly and returns its wall time, query count and peak memory. The query count
+    and peak memory are measured on a separate call so that they do not slow down the timed calls.
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    with CaptureQueriesContext(connection) as queries:
+        func()
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'wall_time': {
+            'min': min(timings),
+            'mean': statistics.mean(timings),
+            'median': statistics.median(timings),
+        },
+        'queries': len(queries),
+        'peak_memory': peak_memory,
+    }
+
+
+def create_data(num_users):
+    """
+    Syncs the configuration and creates the users. Every other user is staff, and every user has
+    individual access to one level.
+    """
+    from django.contrib.auth.models import User
+
+    from benchmarks.configuration import get_level_name, get_perm_name
+    from restraint.core import update_restraint_db
+    from restraint.models import PermAccess
+
+    update_restraint_db()
+    User.objects.bulk_create([
+        User(username=f'user_{i}', is_staff=bool(i % 2))
+        for i in range(num_users)
+    ])
+    users = list(User.objects.order_by('id'))
+    PermAccess.objects.bulk_add_individual_access([
+        (user, get_perm_name(0), get_level_name(0))
+        for user in users
+    ])
+    return users
+
+
+def get_benchmarks(users):
+    """
+    Returns the benchmarks keyed on their name.
+    """
+    from django.contrib.auth.models import User
+
+    from benchmarks.configuration import ID_LIST_PERM, SUBQUERY_PERM, SCALE, get_level_name, get_perm_name
+    from restraint.core import Restraint, update_restraint_db
+    from restraint.models import PermAccess
+
+    user = users[0]
+    perm_names = [get_perm_name(i) for i in range(SCALE['perms'])]
+    loaded = Restraint(user)
+    loaded.perms
+    grants = [(u, get_perm_name(1), get_level_name(1)) for u in users]
+
+    return {
+        'perms': lambda: Restraint(user).perms,
+        'perms_which_perms': lambda: Restraint(user, perm_names[:10]).perms,
+        'for_users': lambda: [restraint.perms for restraint in Restraint.for_users(users)],
+        'has_perm': lambda: [loaded.has_perm(perm_name) for perm_name in perm_names],
+        'has_perm_level': lambda: [loaded.has_perm(perm_name, get_level_name(1)) for perm_name in perm_names],
+        'has_perms': lambda: loaded.has_perms(perm_names),
+        'filter_qset_id_list': lambda: loaded.filter_qset(User.objects.all(), ID_LIST_PERM).count(),
+        'filter_qset_subquery': lambda: loaded.filter_qset(User.objects.all(), SUBQUERY_PERM).count(),
+        'bulk_add_individual_access': lambda: PermAccess.objects.bulk_add_individual_access(grants),
+        'bulk_remove_individual_access': lambda: PermAccess.objects.bulk_remove_individual_access(grants),
+        'update_perm_set_access': lambda: PermAccess.objects.update_perm_set_access(
+            loaded._config.default_access, flush_previous_config=True
+        ),
+        'update_restraint_db': lambda: update_restraint_db(force=True),
+    }
+
+
+def run(options):
+    from django.db import DatabaseError, connection, transaction
+    from django.test.utils import setup_databases, teardown_databases
+
+    from benchmarks.configuration import SCALE
+    from restraint.version import __version__
+
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        users = create_data(options.users)
+        results = {}
+        for name, func in get_benchmarks(users).items():
+            if options.benchmarks and name not in options.benchmarks:
+                continue
+            try:
+                with transaction.atomic():
+                    results[name] = measure(func, options.repeat)
+            except DatabaseError as e:
+                # Some backends do not support every statement, for example upserts on older SQLite
+                results[name] = {'error': str(e)}
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'restraint': __version__,
+            'database': connection.vendor,
+        },
+        'scale': dict(SCALE, users=options.users),
+        'repeat': options.repeat,
+        'results': results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks restraint with a generated configuration')
+    parser.add_argument('--perms', type=int, default=100, help='The number of perms')
+    parser.add_argument('--levels', type=int, default=5, help='The number of levels of each perm')
+    parser.add_argument('--perm_sets', type=int, default=20, help='The number of perm sets')
+    parser.add_argument('--users', type=int, default=1000, help='The number of users')
+    parser.add_argument('--repeat', type=int, default=10, help='The number of timed calls of each benchmark')
+    parser.add_argument('--output', help='A file to write the results to instead of stdout')
+    parser.add_argument('benchmarks', nargs='*', help='The names of the benchmarks to run. Defaults to all')
+    options = parser.parse_args(argv)
+
+    configure_settings()
+    settings.RESTRAINT_CONFIGURATION = 'benchmarks.configuration.get_configuration'
+    django.setup()
+
+    from benchmarks.configuration import configure_scale
+    from restraint.core import reset_compiled_restraint_config
+
+    # The config was compiled at the default scale when the app was ready
+    configure_scale(options.perms, options.levels, options.perm_sets)
+    reset_compiled_restraint_config()
+
+    results = json.dumps(run(options), indent=4, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(results + '\n')
+    else:
+        sys.stdout.write(results + '\n')
+
+
+if __name__ == '__main__':
+    main()
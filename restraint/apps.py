@@ -1,6 +1,72 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 
 
 class RestraintConfig(AppConfig):
     name = 'restraint'
     verbose_name = 'Django Restraint'
+
+    def ready(self):
+        from restraint import cache, effective_perms, snapshot, versioning
+        from restraint.core import compile_restraint_config, reset_compiled_restraint_config
+        from restraint.models import Perm, PermAccess, PermLevel, PermSet
+        from restraint.signals import restraint_db_updated, restraint_version_changed
+
+        # Compile the config now so that mistakes in it fail at startup instead of when permissions are loaded
+        if getattr(settings, 'RESTRAINT_CONFIGURATION', None):
+            compile_restraint_config()
+        restraint_db_updated.connect(reset_compiled_restraint_config, dispatch_uid='reset_compiled_restraint_config')
+
+        # Keep the cached perm set permissions in sync with the database
+        restraint_db_updated.connect(cache.invalidate_all_perm_sets, dispatch_uid='invalidate_all_perm_sets')
+        m2m_changed.connect(
+            cache.perm_levels_changed, sender=PermAccess.perm_levels.through, dispatch_uid='perm_levels_changed'
+        )
+        post_delete.connect(cache.perm_access_deleted, sender=PermAccess, dispatch_uid='perm_access_deleted')
+        post_save.connect(cache.perm_set_changed, sender=PermSet, dispatch_uid='perm_set_saved')
+        post_delete.connect(cache.perm_set_changed, sender=PermSet, dispatch_uid='perm_set_deleted')
+
+        # Keep the materialized effective permissions in sync with the database
+        restraint_db_updated.connect(effective_perms.refresh_all, dispatch_uid='refresh_effective_perms')
+        m2m_changed.connect(
+            effective_perms.perm_levels_changed,
+            sender=PermAccess.perm_levels.through,
+            dispatch_uid='effective_perm_levels_changed'
+        )
+        pre_delete.connect(
+            effective_perms.perm_set_deleting, sender=PermSet, dispatch_uid='effective_perm_set_deleting'
+        )
+        post_delete.connect(
+            effective_perms.perm_set_deleted, sender=PermSet, dispatch_uid='effective_perm_set_deleted'
+        )
+
+        # Keep the snapshot version in sync with the perm set access
+        restraint_db_updated.connect(snapshot.restraint_db_updated, dispatch_uid='snapshot_restraint_db_updated')
+        m2m_changed.connect(
+            snapshot.perm_levels_changed,
+            sender=PermAccess.perm_levels.through,
+            dispatch_uid='snapshot_perm_levels_changed'
+        )
+        post_delete.connect(
+            snapshot.perm_access_deleted, sender=PermAccess, dispatch_uid='snapshot_perm_access_deleted'
+        )
+        post_save.connect(snapshot.perm_set_changed, sender=PermSet, dispatch_uid='snapshot_perm_set_saved')
+        post_delete.connect(snapshot.perm_set_changed, sender=PermSet, dispatch_uid='snapshot_perm_set_deleted')
+
+        # Keep the restraint version in sync with the database and drop the perm sets cached in this process when
+        # it changes. The compiled config is built from code, so it does not go stale
+        restraint_db_updated.connect(versioning.version_changed, dispatch_uid='version_restraint_db_updated')
+        m2m_changed.connect(
+            versioning.perm_levels_changed,
+            sender=PermAccess.perm_levels.through,
+            dispatch_uid='version_perm_levels_changed'
+        )
+        for model in (PermSet, Perm, PermLevel, PermAccess):
+            post_save.connect(versioning.version_changed, sender=model, dispatch_uid=f'version_{model.__name__}_saved')
+            post_delete.connect(
+                versioning.version_changed, sender=model, dispatch_uid=f'version_{model.__name__}_deleted'
+            )
+        restraint_version_changed.connect(
+            cache.invalidate_local_perm_sets, dispatch_uid='version_invalidate_local_perm_sets'
+        )
@@ -0,0 +1,436 @@
+import inspect
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from restraint import versioning
+from restraint.instrumentation import instrument
+from restraint.signals import perm_set_cache_read
+
+
+# The prefix of the cache keys that hold the permission mask of a perm set
+PERM_SET_KEY_PREFIX = 'restraint:perm_set:'
+
+# The prefix of the cache keys that hold the permission mask of the individual access of a user
+INDIVIDUAL_KEY_PREFIX = 'restraint:individual:'
+
+# The generation of the perm set and individual access keys of this process. It is bumped to make every
+# entry of a cache held in the memory of this process unreachable when another process changes permissions
+_local_generation = 0
+
+# The prefixes of the cache keys that hold memoized id filter results and the version of their namespace
+ID_FILTER_KEY_PREFIX = 'restraint:id_filter:'
+ID_FILTER_VERSION_KEY_PREFIX = 'restraint:id_filter_version:'
+
+
+def get_cache():
+    """
+    Returns the cache that holds perm set permission masks, or None if caching is not enabled with the
+    RESTRAINT_CACHE setting.
+    """
+    alias = getattr(settings, 'RESTRAINT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def get_perm_set_key(perm_set_name):
+    """
+    Returns the cache key of a perm set. The key includes the hash of the level bits of the config so
+    that processes running different configs never share permission masks, and the local generation.
+    """
+    from restraint.core import get_compiled_restraint_config
+    levels_hash = get_compiled_restraint_config().levels_hash
+    return f'{PERM_SET_KEY_PREFIX}{levels_hash}:{_local_generation}:{perm_set_name}'
+
+
+def get_individual_key(user_key):
+    """
+    Returns the cache key of the individual access of a user, given its (app label, model name, id)
+    key. Like perm set keys, the key includes the hash of the level bits of the config and the local
+    generation.
+    """
+    from restraint.core import get_compiled_restraint_config
+    levels_hash = get_compiled_restraint_config().levels_hash
+    app_label, model_name, user_id = user_key
+    return f'{INDIVIDUAL_KEY_PREFIX}{levels_hash}:{_local_generation}:{app_label}.{model_name}:{user_id}'
+
+
+def _get_perm_user_key(perm_user_type_id, perm_user_id):
+    """
+    Returns the (app label, model name, id) key of the user of individual PermAccess.
+    """
+    content_type = ContentType.objects.get_for_id(perm_user_type_id)
+    return (content_type.app_label, content_type.model, perm_user_id)
+
+
+def _set_loaded(cache, values):
+    """
+    Caches permission masks that were loaded from the database once the current transaction commits,
+    or right away outside of transactions, so that masks read inside a transaction that rolls back are
+    never cached.
+    """
+    timeout = getattr(settings, 'RESTRAINT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    transaction.on_commit(lambda: cache.set_many(values, timeout))
+
+
+async def _aset_loaded(cache, values):
+    """
+    The async version of _set_loaded. The async ORM runs queries in the thread that holds the
+    connection, so the transaction is checked in that thread too.
+    """
+    await sync_to_async(_set_loaded)(cache, values)
+
+
+def _get_perm_set_levels_qset(perm_set_names, which_perms=None):
+    """
+    Returns a queryset of the (perm set name, perm name, level name) access of the perm sets.
+    """
+    from restraint.models import PermLevel
+
+    perm_levels = PermLevel.objects.filter(permaccess__perm_set__name__in=perm_set_names)
+    if which_perms:
+        perm_levels = perm_levels.filter(perm__name__in=which_perms)
+    return perm_levels.values_list('permaccess__perm_set__name', 'perm__name', 'name')
+
+
+def _get_perm_set_masks(perm_set_names, perm_set_levels):
+    """
+    Builds the permission masks of (perm set name, perm name, level name) access. Every perm set
+    name is present in the returned dictionary, even if it has no access.
+    """
+    from restraint.core import get_compiled_restraint_config
+    level_bits = get_compiled_restraint_config().level_bits
+
+    perm_set_masks = {name: 0 for name in perm_set_names}
+    for perm_set_name, perm_name, level_name in perm_set_levels:
+        perm_set_masks[perm_set_name] |= 1 << level_bits[(perm_name, level_name)]
+    return perm_set_masks
+
+
+def load_perm_set_masks(perm_set_names, which_perms=None):
+    """
+    Loads the permission masks of the perm sets from the database with one query. Every perm set name
+    is present in the returned dictionary, even if it has no access.
+    """
+    return _get_perm_set_masks(perm_set_names, _get_perm_set_levels_qset(perm_set_names, which_perms))
+
+
+async def aload_perm_set_masks(perm_set_names, which_perms=None):
+    """
+    The async version of load_perm_set_masks.
+    """
+    return _get_perm_set_masks(perm_set_names, [
+        perm_set_level
+        async for perm_set_level in _get_perm_set_levels_qset(perm_set_names, which_perms)
+    ])
+
+
+def get_perm_set_masks(perm_set_names):
+    """
+    Returns a dictionary of perm set names mapped to the permission masks of the levels the perm sets
+    have access to. Perm sets are read from the cache with one multi-get and only the misses are
+    loaded from the database. The restraint version is checked first, which drops the perm sets cached
+    in the memory of this process if another process changed them.
+    """
+    versioning.check_version()
+    cache = get_cache()
+    with instrument(perm_set_cache_read) as event:
+        keys = {get_perm_set_key(name): name for name in set(perm_set_names)}
+        perm_set_masks = {
+            keys[key]: value
+            for key, value in cache.get_many(keys).items()
+        }
+
+        missing_names = set(keys.values()) - set(perm_set_masks)
+        event.update(hits=len(perm_set_masks), misses=len(missing_names))
+        if missing_names:
+            # Perm sets without any access are cached too so that they are not loaded again
+            loaded = load_perm_set_masks(missing_names)
+            _set_loaded(cache, {get_perm_set_key(name): mask for name, mask in loaded.items()})
+            perm_set_masks.update(loaded)
+
+    return perm_set_masks
+
+
+async def aget_perm_set_masks(perm_set_names):
+    """
+    The async version of get_perm_set_masks.
+    """
+    await versioning.acheck_version()
+    cache = get_cache()
+    with instrument(perm_set_cache_read, count_queries=False) as event:
+        keys = {get_perm_set_key(name): name for name in set(perm_set_names)}
+        perm_set_masks = {
+            keys[key]: value
+            for key, value in (await cache.aget_many(keys)).items()
+        }
+
+        missing_names = set(keys.values()) - set(perm_set_masks)
+        event.update(hits=len(perm_set_masks), misses=len(missing_names))
+        if missing_names:
+            loaded = await aload_perm_set_masks(missing_names)
+            await _aset_loaded(cache, {get_perm_set_key(name): mask for name, mask in loaded.items()})
+            perm_set_masks.update(loaded)
+
+    return perm_set_masks
+
+
+def get_individual_masks(users):
+    """
+    Returns a dictionary of (app label, model name, id) user keys mapped to the permission masks of the
+    individual access of the users. The masks are read from the cache with one multi-get and only the
+    misses are loaded from the database, with one query.
+    """
+    from restraint.core import _get_user_key, _load_individual_masks
+
+    cache = get_cache()
+    users = {_get_user_key(user): user for user in users}
+    keys = {get_individual_key(user_key): user_key for user_key in users}
+    individual_masks = {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+    missing_user_keys = set(users) - set(individual_masks)
+    if missing_user_keys:
+        # Users without any individual access are cached too so that they are not loaded again
+        loaded = _load_individual_masks([users[user_key] for user_key in missing_user_keys])
+        loaded = {user_key: loaded[user_key] for user_key in missing_user_keys}
+        _set_loaded(cache, {get_individual_key(user_key): mask for user_key, mask in loaded.items()})
+        individual_masks.update(loaded)
+
+    return individual_masks
+
+
+async def aget_individual_masks(users):
+    """
+    The async version of get_individual_masks.
+    """
+    from restraint.core import _aload_individual_masks, _get_user_key
+
+    cache = get_cache()
+    users = {_get_user_key(user): user for user in users}
+    keys = {get_individual_key(user_key): user_key for user_key in users}
+    individual_masks = {keys[key]: value for key, value in (await cache.aget_many(keys)).items()}
+
+    missing_user_keys = set(users) - set(individual_masks)
+    if missing_user_keys:
+        loaded = await _aload_individual_masks([users[user_key] for user_key in missing_user_keys])
+        loaded = {user_key: loaded[user_key] for user_key in missing_user_keys}
+        await _aset_loaded(cache, {get_individual_key(user_key): mask for user_key, mask in loaded.items()})
+        individual_masks.update(loaded)
+
+    return individual_masks
+
+
+def invalidate_perm_sets(perm_set_names=None):
+    """
+    Drops the cached permissions of the perm sets. All perm sets are dropped if no names are given.
+    The entries are dropped again when the current transaction commits so that a concurrent load
+    cannot cache the permissions from before the change.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    if perm_set_names is None:
+        from restraint.core import get_compiled_restraint_config
+        from restraint.models import PermSet
+        perm_set_names = set(PermSet.objects.values_list('name', flat=True)) | set(
+            get_compiled_restraint_config().perm_sets
+        )
+
+    keys = [get_perm_set_key(name) for name in perm_set_names]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def invalidate_individual_access(user_keys=None):
+    """
+    Drops the cached individual access of users, given their (app label, model name, id) keys. The
+    access of every user with individual access is dropped if no keys are given. Like perm sets, the
+    entries are dropped again when the current transaction commits.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    if user_keys is None:
+        from restraint.models import PermAccess
+        user_keys = PermAccess.objects.filter(perm_user_type__isnull=False).values_list(
+            'perm_user_type__app_label', 'perm_user_type__model', 'perm_user_id'
+        )
+
+    keys = [get_individual_key(user_key) for user_key in user_keys]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_id_filter_version_key(perm_name):
+    """
+    Returns the cache key of the version of the namespace of the memoized id filter results of a perm.
+    """
+    return f'{ID_FILTER_VERSION_KEY_PREFIX}{perm_name}'
+
+
+def get_id_filter_key(perm_name, level_name, version, key):
+    """
+    Returns the cache key of the memoized id filter results of a level for the value of its cache_key.
+    """
+    return f'{ID_FILTER_KEY_PREFIX}{perm_name}:{version}:{level_name}:{key}'
+
+
+def _get_id_filter_timeout(cache_ttl):
+    if cache_ttl is not None:
+        return cache_ttl
+    return getattr(settings, 'RESTRAINT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+
+
+def get_id_filter_ids(perm_name, level_name, id_filter, user, cache_key, cache_ttl=None):
+    """
+    Returns the ids of an id filter, memoized in the cache under the value of the cache_key function
+    of the level so that every user with the same key shares them. Querysets returned by the id filter
+    are evaluated into lists of ids.
+    """
+    cache = get_cache()
+    version = cache.get_or_set(get_id_filter_version_key(perm_name), time.time_ns, None)
+    key = get_id_filter_key(perm_name, level_name, version, cache_key(user))
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(id_filter(user))
+        cache.set(key, ids, _get_id_filter_timeout(cache_ttl))
+    return ids
+
+
+async def aget_id_filter_ids(perm_name, level_name, id_filter, user, cache_key, cache_ttl=None):
+    """
+    The async version of get_id_filter_ids. Id filters that are coroutine functions are awaited and
+    querysets are evaluated with the async ORM.
+    """
+    cache = get_cache()
+    version = await cache.aget_or_set(get_id_filter_version_key(perm_name), time.time_ns, None)
+    key = get_id_filter_key(perm_name, level_name, version, cache_key(user))
+    ids = await cache.aget(key)
+    if ids is None:
+        ids = id_filter(user)
+        if inspect.isawaitable(ids):
+            ids = await ids
+        ids = [pk async for pk in ids] if hasattr(ids, '__aiter__') else list(ids)
+        await cache.aset(key, ids, _get_id_filter_timeout(cache_ttl))
+    return ids
+
+
+def invalidate_id_filters(perm_names=None):
+    """
+    Bumps the version of the namespace of the memoized id filter results of the perms, or of all perms
+    if no names are given, so that the id filters are called again. Call this from app code when the
+    data the id filters read changes.
+    """
+    cache = get_cache()
+    if cache is None:
+        return
+
+    if perm_names is None:
+        from restraint.core import get_compiled_restraint_config
+        perm_names = get_compiled_restraint_config().perms
+
+    for perm_name in perm_names:
+        version_key = get_id_filter_version_key(perm_name)
+        try:
+            cache.incr(version_key)
+        except ValueError:
+            # The version was never set or was evicted. Versions start at the current time so that a new
+            # namespace never matches the entries of an old one
+            cache.set(version_key, time.time_ns(), None)
+
+
+def warm_users(users, which_perms=None, perm_set_names=None, id_filters=False):
+    """
+    Loads the permissions of users in bulk so that the permissions of their perm sets and their
+    individual access are cached, and optionally calls the id filters of their levels that have a
+    cache_key so that their ids are memoized. Returns the number of users that were warmed.
+
+    :type which_perms: list
+    :param which_perms: The perms to load and whose id filters are memoized, or all perms if None
+
+    :type perm_set_names: list
+    :param perm_set_names: If given, only users in at least one of these perm sets are warmed
+    """
+    from restraint.core import Restraint, get_compiled_restraint_config
+    config = get_compiled_restraint_config()
+
+    if perm_set_names is not None:
+        perm_set_names = set(perm_set_names)
+        users = [user for user in users if perm_set_names.intersection(config.perm_set_getter(user))]
+
+    restraints = Restraint.for_users(users, which_perms)
+    if id_filters:
+        for restraint in restraints:
+            for perm_name, level_name in config.get_perm_levels(restraint.perm_mask):
+                level_record = config.get_level_record(perm_name, level_name)
+                if level_record.cache_key and level_record.id_filter:
+                    get_id_filter_ids(
+                        perm_name,
+                        level_name,
+                        level_record.id_filter,
+                        restraint._user,
+                        level_record.cache_key,
+                        level_record.cache_ttl
+                    )
+    return len(restraints)
+
+
+def perm_levels_changed(sender, instance, action, reverse, **kwargs):
+    """
+    Invalidates cached perm sets or individual access when the levels of a PermAccess change. This is
+    connected to the m2m_changed signal of PermAccess.perm_levels.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear') or get_cache() is None:
+        return
+
+    if reverse:
+        # The levels were changed from the PermLevel side so any perm set or user could be affected
+        invalidate_perm_sets()
+        invalidate_individual_access()
+    elif instance.perm_set_id is not None:
+        invalidate_perm_sets([instance.perm_set.name])
+    elif instance.perm_user_type_id is not None:
+        invalidate_individual_access([_get_perm_user_key(instance.perm_user_type_id, instance.perm_user_id)])
+
+
+def perm_access_deleted(sender, instance, **kwargs):
+    """
+    Invalidates cached perm sets or individual access when a PermAccess is deleted.
+    """
+    if instance.perm_set_id is not None:
+        invalidate_perm_sets()
+    elif instance.perm_user_type_id is not None and get_cache() is not None:
+        invalidate_individual_access([_get_perm_user_key(instance.perm_user_type_id, instance.perm_user_id)])
+
+
+def perm_set_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached permissions of a saved or deleted PermSet.
+    """
+    invalidate_perm_sets([instance.name])
+
+
+def invalidate_local_perm_sets(sender, **kwargs):
+    """
+    Makes all cached perm sets and individual access unreachable when the cache is held in the memory of
+    this process, since other processes cannot invalidate it. The local generation in the keys is bumped
+    instead of deleting each entry, and the old entries are culled by the cache. This is connected to the
+    restraint_version_changed signal.
+    """
+    global _local_generation
+    if isinstance(get_cache(), LocMemCache):
+        _local_generation += 1
+
+
+def invalidate_all_perm_sets(sender, **kwargs):
+    """
+    Invalidates all cached perm sets after the restraint db is updated.
+    """
+    invalidate_perm_sets()
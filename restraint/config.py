@@ -0,0 +1,315 @@
+import hashlib
+import json
+from collections import defaultdict
+from types import MappingProxyType
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+def get_config_fingerprint(config):
+    """
+    Returns a stable hash of the parts of the config that update_restraint_db syncs to the database:
+    the names, display names and flags of perm sets, perms and levels, and the default access.
+    """
+    normalized = {
+        'perm_sets': {
+            name: {
+                'display_name': perm_set_config.get('display_name', ''),
+                'locked': perm_set_config.get('locked', False),
+                'hidden': perm_set_config.get('hidden', False),
+            }
+            for name, perm_set_config in config['perm_sets'].items()
+        },
+        'perms': {
+            name: {
+                'display_name': perm_config.get('display_name', ''),
+                'locked': perm_config.get('locked', False),
+                'hidden': perm_config.get('hidden', False),
+                'levels': {
+                    level: level_config.get('display_name', '')
+                    for level, level_config in perm_config['levels'].items()
+                },
+            }
+            for name, perm_config in config['perms'].items()
+        },
+        'default_access': {
+            perm_set: {
+                perm: sorted(levels)
+                for perm, levels in perms.items()
+            }
+            for perm_set, perms in config.get('default_access', {}).items()
+        },
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+# The longest name of a perm set, perm or level that fits in the database
+MAX_NAME_LENGTH = 256
+
+
+def _check_name(name, kind):
+    if not isinstance(name, str) or len(name) > MAX_NAME_LENGTH:
+        raise ImproperlyConfigured(
+            f'The {kind} name {name!r} must be a string of at most {MAX_NAME_LENGTH} characters'
+        )
+
+
+def _check_callable(value, description):
+    if value is not None and not callable(value):
+        raise ImproperlyConfigured(f'The {description} must be callable, got {value!r}')
+
+
+def validate_config(config):
+    """
+    Checks the restraint configuration and raises ImproperlyConfigured with a description of the first
+    problem found. This runs when the configuration is compiled and before it is synced to the database,
+    so that mistakes fail at startup instead of when permissions are loaded.
+
+    :type config: dict
+    :param config: The configuration returned by the RESTRAINT_CONFIGURATION setting
+    """
+    for key in ('perm_sets', 'perms'):
+        if not isinstance(config.get(key), dict):
+            raise ImproperlyConfigured(f'The restraint config must have a {key!r} dictionary')
+    _check_callable(config.get('perm_set_getter'), 'perm_set_getter')
+    _check_callable(config.get('perm_checker'), 'perm_checker')
+    _check_callable(config.get('perm_set_users'), 'perm_set_users')
+
+    for perm_set in config['perm_sets']:
+        _check_name(perm_set, 'perm set')
+    _validate_perms(config['perms'])
+    _validate_default_access(config)
+
+
+def _validate_perms(perms):
+    for perm, perm_config in perms.items():
+        _check_name(perm, 'perm')
+        if not perm_config.get('levels'):
+            raise ImproperlyConfigured(f'The perm {perm!r} must have at least one level')
+        for level, level_config in perm_config['levels'].items():
+            _check_name(level, 'level')
+            for key in ('id_filter', 'q_filter', 'cache_key'):
+                _check_callable(level_config.get(key), f'{key} of the level {perm!r} {level!r}')
+
+
+def _validate_default_access(config):
+    for perm_set, perms in config.get('default_access', {}).items():
+        if perm_set not in config['perm_sets']:
+            raise ImproperlyConfigured(f'The default access refers to the unknown perm set {perm_set!r}')
+        for perm, levels in perms.items():
+            if perm not in config['perms']:
+                raise ImproperlyConfigured(
+                    f'The default access of the perm set {perm_set!r} refers to the unknown perm {perm!r}'
+                )
+            if len(set(levels)) != len(levels):
+                raise ImproperlyConfigured(
+                    f'The default access of the perm set {perm_set!r} lists a level of the perm {perm!r} twice'
+                )
+            for level in levels:
+                if level not in config['perms'][perm]['levels']:
+                    raise ImproperlyConfigured(
+                        f'The default access of the perm set {perm_set!r} refers to the unknown level {level!r} '
+                        f'of the perm {perm!r}'
+                    )
+
+
+class Record(object):
+    """
+    A frozen record of compiled config values. Subclasses name their fields with __slots__.
+    """
+    __slots__ = ()
+
+    def __init__(self, **values):
+        for name in self.__slots__:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} records are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} records are immutable')
+
+    def __repr__(self):
+        return f'<{type(self).__name__} {self.id}: {self.name}>'
+
+
+class PermRecord(Record):
+    """
+    A compiled perm. The id is the position of the perm in the sorted perm names, levels maps the level
+    names to their records and mask has the bits of every level of the perm.
+    """
+    __slots__ = ('id', 'name', 'levels', 'mask')
+
+
+class LevelRecord(Record):
+    """
+    A compiled level of a perm. The id is the bit of the level in permission masks, and the filters and
+    memoization settings of the level are referenced directly.
+    """
+    __slots__ = ('id', 'perm', 'name', 'id_filter', 'q_filter', 'cache_key', 'cache_ttl')
+
+
+class CompiledConfig(object):
+    """
+    An immutable, precompiled view of the restraint configuration. It is built once per process
+    and shared by every Restraint object so that the configuration does not have to be imported and
+    walked every time permissions are loaded.
+    """
+    def __init__(self, config):
+        """
+        Validates and compiles the configuration.
+
+        :type config: dict
+        :param config: The configuration returned by the RESTRAINT_CONFIGURATION setting
+        """
+        validate_config(config)
+        object.__setattr__(self, 'raw', config)
+        object.__setattr__(self, 'perm_set_getter', config.get('perm_set_getter'))
+        object.__setattr__(self, 'perm_checker', config.get('perm_checker'))
+        object.__setattr__(self, 'perm_set_users', config.get('perm_set_users'))
+        object.__setattr__(self, 'perm_sets', MappingProxyType(dict(config.get('perm_sets', {}))))
+        object.__setattr__(self, 'perms', MappingProxyType(dict(config.get('perms', {}))))
+        object.__setattr__(self, 'default_access', MappingProxyType(dict(config.get('default_access', {}))))
+
+        # Compile a record for each perm and level. Each (perm, level) pair is assigned a bit in permission
+        # masks in sorted order. The bits only depend on the names in the config, so masks built by
+        # processes with the same config are interchangeable
+        level_records = []
+        perm_records = {}
+        for perm_id, perm in enumerate(sorted(self.perms)):
+            levels = {}
+            for level in sorted(self.perms[perm]['levels']):
+                level_config = self.perms[perm]['levels'][level]
+                levels[level] = LevelRecord(
+                    id=len(level_records),
+                    perm=perm,
+                    name=level,
+                    id_filter=level_config.get('id_filter'),
+                    q_filter=level_config.get('q_filter'),
+                    cache_key=level_config.get('cache_key'),
+                    cache_ttl=level_config.get('cache_ttl'),
+                )
+                level_records.append(levels[level])
+            perm_records[perm] = PermRecord(
+                id=perm_id,
+                name=perm,
+                levels=MappingProxyType(levels),
+                mask=sum(1 << level_record.id for level_record in levels.values()),
+            )
+        object.__setattr__(self, 'perm_records', MappingProxyType(perm_records))
+        object.__setattr__(self, 'level_records', tuple(level_records))
+
+        # The perm -> level -> id_filter lookup table
+        object.__setattr__(self, 'id_filters', MappingProxyType({
+            perm: MappingProxyType({
+                level: level_record.id_filter
+                for level, level_record in perm_record.levels.items()
+            })
+            for perm, perm_record in perm_records.items()
+        }))
+
+        bit_levels = tuple((level_record.perm, level_record.name) for level_record in level_records)
+        object.__setattr__(self, 'bit_levels', bit_levels)
+        object.__setattr__(self, 'level_bits', MappingProxyType({
+            perm_level: bit
+            for bit, perm_level in enumerate(bit_levels)
+        }))
+        object.__setattr__(self, 'perm_masks', MappingProxyType({
+            perm: perm_record.mask
+            for perm, perm_record in perm_records.items()
+        }))
+        object.__setattr__(self, 'levels_hash', hashlib.sha1(repr(bit_levels).encode()).hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError('The compiled restraint config is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('The compiled restraint config is immutable')
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+    def get_level_record(self, perm, level):
+        """
+        Returns the record of a level of a perm, or None if the perm or level is not in the config.
+        """
+        perm_record = self.perm_records.get(perm)
+        return perm_record.levels.get(level) if perm_record else None
+
+    def get_id_filter(self, perm, level):
+        """
+        Returns the id filter for a level of a perm.
+        """
+        return self.perm_records[perm].levels[level].id_filter
+
+    def get_q_filter(self, perm, level):
+        """
+        Returns the q filter for a level of a perm, or None if the level does not have one.
+        """
+        level_record = self.get_level_record(perm, level)
+        return level_record.q_filter if level_record else None
+
+    def get_id_filter_cache(self, perm, level):
+        """
+        Returns the (cache_key, cache_ttl) pair for a level that memoizes its id filter results, or None.
+        """
+        level_record = self.get_level_record(perm, level)
+        if level_record is None or not level_record.cache_key:
+            return None
+        return level_record.cache_key, level_record.cache_ttl
+
+    def get_mask(self, perm_level_names):
+        """
+        Returns the permission mask of (perm name, level name) pairs.
+        """
+        mask = 0
+        for perm_level in perm_level_names:
+            mask |= 1 << self.level_bits[perm_level]
+        return mask
+
+    def get_perms_mask(self, perm_names):
+        """
+        Returns the permission mask of every level of the perms.
+        """
+        mask = 0
+        for perm_name in perm_names:
+            mask |= self.perm_masks.get(perm_name, 0)
+        return mask
+
+    def has_level(self, mask, perm, level=None):
+        """
+        Returns true if the mask has the level of the perm, or any level of the perm if no level is given.
+        """
+        if level is None:
+            return bool(mask & self.perm_masks.get(perm, 0))
+        bit = self.level_bits.get((perm, level))
+        return bit is not None and bool(mask >> bit & 1)
+
+    def get_perm_levels(self, mask):
+        """
+        Returns the (perm name, level name) pairs of the levels in a permission mask.
+        """
+        perm_levels = []
+        while mask:
+            low_bit = mask & -mask
+            perm_levels.append(self.bit_levels[low_bit.bit_length() - 1])
+            mask ^= low_bit
+        return perm_levels
+
+    def get_perms(self, mask):
+        """
+        Returns the {perm: {level: filter}} dictionary of the levels in a permission mask. The filter of a
+        level is its q_filter if it has one, otherwise its id_filter, and None if the level is unrestricted.
+        """
+        perms = defaultdict(dict)
+        while mask:
+            low_bit = mask & -mask
+            level_record = self.level_records[low_bit.bit_length() - 1]
+            perms[level_record.perm][level_record.name] = (
+                level_record.id_filter if level_record.q_filter is None else level_record.q_filter
+            )
+            mask ^= low_bit
+        return perms
@@ -6,3 +6,9 @@ BOOLEAN_LEVELS_CONFIG = {
         'id_filter': None,
     },
 }
+
+# The name of the metadata that holds the fingerprint of the config last synced by update_restraint_db
+CONFIG_FINGERPRINT_METADATA_NAME = 'config_fingerprint'
+
+# The name of the metadata that holds the version of the perm set access that snapshots are checked against
+SNAPSHOT_VERSION_METADATA_NAME = 'snapshot_version'
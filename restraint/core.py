@@ -1,37 +1,145 @@
+import asyncio
+import inspect
 from collections import defaultdict
 from itertools import chain
 
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, QuerySet
+from django.db.models.constants import LOOKUP_SEP
 from django.utils.functional import cached_property
 from django.utils.module_loading import import_string
 
-from restraint import models
-from restraint.signals import restraint_db_updated
+from restraint import cache, constants, effective_perms, executor, models
+from restraint.config import CompiledConfig, get_config_fingerprint, validate_config
+from restraint.instrumentation import get_num_ids, instrument
+from restraint.signals import (
+    id_filter_called, perm_checkers_called, perms_loaded, qset_filtered, restraint_db_update_phase,
+    restraint_db_updated
+)
+
+
+# The process-wide compiled config shared by all Restraint objects
+_compiled_config = None
 
 
 def get_restraint_config():
     return import_string(settings.RESTRAINT_CONFIGURATION)()
 
 
+def compile_restraint_config():
+    """
+    Compiles the restraint config and shares it with the rest of the process.
+    """
+    global _compiled_config
+    _compiled_config = CompiledConfig(get_restraint_config())
+    return _compiled_config
+
+
+def get_compiled_restraint_config():
+    """
+    Returns the compiled restraint config, building it the first time it is requested in the process.
+    """
+    return _compiled_config or compile_restraint_config()
+
+
+def reset_compiled_restraint_config(**kwargs):
+    """
+    Drops the compiled restraint config so that it is rebuilt the next time it is requested. This is
+    connected to the restraint_db_updated signal.
+    """
+    global _compiled_config
+    _compiled_config = None
+
+
 @transaction.atomic
-def update_restraint_db(flush_default_access=False):
+def update_restraint_db(flush_default_access=False, force=False):
     """
     Updates the restraint db based on the restraint config.
     Can optionally flush the previous default access configuration.
+    Raises ImproperlyConfigured if the config is not valid.
+
+    Nothing is done if the fingerprint of the config matches the one from the last update, unless
+    the update is forced or the default access is flushed.
     """
     config = get_restraint_config()
-    models.PermSet.objects.sync_perm_sets(config['perm_sets'])
-    updated_perms, new_perms = models.Perm.objects.sync_perms(config['perms'])
-    models.PermLevel.objects.sync_perm_levels(config['perms'])
-    models.PermAccess.objects.update_perm_set_access(config.get('default_access', {}), new_perms, flush_default_access)
-    restraint_db_updated.send(sender=None, config=config)
+    validate_config(config)
+    with instrument(restraint_db_update_phase, phase='fingerprint'):
+        fingerprint = get_config_fingerprint(config)
+
+        # Lock the fingerprint so that concurrent updates wait for each other and then skip
+        fingerprint_metadata = models.RestraintMetadata.objects.select_for_update().filter(
+            name=constants.CONFIG_FINGERPRINT_METADATA_NAME
+        ).first()
+    if not force and not flush_default_access and fingerprint_metadata and fingerprint_metadata.value == fingerprint:
+        return
+
+    with instrument(restraint_db_update_phase, phase='sync_perm_sets'):
+        models.PermSet.objects.sync_perm_sets(config['perm_sets'])
+    with instrument(restraint_db_update_phase, phase='sync_perms'):
+        updated_perms, new_perms = models.Perm.objects.sync_perms(config['perms'])
+    with instrument(restraint_db_update_phase, phase='sync_perm_levels'):
+        models.PermLevel.objects.sync_perm_levels(config['perms'])
+    with instrument(restraint_db_update_phase, phase='update_perm_set_access'):
+        # The effective permissions of every user are refreshed by restraint_db_updated below
+        models.PermAccess.objects.update_perm_set_access(
+            config.get('default_access', {}), new_perms, flush_default_access, refresh_effective_perms=False
+        )
+    models.RestraintMetadata.objects.update_or_create(
+        name=constants.CONFIG_FINGERPRINT_METADATA_NAME,
+        defaults={'value': fingerprint}
+    )
+    with instrument(restraint_db_update_phase, phase='restraint_db_updated'):
+        restraint_db_updated.send(sender=None, config=config)
+
+
+def users_with_perm(perm, level=None, model=None):
+    """
+    Returns a lazy queryset of the users that have a level of a perm, or any level of the perm if no
+    level is given, through their perm sets or their individual access. The perm sets with access are
+    read with one query and the users of each are given by the perm_set_users function of the config,
+    so everything else is a single query that is run when the queryset is evaluated. Permission
+    checkers are not called.
+
+    :type model: Model class
+    :param model: The model of the users, which defaults to the user model
+
+    :raises ImproperlyConfigured: if the config does not have a perm_set_users function
+    """
+    config = get_compiled_restraint_config()
+    if config.perm_set_users is None:
+        raise ImproperlyConfigured('users_with_perm requires a perm_set_users function in the restraint config')
+    model = model or get_user_model()
+
+    perm_levels_filter = {'perm_levels__perm__name': perm}
+    if level is not None:
+        perm_levels_filter['perm_levels__name'] = level
+
+    # Individual access is stored against the content type of the user model
+    users_filter = Q(pk__in=models.PermAccess.objects.filter(
+        perm_user_type=ContentType.objects.get_for_model(model),
+        **perm_levels_filter
+    ).values('perm_user_id'))
+
+    perm_set_names = models.PermAccess.objects.filter(
+        perm_set__isnull=False,
+        **perm_levels_filter
+    ).values_list('perm_set__name', flat=True).distinct()
+    for perm_set_name in perm_set_names:
+        perm_set_users = config.perm_set_users(perm_set_name)
+        if perm_set_users is not None:
+            users_filter |= Q(pk__in=perm_set_users.values('pk'))
+
+    return model.objects.filter(users_filter)
 
 
 def has_permission(user, user_permissions, permission, level):
     """
-    The default permission checker.
+    A permission checker over a permissions dictionary. Restraint objects check their permission
+    masks directly, so this is only provided for compatibility.
 
     Returns true if the restraint object has the perm. If a level is not specified, it returns
     true if that perm exists for any level.
@@ -43,6 +151,107 @@ def has_permission(user, user_permissions, permission, level):
     )
 
 
+def _get_user_key(user):
+    return (user._meta.app_label, user._meta.model_name, user.id)
+
+
+def _get_relation_prefix(model, path):
+    """
+    Returns the lookup of the relation that a path to ids goes through, such as 'account' for the paths
+    'account', 'account_id' and 'account__id', or an empty string for the primary key of the model.
+    Returns None if the path ends at a column that is not a relation.
+    """
+    parts = path.split(LOOKUP_SEP)
+    for part in parts[:-1]:
+        model = model._meta.get_field(part).related_model
+    if parts[-1] == 'pk' or parts[-1] == model._meta.pk.name:
+        return LOOKUP_SEP.join(parts[:-1])
+
+    # Foreign keys can be looked up by their attname, like account_id
+    field = model._meta.get_field(parts[-1])
+    if not field.is_relation:
+        return None
+    return LOOKUP_SEP.join(parts[:-1] + [field.name])
+
+
+def _prefix_q(q, prefix):
+    """
+    Returns a copy of a Q object with the lookups prefixed so that they apply through a relation.
+    Raises ValueError for children that are expressions, such as Exists, since they cannot be
+    rewritten to go through the relation.
+    """
+    if not prefix:
+        return q
+    prefixed = Q()
+    prefixed.connector = q.connector
+    prefixed.negated = q.negated
+    for child in q.children:
+        if isinstance(child, Q):
+            prefixed.children.append(_prefix_q(child, prefix))
+        elif isinstance(child, tuple):
+            prefixed.children.append((f'{prefix}{LOOKUP_SEP}{child[0]}', child[1]))
+        else:
+            raise ValueError(f'The q filter expression {child!r} cannot be applied through {prefix!r}')
+    return prefixed
+
+
+def _get_individual_levels_qset(users, which_perms=None):
+    """
+    Returns a queryset of the (app label, model name, user id, perm name, level name) individual access
+    of many users.
+    """
+    user_ids = defaultdict(set)
+    for user in users:
+        user_ids[(user._meta.app_label, user._meta.model_name)].add(user.id)
+    individual_filter = Q()
+    for (app_label, model_name), ids in user_ids.items():
+        individual_filter |= Q(
+            permaccess__perm_user_type__app_label=app_label,
+            permaccess__perm_user_type__model=model_name,
+            permaccess__perm_user_id__in=ids
+        )
+
+    perm_levels = models.PermLevel.objects.filter(individual_filter)
+    if which_perms:
+        perm_levels = perm_levels.filter(perm__name__in=which_perms)
+    return perm_levels.values_list(
+        'permaccess__perm_user_type__app_label',
+        'permaccess__perm_user_type__model',
+        'permaccess__perm_user_id',
+        'perm__name',
+        'name'
+    )
+
+
+def _get_individual_masks(individual_levels):
+    """
+    Builds the permission masks of (app label, model name, user id, perm name, level name) individual
+    access, keyed on (app label, model name, user id).
+    """
+    level_bits = get_compiled_restraint_config().level_bits
+    individual_masks = defaultdict(int)
+    for app_label, model_name, user_id, perm_name, level_name in individual_levels:
+        individual_masks[(app_label, model_name, user_id)] |= 1 << level_bits[(perm_name, level_name)]
+    return individual_masks
+
+
+def _load_individual_masks(users, which_perms=None):
+    """
+    Loads the individual access of many users with one query. Returns a dictionary of permission
+    masks keyed on (app label, model name, user id).
+    """
+    return _get_individual_masks(_get_individual_levels_qset(users, which_perms))
+
+
+async def _aload_individual_masks(users, which_perms=None):
+    """
+    The async version of _load_individual_masks.
+    """
+    return _get_individual_masks([
+        individual_level async for individual_level in _get_individual_levels_qset(users, which_perms)
+    ])
+
+
 class Restraint(object):
     """
     The primary way of accessing permissions. The programmer loads a restraint object with the
@@ -61,8 +270,8 @@ class Restraint(object):
         :param which_perms: The permissions to be loaded for the user, or all permissions if None.
         """
 
-        # Save a reference to the config
-        self._config = get_restraint_config()
+        # Save a reference to the shared compiled config
+        self._config = get_compiled_restraint_config()
 
         # Save a reference to the user
         self._user = user
@@ -70,49 +279,390 @@ class Restraint(object):
         # Save a reference wo which perms we loaded
         self._which_perms = which_perms
 
-        # Set the permission checkers
-        self._permission_checkers = [has_permission]
-        if self._config.get('perm_checker'):
-            self._permission_checkers.append(self._config.get('perm_checker'))
+        # Set the custom permission checkers. The default checker tests the permission mask
+        self._permission_checkers = []
+        if self._config.perm_checker:
+            self._permission_checkers.append(self._config.perm_checker)
+
+    @classmethod
+    def for_users(cls, users, which_perms=None):
+        """
+        Builds Restraint objects for many users at once. The perm set levels of all of the users are
+        loaded with one query (or one cache multi-get) and the individual access of all of the users
+        with another, so the returned objects never have to load their permissions again.
+
+        :type users: An iterable or QuerySet of users
+        :param users: The users to build Restraint objects for
+
+        :type which_perms: list
+        :param which_perms: The permissions to be loaded for the users, or all permissions if None.
+
+        :rtype: list
+        :returns: A Restraint object for each user, in the order of the users
+        """
+        restraints = [cls(user, which_perms) for user in users]
+        if not restraints:
+            return restraints
+
+        with instrument(perms_loaded, num_users=len(restraints), which_perms=which_perms):
+            config = get_compiled_restraint_config()
+            user_perm_set_names = [config.perm_set_getter(restraint._user) for restraint in restraints]
+            perm_set_names = set(chain(*user_perm_set_names))
+            users = [restraint._user for restraint in restraints]
+            if cache.get_cache() is None:
+                perm_set_masks = cache.load_perm_set_masks(perm_set_names, which_perms)
+                individual_masks = _load_individual_masks(users, which_perms)
+            else:
+                perm_set_masks = cache.get_perm_set_masks(perm_set_names)
+                individual_masks = cache.get_individual_masks(users)
+
+            for restraint, names in zip(restraints, user_perm_set_names):
+                restraint.perm_mask = restraint._merge_perm_set_masks(
+                    individual_masks[_get_user_key(restraint._user)],
+                    [perm_set_masks[name] for name in names],
+                    which_perms
+                )
+        return restraints
+
+    @cached_property
+    def perm_mask(self):
+        """
+        Load and cache the permission mask of the user. Each (perm, level) pair of the config has a
+        bit in the mask, which is set if the user has access to the level.
+        """
+        return self._load_perm_mask(self._which_perms)
 
     @cached_property
     def perms(self):
         """
-        Load and cache the permissions associated with the user
+        The {perm: {level: filter}} dictionary of the permissions associated with the user. The filter of
+        a level is its q_filter if it has one, otherwise its id_filter, and None if the level is
+        unrestricted. It is derived from the permission mask the first time it is accessed.
         """
-        perm_set_names = self._config['perm_set_getter'](self._user)
-        perm_levels = models.PermLevel.objects.filter(
-            Q(permaccess__perm_set__name__in=perm_set_names) | Q(
-                permaccess__perm_user_id=self._user.id,
-                permaccess__perm_user_type__app_label=self._user._meta.app_label,
-                permaccess__perm_user_type__model=self._user._meta.model_name)).select_related('perm')
-        if self._which_perms:
-            perm_levels = perm_levels.filter(perm__name__in=self._which_perms)
+        return self._config.get_perms(self.perm_mask)
+
+    async def aperms(self):
+        """
+        Load and cache the permissions associated with the user with the async ORM. The permissions
+        are shared with the perms property, so they are only loaded once.
+        """
+        if 'perm_mask' not in self.__dict__:
+            self.perm_mask = await self._aload_perm_mask(self._which_perms)
+        return self.perms
+
+    def load_perms(self, which_perms=None):
+        """
+        Makes sure the permissions are loaded. If some permissions were already loaded, only the
+        permissions that are missing are loaded, with one query, and merged into them. This is called
+        by the methods that check permissions and filter querysets, so objects built with which_perms
+        load the other permissions they are asked about as they are needed.
+
+        :type which_perms: list
+        :param which_perms: The permissions to be loaded for the user, or all permissions if None.
+        """
+        missing_perms = self._get_missing_perms(which_perms)
+        if missing_perms is None:
+            self._set_loaded_perm_mask(self._load_perm_mask(None), None)
+        elif missing_perms:
+            self._set_loaded_perm_mask(self.perm_mask | self._load_perm_mask(missing_perms), missing_perms)
+
+    async def aload_perms(self, which_perms=None):
+        """
+        The async version of load_perms.
+        """
+        missing_perms = self._get_missing_perms(which_perms)
+        if missing_perms is None:
+            self._set_loaded_perm_mask(await self._aload_perm_mask(None), None)
+        elif missing_perms:
+            self._set_loaded_perm_mask(self.perm_mask | await self._aload_perm_mask(missing_perms), missing_perms)
+
+    def _get_missing_perms(self, which_perms):
+        """
+        Returns the perms that have to be loaded so that which_perms are loaded: None if all of the perms
+        have to be loaded, or a list of the missing perm names, which is empty if nothing has to be loaded.
+        If nothing has been loaded yet, the missing perms are added to the perms that are loaded later.
+        """
+        if not self._which_perms:
+            # All of the permissions are already loaded, or will be when they are first accessed
+            return []
+
+        if which_perms is None:
+            missing_perms = None
+        else:
+            missing_perms = list(dict.fromkeys(perm for perm in which_perms if perm not in self._which_perms))
+            if not missing_perms:
+                return []
+
+        if 'perm_mask' not in self.__dict__:
+            # Nothing has been loaded yet, so load everything that is needed together later
+            self._which_perms = None if missing_perms is None else list(self._which_perms) + missing_perms
+            return []
+
+        return missing_perms
+
+    def _set_loaded_perm_mask(self, perm_mask, loaded_perms):
+        """
+        Sets the permission mask after the loaded perms were merged into it, or after all of the perms
+        were loaded if loaded_perms is None.
+        """
+        self.perm_mask = perm_mask
+        self._which_perms = None if loaded_perms is None else list(self._which_perms) + loaded_perms
+
+        # The permissions dictionary is derived from the mask again the next time it is accessed
+        self.__dict__.pop('perms', None)
+
+    def _get_perm_levels_qset(self, which_perms, perm_set_names=None):
+        """
+        Returns a queryset of the (perm name, level name) pairs of the individual access of the user
+        and, if perm set names are provided, of the access of those perm sets. The individual access and
+        the perm set access are narrow queries that are combined with a UNION, so each one can use the
+        indexes of its own path through the PermAccess and the perm_levels through tables.
+        """
+        perm_levels = self._filter_which_perms(models.PermLevel.objects.filter(
+            permaccess__perm_user_id=self._user.id,
+            permaccess__perm_user_type__app_label=self._user._meta.app_label,
+            permaccess__perm_user_type__model=self._user._meta.model_name
+        ), which_perms)
+        if perm_set_names is not None:
+            perm_levels = self._filter_which_perms(models.PermLevel.objects.filter(
+                permaccess__perm_set__name__in=perm_set_names
+            ), which_perms).union(perm_levels)
+        return perm_levels
 
-        perms = defaultdict(dict)
-        for level in perm_levels:
-            perms[level.perm.name].update({
-                level.name: self._config['perms'][level.perm.name]['levels'][level.name]['id_filter']
-            })
-        return perms
+    def _filter_which_perms(self, perm_levels, which_perms):
+        """
+        Returns the (perm name, level name) pairs of a PermLevel queryset, filtered by which_perms.
+        """
+        if which_perms:
+            perm_levels = perm_levels.filter(perm__name__in=which_perms)
+        return perm_levels.values_list('perm__name', 'name')
+
+    def _get_effective_perm_levels_qset(self, which_perms):
+        """
+        Returns a queryset of the (perm name, level name) pairs of the materialized effective
+        permissions of the user, including the (None, None) pair of the row that marks the user as
+        materialized.
+        """
+        perm_levels = models.EffectivePermLevel.objects.filter(
+            perm_user_id=self._user.id,
+            perm_user_type__app_label=self._user._meta.app_label,
+            perm_user_type__model=self._user._meta.model_name
+        )
+        if which_perms:
+            perm_levels = perm_levels.filter(
+                Q(perm_level__isnull=True) | Q(perm_level__perm__name__in=which_perms)
+            )
+        return perm_levels.values_list('perm_level__perm__name', 'perm_level__name')
+
+    def _get_effective_perm_mask(self, perm_levels):
+        """
+        Returns the permission mask of the materialized (perm name, level name) pairs of the user, or None
+        if the user has not been materialized.
+        """
+        if not perm_levels:
+            return None
+        return self._config.get_mask(perm_level for perm_level in perm_levels if perm_level != (None, None))
+
+    def _merge_perm_set_masks(self, mask, perm_set_masks, which_perms):
+        """
+        Merges the permission masks of perm sets into a permission mask, keeping only the bits of the
+        perms that are being loaded.
+        """
+        for perm_set_mask in perm_set_masks:
+            mask |= perm_set_mask
+        return mask & self._config.get_perms_mask(which_perms) if which_perms else mask
+
+    def _load_perm_mask(self, which_perms):
+        """
+        Loads the permission mask of the user and sends the perms_loaded signal.
+        """
+        with instrument(perms_loaded, num_users=1, which_perms=which_perms):
+            return self._get_perm_mask(which_perms)
+
+    async def _aload_perm_mask(self, which_perms):
+        """
+        The async version of _load_perm_mask. Queries are not counted since they run in other threads.
+        """
+        with instrument(perms_loaded, count_queries=False, num_users=1, which_perms=which_perms):
+            return await self._aget_perm_mask(which_perms)
+
+    def _get_perm_mask(self, which_perms):
+        """
+        Returns the permission mask of the levels the user has access to. When the perm set cache is
+        enabled, the masks of the user's perm sets and of their individual access are read from the
+        cache and only the misses are queried. When effective permissions are enabled they are read first, and
+        the permissions are only loaded from the perm sets and individual access of the user if the
+        user has not been materialized.
+        """
+        if effective_perms.is_enabled():
+            mask = self._get_effective_perm_mask(list(self._get_effective_perm_levels_qset(which_perms)))
+            if mask is not None:
+                return mask
+
+        perm_set_names = self._config.perm_set_getter(self._user)
+        if cache.get_cache() is None:
+            return self._config.get_mask(self._get_perm_levels_qset(which_perms, perm_set_names))
+
+        # The perm sets are read first since that checks the restraint version
+        perm_set_masks = cache.get_perm_set_masks(perm_set_names)
+        return self._merge_perm_set_masks(
+            cache.get_individual_masks([self._user])[_get_user_key(self._user)],
+            perm_set_masks.values(),
+            which_perms
+        )
+
+    async def _aget_perm_mask(self, which_perms):
+        """
+        The async version of _get_perm_mask.
+        """
+        if effective_perms.is_enabled():
+            mask = self._get_effective_perm_mask([
+                perm_level async for perm_level in self._get_effective_perm_levels_qset(which_perms)
+            ])
+            if mask is not None:
+                return mask
+
+        perm_set_names = self._config.perm_set_getter(self._user)
+        if cache.get_cache() is None:
+            return self._config.get_mask([
+                perm_level async for perm_level in self._get_perm_levels_qset(which_perms, perm_set_names)
+            ])
+
+        perm_set_masks = await cache.aget_perm_set_masks(perm_set_names)
+        return self._merge_perm_set_masks(
+            (await cache.aget_individual_masks([self._user]))[_get_user_key(self._user)],
+            perm_set_masks.values(),
+            which_perms
+        )
 
     def has_perm(self, perm, level=None):
         """
-        Call the configured permission checker
+        Test the permission mask and then call the configured permission checker
+        """
+        if self._which_perms:
+            self.load_perms([perm])
+        if self._config.has_level(self.perm_mask, perm, level or None):
+            return True
+        return self._check_perm_levels([(perm, level)])[0]
+
+    async def ahas_perm(self, perm, level=None):
+        """
+        The async version of has_perm. The permissions are loaded with the async ORM.
+        """
+        await self.aload_perms([perm])
+        await self.aperms()
+        return self.has_perm(perm, level)
+
+    def has_perms(self, perms):
+        """
+        Checks many permissions at once. Each permission is either a perm name, which is true for any
+        level of the perm, or a (perm name, level name) pair. Returns a dictionary of the given
+        permissions mapped to booleans, where pairs given as lists are keyed on tuples.
+
+        The permission checker is only called for the permissions that are not in the permission mask.
+        Batch permission checkers are called once for all of them.
+        """
+        perms = [perm if isinstance(perm, str) else tuple(perm) for perm in perms]
+        perm_levels = self._load_perm_levels(perms)
+        passed = [self._config.has_level(self.perm_mask, perm, level or None) for perm, level in perm_levels]
+        failed = [i for i, has_level in enumerate(passed) if not has_level]
+        if failed:
+            for i, has_perm in zip(failed, self._check_perm_levels([perm_levels[i] for i in failed])):
+                passed[i] = has_perm
+        return dict(zip(perms, passed))
+
+    def has_any_perm(self, perms):
+        """
+        Returns true if any of the permissions passes. Permissions are given as in has_perms.
+        """
+        perm_levels = self._load_perm_levels(perms)
+        if any(self._config.has_level(self.perm_mask, perm, level or None) for perm, level in perm_levels):
+            return True
+        return any(self._check_perm_levels(perm_levels))
+
+    def has_all_perms(self, perms):
+        """
+        Returns true if all of the permissions pass. Permissions are given as in has_perms.
+        """
+        return all(self.has_perms(perms).values())
+
+    async def ahas_perms(self, perms):
+        """
+        The async version of has_perms.
+        """
+        await self.aload_perms([perm for perm, level in map(self._get_perm_level, perms)])
+        await self.aperms()
+        return self.has_perms(perms)
+
+    async def ahas_any_perm(self, perms):
+        """
+        The async version of has_any_perm.
+        """
+        await self.aload_perms([perm for perm, level in map(self._get_perm_level, perms)])
+        await self.aperms()
+        return self.has_any_perm(perms)
+
+    async def ahas_all_perms(self, perms):
+        """
+        The async version of has_all_perms.
+        """
+        await self.aload_perms([perm for perm, level in map(self._get_perm_level, perms)])
+        await self.aperms()
+        return self.has_all_perms(perms)
+
+    def _load_perm_levels(self, perms):
         """
-        # Try and find the first one that passes
-        # Do this in a loop to avoid additional checks when not necessary
-        for permission_checker in self._permission_checkers:
-            if permission_checker(
-                user=self._user,
-                user_permissions=self.perms,
-                permission=perm,
-                level=level
-            ):
-                return True
-        return False
+        Returns the (perm, level) pairs of permissions given as in has_perms, after loading the perms.
+        """
+        perm_levels = [self._get_perm_level(perm) for perm in perms]
+        if self._which_perms:
+            self.load_perms([perm for perm, level in perm_levels])
+        return perm_levels
+
+    def _get_perm_level(self, perm):
+        """
+        Returns the (perm, level) pair of a permission given as a perm name or a (perm, level) pair.
+        """
+        return (perm, None) if isinstance(perm, str) else tuple(perm)
+
+    def _check_perm_levels(self, perm_levels):
+        """
+        Calls the custom permission checkers on (perm, level) pairs and returns a list of booleans.
+        Checkers with an accepts_batch attribute of True are called once with all of the pairs that have
+        not passed yet and return a boolean for each of them.
+        """
+        passed = [False] * len(perm_levels)
+        if not self._permission_checkers:
+            return passed
+
+        with instrument(perm_checkers_called, perm_levels=perm_levels, results=passed):
+            # Try and find the first one that passes
+            # Do this in a loop to avoid additional checks when not necessary
+            for permission_checker in self._permission_checkers:
+                failed = [i for i, has_perm in enumerate(passed) if not has_perm]
+                if not failed:
+                    break
+                if getattr(permission_checker, 'accepts_batch', False) is True:
+                    results = permission_checker(
+                        user=self._user,
+                        user_permissions=self.perms,
+                        permissions=[perm_levels[i] for i in failed]
+                    )
+                else:
+                    results = (
+                        permission_checker(
+                            user=self._user,
+                            user_permissions=self.perms,
+                            permission=perm_levels[i][0],
+                            level=perm_levels[i][1]
+                        )
+                        for i in failed
+                    )
+                for i, has_perm in zip(failed, results):
+                    passed[i] = bool(has_perm)
+        return passed
 
-    def filter_qset(self, qset, perm, restrict_kwargs=None):
+    def filter_qset(self, qset, perm, restrict_kwargs=None, path='id'):
         """
         Given a permission, filter the queryset by its levels.
 
@@ -121,12 +671,117 @@ class Restraint(object):
 
         :type perm: string
         :param perm: The permission over which to do the filtering
+
+        :type path: string
+        :param path: The lookup of the ids that the levels filter by, such as 'account_id' to filter the
+            children of the objects the permission is about. The q filters of the levels are applied
+            through the relation of the path.
+
+        The id filters of the levels are called in a thread pool when the RESTRAINT_ID_FILTER_THREADS
+        setting is enabled, and serially inside transactions.
+        """
+        with instrument(qset_filtered, perm=perm):
+            self.load_perms([perm])
+            permission_filters = self._get_permission_filters(perm)
+            unfiltered_qset = self._get_unfiltered_qset(qset, perm, permission_filters, restrict_kwargs)
+            if unfiltered_qset is not None:
+                return unfiltered_qset
+
+            return qset.filter(self._get_levels_q(
+                permission_filters,
+                executor.map_calls(self._call_id_filter, [
+                    (perm, level, id_filter)
+                    for level, q_filter, id_filter in permission_filters
+                    if q_filter is None
+                ]),
+                qset.model,
+                path
+            ))
+
+    async def afilter_qset(self, qset, perm, restrict_kwargs=None, path='id'):
         """
+        The async version of filter_qset. The permissions are loaded with the async ORM and id filters
+        that are coroutine functions are awaited concurrently. Other id filters are called directly,
+        so they should return unevaluated querysets instead of querying the database.
+
+        :type qset: A Django QuerySet
+        :param qset: The queryset to be filtered
+
+        :type perm: string
+        :param perm: The permission over which to do the filtering
 
+        :type path: string
+        :param path: The lookup of the ids that the levels filter by, as for filter_qset
+        """
+        await self.aload_perms([perm])
+        await self.aperms()
+        with instrument(qset_filtered, count_queries=False, perm=perm):
+            permission_filters = self._get_permission_filters(perm)
+            unfiltered_qset = self._get_unfiltered_qset(qset, perm, permission_filters, restrict_kwargs)
+            if unfiltered_qset is not None:
+                return unfiltered_qset
+
+            return qset.filter(self._get_levels_q(
+                permission_filters,
+                await asyncio.gather(*[
+                    self._acall_id_filter(perm, level, id_filter)
+                    for level, q_filter, id_filter in permission_filters
+                    if q_filter is None
+                ]),
+                qset.model,
+                path
+            ))
+
+    def _call_id_filter(self, perm, level, id_filter):
+        """
+        Calls the id filter of a level and sends the id_filter_called signal. The results of levels with
+        a cache_key are memoized in the perm set cache.
+        """
+        with instrument(id_filter_called, perm=perm, level=level) as event:
+            id_filter_cache = self._config.get_id_filter_cache(perm, level)
+            if id_filter_cache and cache.get_cache() is not None:
+                ids = cache.get_id_filter_ids(perm, level, id_filter, self._user, *id_filter_cache)
+            else:
+                ids = id_filter(self._user)
+            event['num_ids'] = get_num_ids(ids)
+        return ids
+
+    async def _acall_id_filter(self, perm, level, id_filter):
+        """
+        The async version of _call_id_filter, which also awaits id filters that are coroutine functions.
+        """
+        with instrument(id_filter_called, count_queries=False, perm=perm, level=level) as event:
+            id_filter_cache = self._config.get_id_filter_cache(perm, level)
+            if id_filter_cache and cache.get_cache() is not None:
+                ids = await cache.aget_id_filter_ids(perm, level, id_filter, self._user, *id_filter_cache)
+            else:
+                ids = id_filter(self._user)
+                if inspect.isawaitable(ids):
+                    ids = await ids
+            event['num_ids'] = get_num_ids(ids)
+        return ids
+
+    def _get_permission_filters(self, perm):
+        """
+        Returns (level, q filter, id filter) tuples for the levels of the perm that the user has.
+        """
+        permission_filters = []
+        for level, level_filter in self.perms[perm].items():
+            q_filter = self._config.get_q_filter(perm, level)
+            # The filter of a q_filter level in perms is its q_filter, so it does not have an id filter
+            permission_filters.append((level, q_filter, level_filter if q_filter is None else None))
+        return permission_filters
+
+    def _get_unfiltered_qset(self, qset, perm, permission_filters, restrict_kwargs):
+        """
+        Returns the filtered queryset when it does not depend on the filters of the levels, otherwise None.
+        """
         # Check if any permission filters exist
         # If none exist we know we can allow all
-        permission_filters = self.perms[perm].values()
-        allow_all = True if not len(permission_filters) or None in permission_filters else False
+        allow_all = not permission_filters or any(
+            q_filter is None and id_filter is None
+            for level, q_filter, id_filter in permission_filters
+        )
         has_perm = self.has_perm(perm)
 
         # The user does not have this permission for any level
@@ -140,6 +795,42 @@ class Restraint(object):
         elif has_perm and allow_all:
             # If any levels are none, return the full queryset
             return qset
-        else:
-            # Filter the queryset by the union of all filters
-            return qset.filter(id__in=set(chain(*[level(self._user) for level in self.perms[perm].values()])))
+        return None
+
+    def _get_levels_q(self, permission_filters, id_filter_results, model, path='id'):
+        """
+        Builds a Q object for the union of all of the levels. Levels with q filters are ORed into the
+        where clause through the relation of the path and the rest are filtered by the ids their id
+        filters returned.
+        """
+        q = Q()
+        q_filters = [q_filter for level, q_filter, id_filter in permission_filters if q_filter is not None]
+        if q_filters:
+            prefix = _get_relation_prefix(model, path)
+            if prefix is None:
+                raise ValueError(f'Q filters cannot be applied through {path!r}, which is not a relation')
+            for q_filter in q_filters:
+                q |= _prefix_q(q_filter(self._user), prefix)
+        if id_filter_results:
+            q |= self._get_id_filter_q(id_filter_results, path)
+        return q
+
+    def _get_id_filter_q(self, id_filter_results, path='id'):
+        """
+        Builds a Q object for the union of the ids returned by the id filters. Id filters that return
+        unevaluated querysets are kept lazy and become subqueries, so the database does the work
+        instead of the ids being loaded and sent back in a large list.
+        """
+        lookup = f'{path}{LOOKUP_SEP}in'
+        q = Q()
+        ids = set()
+        for level_ids in id_filter_results:
+            if isinstance(level_ids, QuerySet) and level_ids._result_cache is None:
+                q |= Q(**{lookup: level_ids})
+            else:
+                ids.update(level_ids)
+
+        # Materialized ids are combined into one list, which also handles the case of no ids at all
+        if ids or not q:
+            q |= Q(**{lookup: ids})
+        return q
@@ -0,0 +1,61 @@
+from django.conf import settings
+
+
+def is_enabled():
+    """
+    Returns true if effective permissions are materialized and read with the
+    RESTRAINT_EFFECTIVE_PERMS setting.
+    """
+    return getattr(settings, 'RESTRAINT_EFFECTIVE_PERMS', False)
+
+
+def perm_levels_changed(sender, instance, action, reverse, **kwargs):
+    """
+    Refreshes the effective permissions of the users affected by a change to the levels of a
+    PermAccess. This is connected to the m2m_changed signal of PermAccess.perm_levels.
+    """
+    from restraint.models import EffectivePermLevel
+
+    if action not in ('post_add', 'post_remove', 'post_clear') or not is_enabled():
+        return
+
+    if reverse:
+        # The levels were changed from the PermLevel side so any user could be affected
+        EffectivePermLevel.objects.refresh_all()
+    elif instance.perm_set_id is not None:
+        EffectivePermLevel.objects.refresh_perm_sets([instance.perm_set_id])
+    else:
+        EffectivePermLevel.objects.refresh_user_ids([(instance.perm_user_type_id, instance.perm_user_id)])
+
+
+def perm_set_deleting(sender, instance, **kwargs):
+    """
+    Remembers the users of a perm set that is about to be deleted, since their memberships are
+    deleted along with it.
+    """
+    from restraint.models import EffectivePermSet
+
+    if is_enabled():
+        instance._effective_perm_user_ids = set(EffectivePermSet.objects.filter(
+            perm_set=instance
+        ).values_list('perm_user_type_id', 'perm_user_id'))
+
+
+def perm_set_deleted(sender, instance, **kwargs):
+    """
+    Refreshes the effective permissions of the users of a deleted perm set.
+    """
+    from restraint.models import EffectivePermLevel
+
+    if is_enabled():
+        EffectivePermLevel.objects.refresh_user_ids(getattr(instance, '_effective_perm_user_ids', []))
+
+
+def refresh_all(sender, **kwargs):
+    """
+    Refreshes the effective permissions of every materialized user after the restraint db is updated.
+    """
+    from restraint.models import EffectivePermLevel
+
+    if is_enabled():
+        EffectivePermLevel.objects.refresh_all()
@@ -0,0 +1,74 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+
+# The thread pool shared by every Restraint object, created the first time it is needed
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_max_workers():
+    """
+    Returns the number of threads used to call id filters concurrently, set with the
+    RESTRAINT_ID_FILTER_THREADS setting. Id filters are called serially when it is 0, the default.
+    """
+    return getattr(settings, 'RESTRAINT_ID_FILTER_THREADS', 0)
+
+
+def get_min_calls():
+    """
+    Returns the number of id filters a queryset must be filtered by before they are called concurrently,
+    set with the RESTRAINT_ID_FILTER_THREADS_MIN_LEVELS setting.
+    """
+    return max(getattr(settings, 'RESTRAINT_ID_FILTER_THREADS_MIN_LEVELS', 2), 2)
+
+
+def is_concurrent(num_calls):
+    """
+    Returns true if a number of id filter calls should run in the thread pool. Calls made inside a
+    transaction are always serial, since the connections of other threads cannot see its changes.
+    """
+    if get_max_workers() <= 0 or num_calls < get_min_calls():
+        return False
+    return not transaction.get_connection().in_atomic_block
+
+
+def get_executor():
+    """
+    Returns the thread pool, creating it again if the number of threads has changed.
+    """
+    global _executor
+    max_workers = get_max_workers()
+    with _executor_lock:
+        if _executor is None or _executor._max_workers != max_workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='restraint')
+        return _executor
+
+
+def _call_in_thread(func, args):
+    """
+    Calls a function in a pool thread. Each thread uses its own database connection, which is closed
+    around the call the same way Django closes connections around requests.
+    """
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def map_calls(func, args_list):
+    """
+    Calls the function with each tuple of arguments and returns the results in order. The calls run in
+    the thread pool when enabled, and serially otherwise.
+    """
+    args_list = list(args_list)
+    if not is_concurrent(len(args_list)):
+        return [func(*args) for args in args_list]
+    return list(get_executor().map(_call_in_thread, repeat(func), args_list))
@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Sized
+from contextlib import contextmanager
+
+from django.db import connection
+
+from restraint import signals
+
+
+# The upper bound of the first bucket of duration histograms in seconds. Each bucket doubles the bound
+HISTOGRAM_MIN_DURATION = 0.000001
+
+
+class QueryCounter(object):
+    """
+    A database execute wrapper that counts the queries it sees.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def instrument(signal, count_queries=True, **kwargs):
+    """
+    Times the block and sends the signal with its duration, the number of queries it ran and the keyword
+    arguments. The block can add arguments that are only known after the work is done to the yielded
+    dictionary. Nothing is measured when the signal has no receivers.
+    """
+    if not signal.has_listeners():
+        yield {}
+        return
+
+    counter = QueryCounter()
+    start = time.perf_counter()
+    if count_queries:
+        with connection.execute_wrapper(counter):
+            yield kwargs
+    else:
+        yield kwargs
+    signal.send(
+        sender=None,
+        duration=time.perf_counter() - start,
+        queries=counter.count if count_queries else None,
+        **kwargs
+    )
+
+
+def get_num_ids(ids):
+    """
+    Returns the number of ids returned by an id filter, or None for an unevaluated queryset or an
+    iterable without a length, such as a generator, which is left for filter_qset to consume.
+    """
+    if not isinstance(ids, Sized) or getattr(ids, '_result_cache', ()) is None:
+        return None
+    return len(ids)
+
+
+class Histogram(object):
+    """
+    A histogram of durations with buckets that double in size, used to estimate percentiles without
+    keeping every duration.
+    """
+    def __init__(self):
+        self.buckets = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        bucket = max(0, math.ceil(math.log2(duration / HISTOGRAM_MIN_DURATION))) if duration > 0 else 0
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, percent):
+        """
+        Returns the upper bound of the bucket that holds the percentile, capped by the largest duration.
+        """
+        rank = self.count * percent / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(HISTOGRAM_MIN_DURATION * 2 ** bucket, self.max)
+        return self.max
+
+
+class Aggregator(object):
+    """
+    Collects the instrumentation signals in process. Durations are kept in a histogram for each event,
+    keyed on the event name and, where they apply, the perm and level or the update phase, so that slow
+    id filters can be found without an external APM.
+
+        aggregator = Aggregator()
+        aggregator.connect()
+        ...
+        aggregator.get_stats()[('id_filter', 'can_edit_stuff', 'some_stuff')]['p99']
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def connect(self):
+        for signal, receiver in self._get_receivers():
+            signal.connect(receiver, weak=False, dispatch_uid=(id(self), signal))
+
+    def disconnect(self):
+        for signal, receiver in self._get_receivers():
+            signal.disconnect(dispatch_uid=(id(self), signal))
+
+    def reset(self):
+        with self._lock:
+            self._histograms = defaultdict(Histogram)
+            self._queries = defaultdict(int)
+            self._ids = defaultdict(int)
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+    def get_stats(self):
+        """
+        Returns a dictionary of event keys mapped to the number of events, their total and maximum
+        durations, their 50th, 90th and 99th percentile durations, and the total number of queries and
+        ids they returned.
+        """
+        with self._lock:
+            return {
+                key: {
+                    'count': histogram.count,
+                    'total': histogram.total,
+                    'max': histogram.max,
+                    'p50': histogram.percentile(50),
+                    'p90': histogram.percentile(90),
+                    'p99': histogram.percentile(99),
+                    'queries': self._queries[key],
+                    'ids': self._ids[key],
+                }
+                for key, histogram in self._histograms.items()
+            }
+
+    def _get_receivers(self):
+        return [
+            (signals.perms_loaded, self._perms_loaded),
+            (signals.perm_set_cache_read, self._perm_set_cache_read),
+            (signals.id_filter_called, self._id_filter_called),
+            (signals.qset_filtered, self._qset_filtered),
+            (signals.perm_checkers_called, self._perm_checkers_called),
+            (signals.restraint_db_update_phase, self._restraint_db_update_phase),
+        ]
+
+    def _add(self, key, duration, queries, num_ids=None):
+        with self._lock:
+            self._histograms[key].add(duration)
+            self._queries[key] += queries or 0
+            self._ids[key] += num_ids or 0
+
+    def _perms_loaded(self, duration, queries, **kwargs):
+        self._add(('perms_loaded',), duration, queries)
+
+    def _perm_set_cache_read(self, duration, queries, hits, misses, **kwargs):
+        self._add(('perm_set_cache_read',), duration, queries)
+        with self._lock:
+            self.cache_hits += hits
+            self.cache_misses += misses
+
+    def _id_filter_called(self, duration, queries, perm, level, num_ids, **kwargs):
+        self._add(('id_filter', perm, level), duration, queries, num_ids)
+
+    def _qset_filtered(self, duration, queries, perm, **kwargs):
+        self._add(('filter_qset', perm), duration, queries)
+
+    def _perm_checkers_called(self, duration, queries, **kwargs):
+        self._add(('perm_checkers',), duration, queries)
+
+    def _restraint_db_update_phase(self, duration, queries, phase, **kwargs):
+        self._add(('update_restraint_db', phase), duration, queries)
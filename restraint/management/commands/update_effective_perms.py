@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from restraint.models import EffectivePermLevel
+
+
+class Command(BaseCommand):
+    """
+    A management command for materializing the effective permissions of every user of a model.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            dest='model',
+            default=settings.AUTH_USER_MODEL,
+            help='The app_label.ModelName of the users to materialize. Defaults to the user model'
+        )
+        parser.add_argument(
+            '--chunk_size',
+            type=int,
+            dest='chunk_size',
+            default=1000,
+            help='The number of users to materialize at a time'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Walks the users in primary key order and materializes their permissions one chunk at a time.
+        """
+        model = apps.get_model(options['model'])
+        last_pk = None
+        while True:
+            users = model.objects.order_by('pk')
+            if last_pk is not None:
+                users = users.filter(pk__gt=last_pk)
+            users = list(users[:options['chunk_size']])
+            if not users:
+                break
+
+            EffectivePermLevel.objects.refresh_users(users)
+            last_pk = users[-1].pk
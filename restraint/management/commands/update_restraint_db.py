@@ -16,9 +16,16 @@ class Command(BaseCommand):
             default=False,
             help='Flush all permission sets before updating'
         )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Update even if the config has not changed since the last update'
+        )
 
     def handle(self, *args, **options):
         """
         Runs the command to update the restraint db.
         """
-        update_restraint_db(flush_default_access=options['flush_default_access'])
+        update_restraint_db(flush_default_access=options['flush_default_access'], force=options['force'])
@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from restraint import cache
+
+
+def get_chunks(model, chunk_size, start_after=None):
+    """
+    Walks the primary keys of a model in order, a chunk at a time, starting after a primary key.
+    """
+    last_pk = start_after
+    while True:
+        pks = model.objects.order_by('pk')
+        if last_pk is not None:
+            pks = pks.filter(pk__gt=last_pk)
+        pks = list(pks.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def init_worker():
+    """
+    Sets up Django in worker processes that were not forked from a process where it was set up.
+    """
+    if not apps.ready:  # pragma: no cover
+        django.setup()
+
+
+def warm_chunk(args):
+    """
+    Warms the cache for a chunk of users, given the model label, primary keys, perms, perm sets and
+    whether to memoize id filters. Returns the number of users in the chunk, the number that were
+    warmed and the last primary key of the chunk.
+    """
+    model_label, pks, which_perms, perm_set_names, id_filters = args
+    users = apps.get_model(model_label).objects.filter(pk__in=pks).order_by('pk')
+    return len(pks), cache.warm_users(users, which_perms, perm_set_names, id_filters), pks[-1]
+
+
+class Command(BaseCommand):
+    """
+    A management command for warming the restraint cache for every user of a model.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            dest='model',
+            default=settings.AUTH_USER_MODEL,
+            help='The app_label.ModelName of the users to warm. Defaults to the user model'
+        )
+        parser.add_argument(
+            '--chunk_size',
+            type=int,
+            dest='chunk_size',
+            default=1000,
+            help='The number of users each worker warms at a time'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            dest='processes',
+            default=os.cpu_count(),
+            help='The number of worker processes. The users are warmed in this process when it is 0'
+        )
+        parser.add_argument(
+            '--start_after',
+            dest='start_after',
+            default=None,
+            help='Resume after the user with this primary key'
+        )
+        parser.add_argument(
+            '--perm_sets',
+            nargs='+',
+            dest='perm_sets',
+            default=None,
+            help='Only warm users in these perm sets'
+        )
+        parser.add_argument(
+            '--perms',
+            nargs='+',
+            dest='perms',
+            default=None,
+            help='Only warm these perms'
+        )
+        parser.add_argument(
+            '--id_filters',
+            action='store_true',
+            dest='id_filters',
+            default=False,
+            help='Also memoize the results of id filters of levels with a cache_key'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Walks the users in primary key order and warms them a chunk at a time, reporting the progress
+        after each chunk. The chunks are reported in order, so the last reported primary key can be
+        passed to --start_after to resume.
+        """
+        if cache.get_cache() is None:
+            raise CommandError('Set RESTRAINT_CACHE to warm the restraint cache')
+        if options['processes'] > 0 and isinstance(cache.get_cache(), LocMemCache):
+            # Each worker would only warm its own memory, which is discarded when the pool exits
+            raise CommandError('RESTRAINT_CACHE must be shared between processes to warm it with worker processes')
+
+        model = apps.get_model(options['model'])
+        chunk_args = (
+            (options['model'], pks, options['perms'], options['perm_sets'], options['id_filters'])
+            for pks in get_chunks(model, options['chunk_size'], options['start_after'])
+        )
+
+        start = time.perf_counter()
+        num_users = num_warmed = 0
+        if options['processes'] > 0:
+            # Close the connections of this process so that each forked worker opens its own
+            connections.close_all()
+            with multiprocessing.Pool(options['processes'], initializer=init_worker) as pool:
+                # Chunks are read in this thread and a few per worker are queued at a time. Results are
+                # reported in the order of the chunks
+                pending = deque()
+                for args in chunk_args:
+                    pending.append(pool.apply_async(warm_chunk, (args,)))
+                    if len(pending) >= options['processes'] * 2:
+                        num_users, num_warmed = self._report(pending.popleft().get(), num_users, num_warmed, start)
+                while pending:
+                    num_users, num_warmed = self._report(pending.popleft().get(), num_users, num_warmed, start)
+        else:
+            for args in chunk_args:
+                num_users, num_warmed = self._report(warm_chunk(args), num_users, num_warmed, start)
+
+        self.stdout.write(f'Warmed {num_warmed} of {num_users} users in {time.perf_counter() - start:.1f}s')
+
+    def _report(self, result, num_users, num_warmed, start):
+        chunk_users, chunk_warmed, last_pk = result
+        num_users += chunk_users
+        num_warmed += chunk_warmed
+        self.stdout.write(
+            f'Warmed {num_warmed} of {num_users} users through pk {last_pk} '
+            f'({num_users / (time.perf_counter() - start):.0f} users/s)'
+        )
+        return num_users, num_warmed
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from restraint.snapshot import get_path, write_snapshot
+
+
+class Command(BaseCommand):
+    """
+    A management command for writing a snapshot of the perm set access that workers load at startup.
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output',
+            dest='output',
+            default=None,
+            help='The file to write the snapshot to. Defaults to the RESTRAINT_SNAPSHOT setting'
+        )
+
+    def handle(self, *args, **options):
+        """
+        Writes the snapshot.
+        """
+        path = options['output'] or get_path()
+        if not path:
+            raise CommandError('Pass --output or set RESTRAINT_SNAPSHOT')
+        write_snapshot(path)
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 from django.contrib.contenttypes.models import ContentType
 from django.db import models, transaction
 from manager_utils import sync
@@ -117,10 +119,14 @@ class PermAccessManager(models.Manager):
         else:
             permission_access.perm_levels.clear()
 
-    def update_perm_set_access(self, config, new_perms=None, flush_previous_config=False):
+    def update_perm_set_access(self, config, new_perms=None, flush_previous_config=False, refresh_effective_perms=True):
         """
         Update the access for private perm sets with a config. The user can optionally flush
         the previous config and set it to the new one.
+
+        This runs a fixed number of queries no matter how many perm sets and perms are configured.
+        The materialized effective permissions of the users of changed perm sets are refreshed unless
+        refresh_effective_perms is false, such as when every user is refreshed afterwards anyway.
         """
 
         # Do model imports to avoid circular
@@ -129,23 +135,160 @@ class PermAccessManager(models.Manager):
         # Ensure that new perms is not none
         if new_perms is None:  # pragma: no cover
             new_perms = []
+        new_perm_names = {p.name for p in new_perms}
+
+        # Get the access of each private permission set, creating the missing ones
+        perm_sets = list(PermSet.objects.filter(is_private=True))
+        perm_accesses = {}
+        for perm_access in PermAccess.objects.filter(perm_set__in=perm_sets).order_by('-id'):
+            perm_accesses[perm_access.perm_set_id] = perm_access
+        created_perm_accesses = PermAccess.objects.bulk_create([
+            PermAccess(perm_set=perm_set)
+            for perm_set in perm_sets
+            if perm_set.id not in perm_accesses
+        ])
+        created_perm_set_ids = {perm_access.perm_set_id for perm_access in created_perm_accesses}
+        perm_accesses.update({perm_access.perm_set_id: perm_access for perm_access in created_perm_accesses})
+
+        # Index the levels by perm name and level name
+        level_ids = {
+            (perm_name, level_name): level_id
+            for level_id, perm_name, level_name in PermLevel.objects.values_list('id', 'perm__name', 'name')
+        }
 
-        # Loop over each private permission set
-        for perm_set in PermSet.objects.filter(is_private=True):
-            perm_access, created = PermAccess.objects.get_or_create(perm_set=perm_set)
-            perm_access_levels = []
+        # Build the levels of each perm access from the config
+        config_levels = set()
+        for perm_set in perm_sets:
+            created = perm_set.id in created_perm_set_ids
             for perm, perm_levels in config.get(perm_set.name, {}).items():
                 # If we are not flushing the previous config, continue if the perm not among the newly created perms
                 # this is necessary because perm access is mutable; We don't want to destroy modifications made to
                 # existing permissions
-                if not created and not flush_previous_config and perm not in [p.name for p in new_perms]:
+                if not created and not flush_previous_config and perm not in new_perm_names:
                     continue
                 assert perm_levels
-                perm_access_levels.extend(PermLevel.objects.filter(perm__name=perm, name__in=perm_levels))
+                config_levels.update(
+                    (perm_accesses[perm_set.id].id, level_ids[(perm, level)])
+                    for level in perm_levels
+                    if (perm, level) in level_ids
+                )
+
+        # Diff the config against the levels in the through table
+        through_model = PermAccess.perm_levels.through
+        current_levels = {
+            (perm_access_id, level_id): through_id
+            for through_id, perm_access_id, level_id in through_model.objects.filter(
+                permaccess_id__in=[perm_access.id for perm_access in perm_accesses.values()]
+            ).values_list('id', 'permaccess_id', 'permlevel_id')
+        }
+        added_levels = config_levels - set(current_levels)
+        removed_levels = set(current_levels) - config_levels if flush_previous_config else set()
+
+        if removed_levels:
+            through_model.objects.filter(id__in=[current_levels[level] for level in removed_levels]).delete()
+        if added_levels:
+            through_model.objects.bulk_create([
+                through_model(permaccess_id=perm_access_id, permlevel_id=level_id)
+                for perm_access_id, level_id in added_levels
+            ])
+
+        # Bulk writes to the through table do not send m2m_changed
+        changed_perm_access_ids = {perm_access_id for perm_access_id, level_id in added_levels | removed_levels}
+        self._perm_levels_changed(perm_sets=[
+            perm_set
+            for perm_set in perm_sets
+            if perm_accesses[perm_set.id].id in changed_perm_access_ids
+        ], refresh_effective_perms=refresh_effective_perms)
+
+    def _perm_levels_changed(self, perm_sets=(), perm_user_ids=(), refresh_effective_perms=True):
+        """
+        Invalidates the cached, snapshotted and materialized permissions that depend on the levels of perm
+        sets or of the individual access of (content type id, user id) pairs after the through table of
+        PermAccess.perm_levels was written in bulk. The materialized permissions are left alone if
+        refresh_effective_perms is false.
+        """
+        from restraint import cache, effective_perms, snapshot, versioning
+        from restraint.models import EffectivePermLevel
+
+        if perm_sets or perm_user_ids:
+            versioning.bump_version()
+        if perm_sets:
+            cache.invalidate_perm_sets([perm_set.name for perm_set in perm_sets])
+            snapshot.bump_version()
+        if perm_user_ids and cache.get_cache() is not None:
+            cache.invalidate_individual_access([
+                cache._get_perm_user_key(perm_user_type_id, perm_user_id)
+                for perm_user_type_id, perm_user_id in perm_user_ids
+            ])
+        if refresh_effective_perms and effective_perms.is_enabled():
+            if perm_sets:
+                EffectivePermLevel.objects.refresh_perm_sets([perm_set.id for perm_set in perm_sets])
+            if perm_user_ids:
+                EffectivePermLevel.objects.refresh_user_ids(perm_user_ids)
+
+    def _get_individual_access_levels(self, user_levels, create):
+        """
+        Given (user, perm name, level name) tuples, returns the set of (perm access id, level id) pairs and
+        the set of (content type id, user id) pairs of the users. Missing individual perm access is created
+        if create is true and skipped otherwise.
+        """
+        from restraint.models import PermAccess, PermLevel
+
+        user_levels = list(user_levels)
+        content_types = ContentType.objects.get_for_models(*{type(user) for user, _, _ in user_levels})
+        user_levels = [
+            ((content_types[type(user)].id, user.id), (perm_name, level_name))
+            for user, perm_name, level_name in user_levels
+        ]
+        if not user_levels:
+            return set(), set()
 
-            if flush_previous_config:
-                perm_access.perm_levels.clear()
-            perm_access.perm_levels.add(*perm_access_levels)
+        # Look up every level at once, failing like PermLevel.objects.get for levels that do not exist
+        perm_level_names = {perm_level for _, perm_level in user_levels}
+        level_ids = {
+            (perm_name, level_name): level_id
+            for level_id, perm_name, level_name in PermLevel.objects.filter(
+                perm__name__in={perm_name for perm_name, _ in perm_level_names},
+                name__in={level_name for _, level_name in perm_level_names}
+            ).values_list('id', 'perm__name', 'name')
+        }
+        missing_levels = perm_level_names - set(level_ids)
+        if missing_levels:
+            raise PermLevel.DoesNotExist(f'Perm levels do not exist: {sorted(missing_levels)}')
+
+        # Get the individual perm access of the users grouped by content type
+        user_ids = defaultdict(set)
+        for (content_type_id, user_id), _ in user_levels:
+            user_ids[content_type_id].add(user_id)
+        perm_access_filter = models.Q()
+        for content_type_id, ids in user_ids.items():
+            perm_access_filter |= models.Q(perm_user_type_id=content_type_id, perm_user_id__in=ids)
+        perm_access_ids = {
+            (content_type_id, user_id): perm_access_id
+            for perm_access_id, content_type_id, user_id in PermAccess.objects.filter(
+                perm_access_filter
+            ).values_list('id', 'perm_user_type_id', 'perm_user_id')
+        }
+        if create:
+            perm_access_ids.update({
+                (perm_access.perm_user_type_id, perm_access.perm_user_id): perm_access.id
+                for perm_access in PermAccess.objects.bulk_create([
+                    PermAccess(perm_user_type_id=content_type_id, perm_user_id=user_id)
+                    for content_type_id, ids in user_ids.items()
+                    for user_id in ids
+                    if (content_type_id, user_id) not in perm_access_ids
+                ])
+            })
+
+        return {
+            (perm_access_ids[user_key], level_ids[perm_level])
+            for user_key, perm_level in user_levels
+            if user_key in perm_access_ids
+        }, {
+            user_key
+            for user_key, _ in user_levels
+            if user_key in perm_access_ids
+        }
 
     def add_individual_access(self, user, perm_name, level_name):
         """
@@ -177,6 +320,45 @@ class PermAccessManager(models.Manager):
             name=level_name
         ))
 
+    @transaction.atomic
+    def bulk_add_individual_access(self, user_levels):
+        """
+        Given (user, permission name, level name) tuples, add the levels in the permission access of the
+        individual users. This runs a handful of queries no matter how many users are given.
+        """
+        from restraint.models import PermAccess
+        access_levels, perm_user_ids = self._get_individual_access_levels(user_levels, create=True)
+        through_model = PermAccess.perm_levels.through
+        through_model.objects.bulk_create([
+            through_model(permaccess_id=perm_access_id, permlevel_id=level_id)
+            for perm_access_id, level_id in access_levels
+        ], ignore_conflicts=True)
+
+        # Bulk writes to the through table do not send m2m_changed
+        self._perm_levels_changed(perm_user_ids=perm_user_ids)
+
+    @transaction.atomic
+    def bulk_remove_individual_access(self, user_levels):
+        """
+        Given (user, permission name, level name) tuples, remove the levels in the permission access of the
+        individual users. Users without individual permission access are ignored.
+        """
+        from restraint.models import PermAccess
+        access_levels, perm_user_ids = self._get_individual_access_levels(user_levels, create=False)
+
+        # Group the perm access by level so that the delete has one condition per level
+        perm_access_ids = defaultdict(set)
+        for perm_access_id, level_id in access_levels:
+            perm_access_ids[level_id].add(perm_access_id)
+        through_filter = models.Q()
+        for level_id, ids in perm_access_ids.items():
+            through_filter |= models.Q(permlevel_id=level_id, permaccess_id__in=ids)
+        if through_filter:
+            PermAccess.perm_levels.through.objects.filter(through_filter).delete()
+
+        # Bulk writes to the through table do not send m2m_changed
+        self._perm_levels_changed(perm_user_ids=perm_user_ids)
+
     @transaction.atomic
     def assign_default_permissions_from_permission_set(self, to_permission_set, from_permission_set):
         """
@@ -198,3 +380,87 @@ class PermAccessManager(models.Manager):
 
         # Use the same levels as the from access
         to_permission_set_access.perm_levels.set(from_permission_set_access.perm_levels.all())
+
+
+class EffectivePermLevelManager(models.Manager):
+    def refresh_users(self, users):
+        """
+        Recomputes the materialized perm sets and levels of the users from their perm sets and their
+        individual access.
+        """
+        from restraint.core import Restraint
+        from restraint.models import EffectivePermSet, PermLevel, PermSet
+
+        restraints = Restraint.for_users(users)
+        if not restraints:
+            return
+
+        config = restraints[0]._config
+        perm_level_ids = {
+            (perm_name, level_name): perm_level_id
+            for perm_level_id, perm_name, level_name in PermLevel.objects.values_list('id', 'perm__name', 'name')
+        }
+        perm_set_ids = dict(PermSet.objects.values_list('name', 'id'))
+
+        user_ids = defaultdict(list)
+        effective_perm_sets = []
+        effective_perm_levels = []
+        for restraint in restraints:
+            user = restraint._user
+            perm_user_type = ContentType.objects.get_for_model(user)
+            user_ids[perm_user_type].append(user.id)
+            effective_perm_sets.extend(
+                EffectivePermSet(perm_user_type=perm_user_type, perm_user_id=user.id, perm_set_id=perm_set_ids[name])
+                for name in set(config.perm_set_getter(user))
+                if name in perm_set_ids
+            )
+            # The row without a level marks the user as materialized even if they have no levels
+            effective_perm_levels.append(self.model(perm_user_type=perm_user_type, perm_user_id=user.id))
+            effective_perm_levels.extend(
+                self.model(
+                    perm_user_type=perm_user_type,
+                    perm_user_id=user.id,
+                    perm_level_id=perm_level_ids[perm_level]
+                )
+                for perm_level in config.get_perm_levels(restraint.perm_mask)
+            )
+
+        with transaction.atomic():
+            for perm_user_type, ids in user_ids.items():
+                EffectivePermSet.objects.filter(perm_user_type=perm_user_type, perm_user_id__in=ids).delete()
+                self.filter(perm_user_type=perm_user_type, perm_user_id__in=ids).delete()
+            EffectivePermSet.objects.bulk_create(effective_perm_sets)
+            self.bulk_create(effective_perm_levels)
+
+    def refresh_user_ids(self, user_ids, chunk_size=1000):
+        """
+        Recomputes the materialized perm sets and levels of users given (content type id, user id)
+        pairs, loading the users in chunks.
+        """
+        ids_by_type = defaultdict(list)
+        for perm_user_type_id, perm_user_id in user_ids:
+            ids_by_type[perm_user_type_id].append(perm_user_id)
+
+        for perm_user_type_id, ids in ids_by_type.items():
+            model = ContentType.objects.get_for_id(perm_user_type_id).model_class()
+            ids = sorted(ids)
+            for i in range(0, len(ids), chunk_size):
+                self.refresh_users(model.objects.filter(id__in=ids[i:i + chunk_size]))
+
+    def refresh_perm_sets(self, perm_set_ids):
+        """
+        Recomputes the materialized permissions of the users that belong to the perm sets.
+        """
+        from restraint.models import EffectivePermSet
+        self.refresh_user_ids(set(EffectivePermSet.objects.filter(
+            perm_set_id__in=perm_set_ids
+        ).values_list('perm_user_type_id', 'perm_user_id')))
+
+    def refresh_all(self):
+        """
+        Recomputes the materialized permissions of every user that has been materialized.
+        """
+        from restraint.models import EffectivePermSet
+        user_ids = set(EffectivePermSet.objects.values_list('perm_user_type_id', 'perm_user_id'))
+        user_ids.update(self.values_list('perm_user_type_id', 'perm_user_id'))
+        self.refresh_user_ids(user_ids)
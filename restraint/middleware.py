@@ -0,0 +1,52 @@
+try:
+    from asgiref.sync import iscoroutinefunction
+except ImportError:  # pragma: no cover
+    from asyncio import iscoroutinefunction
+
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.functional import SimpleLazyObject
+
+from restraint import versioning
+from restraint.core import Restraint
+
+
+def get_restraint(request, which_perms=None):
+    """
+    Returns the Restraint object of the request's user, creating it the first time it is requested.
+    Later calls for the same user reuse the object and only load the permissions that were not
+    loaded by earlier calls.
+
+    :type request: HttpRequest
+    :param request: The request of the user
+
+    :type which_perms: list
+    :param which_perms: The permissions to be loaded for the user, or all permissions if None.
+    """
+    restraint = getattr(request, '_restraint', None)
+    if restraint is None or restraint._user is not request.user:
+        restraint = Restraint(request.user, which_perms)
+        request._restraint = restraint
+    else:
+        restraint.load_perms(which_perms)
+    return restraint
+
+
+@sync_and_async_middleware
+def RestraintMiddleware(get_response):
+    """
+    Attaches a lazily created Restraint object for the user to each request as request.restraint.
+    The object is shared with get_restraint, so permissions are loaded at most once per request. The
+    restraint version is checked at the start of each request when the check interval is 0, with the
+    async ORM when the middleware runs in an async stack.
+    """
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            await versioning.acheck_version(per_request=True)
+            request.restraint = SimpleLazyObject(lambda: get_restraint(request))
+            return await get_response(request)
+    else:
+        def middleware(request):
+            versioning.check_version(per_request=True)
+            request.restraint = SimpleLazyObject(lambda: get_restraint(request))
+            return get_response(request)
+    return middleware
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('restraint', '0003_auto_20230301_0109'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePermLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('perm_user_id', models.PositiveIntegerField()),
+                ('perm_level', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='restraint.permlevel')),
+                ('perm_user_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('perm_user_type', 'perm_user_id', 'perm_level')},
+            },
+        ),
+        migrations.CreateModel(
+            name='EffectivePermSet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('perm_user_id', models.PositiveIntegerField()),
+                ('perm_set', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='restraint.permset')),
+                ('perm_user_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'unique_together': {('perm_user_type', 'perm_user_id', 'perm_set')},
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restraint', '0004_effective_perms'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestraintMetadata',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=256, unique=True)),
+                ('value', models.TextField(blank=True)),
+            ],
+        ),
+    ]
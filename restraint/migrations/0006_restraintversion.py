@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    apps.get_model('restraint', 'RestraintVersion').objects.create()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restraint', '0005_restraintmetadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestraintVersion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
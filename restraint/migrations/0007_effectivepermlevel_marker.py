@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restraint', '0006_restraintversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='effectivepermlevel',
+            name='perm_level',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='restraint.permlevel'),
+        ),
+    ]
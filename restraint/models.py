@@ -1,7 +1,9 @@
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
-from restraint.managers import PermSetManager, PermManager, PermLevelManager, PermAccessManager
+from restraint.managers import (
+    PermSetManager, PermManager, PermLevelManager, PermAccessManager, EffectivePermLevelManager
+)
 
 
 class PermSet(models.Model):
@@ -139,3 +141,81 @@ class PermAccess(models.Model):
 
     def __str__(self):  # pragma: no cover
         return f'[PERM_SET]{self.perm_set}[USER_TYPE]{self.perm_user_type}[USER_ID]{self.perm_user_id}'
+
+
+class RestraintMetadata(models.Model):
+    """
+    A small store of named values that restraint uses to keep track of the state of the database,
+    such as the fingerprint of the config that was last synced.
+
+    Fields:
+     - Name
+     - Value
+    """
+    name = models.CharField(max_length=256, unique=True)
+    value = models.TextField(blank=True)
+
+    def __str__(self):  # pragma: no cover
+        return f'{self.name}:{self.value}'
+
+
+class RestraintVersion(models.Model):
+    """
+    A single row counter that is incremented in the same transaction as every change to perm sets, perms,
+    levels and access, so that processes can tell when their in-process caches are stale.
+
+    Fields:
+     - Version
+    """
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):  # pragma: no cover
+        return str(self.version)
+
+
+class EffectivePermSet(models.Model):
+    """
+    The perm sets an individual user belonged to when their effective permissions were last
+    materialized. This is used to find the users whose effective permissions change when the
+    access of a perm set changes.
+
+    Fields:
+     - Perm_user_type (ContentType, Generic Foreign Key)
+     - Perm_user_id (id of the object associated with the content type)
+     - Perm_set (Foreign Key)
+    """
+    perm_user_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    perm_user_id = models.PositiveIntegerField()
+    perm_set = models.ForeignKey(PermSet, on_delete=models.CASCADE)
+
+    class Meta:
+        unique_together = ('perm_user_type', 'perm_user_id', 'perm_set')
+
+    def __str__(self):  # pragma: no cover
+        return f'[PERM_SET]{self.perm_set}[USER_TYPE]{self.perm_user_type}[USER_ID]{self.perm_user_id}'
+
+
+class EffectivePermLevel(models.Model):
+    """
+    A materialized level that an individual user has access to, either through one of their perm
+    sets or through their individual access. When the RESTRAINT_EFFECTIVE_PERMS setting is enabled,
+    the permissions of a user are read from this table with a single indexed lookup. Every materialized
+    user also has a row without a perm level, so that a user without any levels is still known to be
+    materialized.
+
+    Fields:
+     - Perm_user_type (ContentType, Generic Foreign Key)
+     - Perm_user_id (id of the object associated with the content type)
+     - Perm_level (Foreign Key, null for the row that marks the user as materialized)
+    """
+    perm_user_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    perm_user_id = models.PositiveIntegerField()
+    perm_level = models.ForeignKey(PermLevel, null=True, on_delete=models.CASCADE)
+
+    objects = EffectivePermLevelManager()
+
+    class Meta:
+        unique_together = ('perm_user_type', 'perm_user_id', 'perm_level')
+
+    def __str__(self):  # pragma: no cover
+        return f'[PERM_LEVEL]{self.perm_level}[USER_TYPE]{self.perm_user_type}[USER_ID]{self.perm_user_id}'
@@ -3,3 +3,30 @@ from django.dispatch import Signal
 
 # Fires when the restraint database is updated
 restraint_db_updated = Signal()
+
+# Fires when a process finds that the restraint version in the database changed since it last checked it,
+# so that its in-process caches may be stale
+restraint_version_changed = Signal()
+
+# The instrumentation signals below are only sent when they have receivers. Each one is sent with the
+# duration of the work in seconds and the number of queries it ran, or None when queries are not counted
+# because they run in other threads with the async ORM.
+
+# Fires after the permissions of users are loaded, with the number of users and which perms were loaded
+perms_loaded = Signal()
+
+# Fires after the perm set cache is read, with the number of perm sets that were hits and misses
+perm_set_cache_read = Signal()
+
+# Fires after an id filter is called, with the perm, the level and the number of ids it returned, or None
+# if it returned an unevaluated queryset that is used as a subquery
+id_filter_called = Signal()
+
+# Fires after a queryset is filtered, with the perm it was filtered by
+qset_filtered = Signal()
+
+# Fires after the custom permission checkers are called, with the (perm, level) pairs and their results
+perm_checkers_called = Signal()
+
+# Fires after each phase of update_restraint_db, with the name of the phase
+restraint_db_update_phase = Signal()
@@ -0,0 +1,155 @@
+import json
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+
+from restraint import cache, constants
+
+
+# The version of the snapshot file format. Snapshots of other formats are ignored when loading
+SNAPSHOT_FORMAT = 1
+
+
+def get_path():
+    """
+    Returns the path of the snapshot file, set with the RESTRAINT_SNAPSHOT setting. The snapshot
+    version is only kept up to date in the database when it is set.
+    """
+    return getattr(settings, 'RESTRAINT_SNAPSHOT', None)
+
+
+def is_enabled():
+    return bool(get_path())
+
+
+def get_version():
+    """
+    Returns the version of the perm set access in the database with a single row read, or None if no
+    snapshot has been written.
+    """
+    from restraint.models import RestraintMetadata
+    return RestraintMetadata.objects.filter(
+        name=constants.SNAPSHOT_VERSION_METADATA_NAME
+    ).values_list('value', flat=True).first()
+
+
+def bump_version():
+    """
+    Changes the version of the perm set access so that snapshots written before the change are stale.
+    The version is only stored once a snapshot has been written, so this is a single update.
+    """
+    from restraint.models import RestraintMetadata
+
+    if is_enabled():
+        RestraintMetadata.objects.filter(
+            name=constants.SNAPSHOT_VERSION_METADATA_NAME
+        ).update(value=uuid.uuid4().hex)
+
+
+def build_snapshot():
+    """
+    Returns the snapshot of the perm sets and the levels of their access as a dictionary that can be
+    serialized to JSON. The version is read before the access, so a change made in between leaves the
+    snapshot stale rather than labelling newer access with an older version.
+    """
+    from restraint.models import PermLevel, PermSet, RestraintMetadata
+
+    version = RestraintMetadata.objects.get_or_create(
+        name=constants.SNAPSHOT_VERSION_METADATA_NAME,
+        defaults={'value': uuid.uuid4().hex}
+    )[0].value
+
+    perm_sets = {name: defaultdict(list) for name in PermSet.objects.values_list('name', flat=True)}
+    perm_set_levels = PermLevel.objects.filter(
+        permaccess__perm_set__isnull=False
+    ).values_list('permaccess__perm_set__name', 'perm__name', 'name').order_by(
+        'permaccess__perm_set__name', 'perm__name', 'name'
+    )
+    for perm_set_name, perm_name, level_name in perm_set_levels:
+        perm_sets[perm_set_name][perm_name].append(level_name)
+
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'perm_sets': perm_sets,
+    }
+
+
+def write_snapshot(path=None):
+    """
+    Writes the snapshot to a file, which defaults to the RESTRAINT_SNAPSHOT setting.
+    """
+    with open(path or get_path(), 'w') as f:
+        json.dump(build_snapshot(), f, separators=(',', ':'), sort_keys=True)
+
+
+def load_snapshot(path=None):
+    """
+    Hydrates the perm set cache from a snapshot file, which defaults to the RESTRAINT_SNAPSHOT setting.
+    This is meant to be called once when a worker starts, so that it reads the permissions of every perm
+    set from the file instead of the database. Returns true if the cache was hydrated, and false if the
+    cache is not enabled or the snapshot is missing, of another format or stale.
+    """
+    perm_set_cache = cache.get_cache()
+    path = path or get_path()
+    if perm_set_cache is None or not path:
+        return False
+
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != get_version():
+        return False
+
+    try:
+        perm_set_masks = cache._get_perm_set_masks(snapshot['perm_sets'], [
+            (perm_set_name, perm_name, level_name)
+            for perm_set_name, perm_set_access in snapshot['perm_sets'].items()
+            for perm_name, level_names in perm_set_access.items()
+            for level_name in level_names
+        ])
+    except KeyError:
+        # The snapshot has levels that are not in the config of this process
+        return False
+
+    perm_set_cache.set_many(
+        {cache.get_perm_set_key(name): mask for name, mask in perm_set_masks.items()},
+        getattr(settings, 'RESTRAINT_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    )
+    return True
+
+
+def perm_levels_changed(sender, instance, action, reverse, **kwargs):
+    """
+    Bumps the snapshot version when the levels of a perm set change. This is connected to the
+    m2m_changed signal of PermAccess.perm_levels.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear') and (reverse or instance.perm_set_id is not None):
+        bump_version()
+
+
+def perm_access_deleted(sender, instance, **kwargs):
+    """
+    Bumps the snapshot version when the PermAccess of a perm set is deleted.
+    """
+    if instance.perm_set_id is not None:
+        bump_version()
+
+
+def perm_set_changed(sender, **kwargs):
+    """
+    Bumps the snapshot version when a PermSet is saved or deleted.
+    """
+    bump_version()
+
+
+def restraint_db_updated(sender, **kwargs):
+    """
+    Bumps the snapshot version after the restraint db is updated.
+    """
+    bump_version()
@@ -0,0 +1,285 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import Mock, patch
+
+from restraint import cache, core
+from restraint.models import PermAccess, PermLevel, PermSet
+import restraint.tests.configuration as test_configuration
+
+
+@override_settings(RESTRAINT_CACHE='default')
+class PermSetCacheTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        caches['default'].clear()
+
+    def load_perms(self, user):
+        # Loaded permissions are cached when the transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return core.Restraint(user).perms
+
+    def test_get_cache_disabled(self):
+        with override_settings(RESTRAINT_CACHE=None):
+            self.assertIsNone(cache.get_cache())
+
+    def test_get_perm_set_masks(self):
+        config = core.get_compiled_restraint_config()
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            perm_set_masks = cache.get_perm_set_masks(['individual', 'staff', 'locked_and_hidden'])
+        self.assertEqual(perm_set_masks, {
+            'individual': config.get_mask([('can_edit_stuff', 'some_stuff')]),
+            'staff': config.get_mask([('can_edit_stuff', 'some_stuff'), ('can_edit_stuff', 'only_superusers')]),
+            'locked_and_hidden': 0,
+        })
+
+        # The perm sets are now read from the cache
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_perm_set_masks(['individual', 'locked_and_hidden']), {
+                'individual': config.get_mask([('can_edit_stuff', 'some_stuff')]),
+                'locked_and_hidden': 0,
+            })
+
+    def test_key_includes_levels_hash(self):
+        levels_hash = core.get_compiled_restraint_config().levels_hash
+        self.assertEqual(
+            cache.get_perm_set_key('individual'),
+            f'restraint:perm_set:{levels_hash}:{cache._local_generation}:individual'
+        )
+
+    def test_restraint_perms_cached(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        self.load_perms(user)
+
+        # Nothing is queried once the perm sets and individual access are cached
+        with self.assertNumQueries(0):
+            perms = self.load_perms(user)
+        self.assertEqual(perms, {
+            'can_edit_stuff': {
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+                'only_superusers': test_configuration.user_only_super_users_id_filter,
+            }
+        })
+
+    def test_restraint_perms_cached_with_individual_access(self):
+        user = G(User, is_superuser=True)
+        PermAccess.objects.add_individual_access(user, 'can_edit_stuff', 'only_superusers')
+        self.assertEqual(core.Restraint(user, ['can_edit_stuff']).perms, {
+            'can_edit_stuff': {
+                'all_stuff': None,
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+                'only_superusers': test_configuration.user_only_super_users_id_filter,
+            }
+        })
+
+    def test_get_individual_masks(self):
+        config = core.get_compiled_restraint_config()
+        user = G(User)
+        other = G(User)
+        PermAccess.objects.add_individual_access(user, 'can_view_stuff', '')
+        user_key = ('auth', 'user', user.id)
+        other_key = ('auth', 'user', other.id)
+
+        with self.assertNumQueries(1), self.captureOnCommitCallbacks(execute=True):
+            individual_masks = cache.get_individual_masks([user, other])
+        self.assertEqual(individual_masks, {user_key: config.get_mask([('can_view_stuff', '')]), other_key: 0})
+
+        # Users without individual access are cached too
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_individual_masks([user, other]), individual_masks)
+        self.assertEqual(
+            cache.get_individual_key(user_key),
+            f'restraint:individual:{config.levels_hash}:{cache._local_generation}:auth.user:{user.id}'
+        )
+
+    def test_individual_access_invalidated(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.load_perms(user)
+
+        PermAccess.objects.add_individual_access(user, 'can_view_stuff', '')
+        self.assertEqual(set(self.load_perms(user)), {'can_edit_stuff', 'can_view_stuff'})
+
+        PermAccess.objects.bulk_add_individual_access([(user, 'can_edit_stuff', 'all_stuff')])
+        self.assertEqual(set(self.load_perms(user)['can_edit_stuff']), {'some_stuff', 'all_stuff'})
+
+        PermAccess.objects.bulk_remove_individual_access([(user, 'can_edit_stuff', 'all_stuff')])
+        self.assertEqual(set(self.load_perms(user)['can_edit_stuff']), {'some_stuff'})
+
+        PermLevel.objects.get(perm__name='can_view_stuff', name='').permaccess_set.clear()
+        self.assertEqual(set(self.load_perms(user)), {'can_edit_stuff'})
+
+        PermAccess.objects.add_individual_access(user, 'can_view_stuff', '')
+        self.load_perms(user)
+        PermAccess.objects.get(perm_user_id=user.id).delete()
+        self.assertEqual(set(self.load_perms(user)), {'can_edit_stuff'})
+
+    def test_access_without_perm_set_or_user(self):
+        user = G(User)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_individual_masks([user])
+        perm_access = G(PermAccess, perm_set=None, perm_user_type=None, perm_user_id=user.id)
+        perm_access.perm_levels.add(PermLevel.objects.get(perm__name='can_view_stuff'))
+        perm_access.delete()
+        self.assertIsNotNone(caches['default'].get(cache.get_individual_key(('auth', 'user', user.id))))
+
+    def test_not_cached_when_rolled_back(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                PermAccess.objects.set_default('individual', 'can_view_stuff', [''])
+                PermAccess.objects.add_individual_access(user, 'can_edit_stuff', 'all_stuff')
+                self.assertEqual(set(core.Restraint(user).perms), {'can_view_stuff', 'can_edit_stuff'})
+                raise RuntimeError
+
+        self.assertEqual(self.load_perms(user), {
+            'can_edit_stuff': {'some_stuff': test_configuration.user_some_stuff_id_filter}
+        })
+
+    def test_invalidated_on_perm_levels_changed(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.assertEqual(set(self.load_perms(user)['can_edit_stuff']), {'some_stuff'})
+
+        PermAccess.objects.set_default('individual', 'can_edit_stuff', ['all_stuff'])
+        self.assertEqual(set(self.load_perms(user)['can_edit_stuff']), {'all_stuff'})
+
+    def test_invalidated_on_reverse_perm_levels_changed(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.load_perms(user)
+
+        PermLevel.objects.get(name='some_stuff').permaccess_set.clear()
+        self.assertEqual(self.load_perms(user), {})
+
+    def test_invalidated_on_perm_set_access_updated(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.load_perms(user)
+
+        PermAccess.objects.update_perm_set_access({'individual': {'can_view_stuff': ['']}}, [], True)
+        self.assertEqual(self.load_perms(user), {'can_view_stuff': {'': None}})
+
+    def test_invalidated_on_perm_access_deleted(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.load_perms(user)
+
+        PermAccess.objects.get(perm_set__name='individual').delete()
+        self.assertEqual(self.load_perms(user), {})
+
+    def test_invalidated_on_perm_set_deleted(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        self.load_perms(user)
+
+        PermSet.objects.get(name='individual').delete()
+        self.assertEqual(self.load_perms(user), {})
+
+    def test_invalidated_on_restraint_db_updated(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_perm_set_masks(['individual'])
+        core.update_restraint_db(force=True)
+        self.assertIsNone(caches['default'].get(cache.get_perm_set_key('individual')))
+
+    def test_invalidate_disabled(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_perm_set_masks(['individual'])
+        with override_settings(RESTRAINT_CACHE=None):
+            cache.invalidate_perm_sets()
+            cache.invalidate_individual_access()
+        self.assertIsNotNone(caches['default'].get(cache.get_perm_set_key('individual')))
+
+
+@override_settings(RESTRAINT_CACHE='default')
+class IdFilterCacheTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        caches['default'].clear()
+
+        # Memoize the only_superusers level per first name
+        self.id_filter = Mock(side_effect=lambda user: User.objects.filter(
+            is_superuser=True
+        ).values_list('id', flat=True))
+        config = test_configuration.get_configuration()
+        config['perms']['can_edit_stuff']['levels']['only_superusers'].update(
+            id_filter=self.id_filter,
+            cache_key=lambda user: user.first_name,
+            cache_ttl=60
+        )
+        patcher = patch.object(core, 'get_restraint_config', return_value=config)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        core.reset_compiled_restraint_config()
+        self.addCleanup(core.reset_compiled_restraint_config)
+
+        self.superuser = G(User, is_superuser=True, is_staff=False)
+        self.user = G(User, is_superuser=False, is_staff=True, first_name='Jane')
+        self.other_user = G(User, is_superuser=False, is_staff=True, first_name='Jane')
+
+    def filter_qset(self, user):
+        return set(core.Restraint(user).filter_qset(User.objects.all(), 'can_edit_stuff'))
+
+    def test_shared_by_key(self):
+        self.assertEqual(self.filter_qset(self.user), {self.user, self.superuser})
+        self.assertEqual(self.filter_qset(self.other_user), {self.other_user, self.superuser})
+        self.assertEqual(self.id_filter.call_count, 1)
+
+        # The memoized ids are a list that does not change with the data until it is invalidated
+        G(User, is_superuser=True)
+        self.assertEqual(self.filter_qset(self.user), {self.user, self.superuser})
+
+        # Users with another key do not share the ids
+        self.assertEqual(len(self.filter_qset(G(User, is_superuser=False, is_staff=True, first_name='Joe'))), 3)
+        self.assertEqual(self.id_filter.call_count, 2)
+
+    def test_invalidate_perm(self):
+        self.filter_qset(self.user)
+        cache.invalidate_id_filters(['can_view_stuff'])
+        self.filter_qset(self.user)
+        self.assertEqual(self.id_filter.call_count, 1)
+
+        cache.invalidate_id_filters(['can_edit_stuff'])
+        self.filter_qset(self.user)
+        self.assertEqual(self.id_filter.call_count, 2)
+
+    def test_invalidate_all(self):
+        self.filter_qset(self.user)
+        cache.invalidate_id_filters()
+        self.filter_qset(self.user)
+        self.assertEqual(self.id_filter.call_count, 2)
+
+    def test_invalidate_without_version(self):
+        cache.invalidate_id_filters(['can_edit_stuff'])
+        self.assertIsNotNone(caches['default'].get(cache.get_id_filter_version_key('can_edit_stuff')))
+
+    def test_timeout(self):
+        self.filter_qset(self.user)
+        with patch.object(caches['default'], 'set', wraps=caches['default'].set) as mock_set:
+            cache.invalidate_id_filters(['can_edit_stuff'])
+            self.filter_qset(self.user)
+        self.assertEqual(mock_set.call_args[0][2], 60)
+
+        self.assertEqual(cache._get_id_filter_timeout(None), DEFAULT_TIMEOUT)
+        with override_settings(RESTRAINT_CACHE_TIMEOUT=30):
+            self.assertEqual(cache._get_id_filter_timeout(None), 30)
+
+    def test_cache_disabled(self):
+        with override_settings(RESTRAINT_CACHE=None):
+            self.filter_qset(self.user)
+            self.filter_qset(self.user)
+            cache.invalidate_id_filters()
+        self.assertEqual(self.id_filter.call_count, 2)
+
+    async def test_afilter_qset(self):
+        async def id_filter(user):
+            return [self.superuser.id]
+        self.id_filter.side_effect = id_filter
+
+        for user in [self.user, self.other_user]:
+            filtered_qset = await core.Restraint(user).afilter_qset(User.objects.all(), 'can_edit_stuff')
+            self.assertEqual({u async for u in filtered_qset}, {user, self.superuser})
+        self.assertEqual(self.id_filter.call_count, 1)
+
+    async def test_afilter_qset_sync_id_filter(self):
+        for user in [self.user, self.other_user]:
+            filtered_qset = await core.Restraint(user).afilter_qset(User.objects.all(), 'can_edit_stuff')
+            self.assertEqual({u async for u in filtered_qset}, {user, self.superuser})
+        self.assertEqual(self.id_filter.call_count, 1)
@@ -1,15 +1,140 @@
-from django.core.management import call_command
-from django.test import SimpleTestCase
-from unittest.mock import patch
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import Mock, patch
+
+from restraint import cache, core
+import restraint.tests.configuration as test_configuration
 
 
 class UpdateRestraintDbTest(SimpleTestCase):
     @patch('restraint.management.commands.update_restraint_db.update_restraint_db', spec_set=True)
     def test_wo_flush_default_access(self, mock_update_restraint_db):
         call_command('update_restraint_db')
-        mock_update_restraint_db.assert_called_once_with(flush_default_access=False)
+        mock_update_restraint_db.assert_called_once_with(flush_default_access=False, force=False)
 
     @patch('restraint.management.commands.update_restraint_db.update_restraint_db', spec_set=True)
     def test_w_flush_default_access(self, mock_update_restraint_db):
         call_command('update_restraint_db', flush_default_access=True)
-        mock_update_restraint_db.assert_called_once_with(flush_default_access=True)
+        mock_update_restraint_db.assert_called_once_with(flush_default_access=True, force=False)
+
+    @patch('restraint.management.commands.update_restraint_db.update_restraint_db', spec_set=True)
+    def test_w_force(self, mock_update_restraint_db):
+        call_command('update_restraint_db', force=True)
+        mock_update_restraint_db.assert_called_once_with(flush_default_access=False, force=True)
+
+
+@override_settings(RESTRAINT_CACHE='default')
+class WarmRestraintCacheTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        caches['default'].clear()
+        self.users = [
+            G(User, is_superuser=False, is_staff=False),
+            G(User, is_superuser=False, is_staff=True),
+            G(User, is_superuser=False, is_staff=True),
+        ]
+
+    def cached_perm_sets(self):
+        return {
+            name
+            for name in core.get_compiled_restraint_config().perm_sets
+            if caches['default'].get(cache.get_perm_set_key(name)) is not None
+        }
+
+    def test_warm(self):
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('warm_restraint_cache', processes=0, chunk_size=2, stdout=stdout)
+        self.assertEqual(self.cached_perm_sets(), {'individual', 'staff'})
+
+        # The first load of each user's permissions does not query the database
+        with self.assertNumQueries(0):
+            for user in self.users:
+                core.Restraint(user).perms
+
+        output = stdout.getvalue().splitlines()
+        self.assertEqual(len(output), 3)
+        self.assertTrue(output[0].startswith(f'Warmed 2 of 2 users through pk {self.users[1].pk} '))
+        self.assertTrue(output[1].startswith(f'Warmed 3 of 3 users through pk {self.users[2].pk} '))
+        self.assertTrue(output[2].startswith('Warmed 3 of 3 users in '))
+
+    def test_start_after_and_perm_sets(self):
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command(
+                'warm_restraint_cache',
+                processes=0,
+                start_after=self.users[0].pk,
+                perm_sets=['staff'],
+                stdout=stdout
+            )
+        self.assertEqual(self.cached_perm_sets(), {'individual', 'staff'})
+        self.assertTrue(stdout.getvalue().splitlines()[-1].startswith('Warmed 2 of 2 users in '))
+
+        stdout = StringIO()
+        call_command('warm_restraint_cache', processes=0, perm_sets=['super'], stdout=stdout)
+        self.assertTrue(stdout.getvalue().startswith('Warmed 0 of 3 users'))
+
+    def test_id_filters(self):
+        id_filter = Mock(return_value=[1])
+        config = test_configuration.get_configuration()
+        config['perms']['can_edit_stuff']['levels']['only_superusers'].update(
+            id_filter=id_filter,
+            cache_key=lambda user: user.is_staff,
+        )
+        with patch.object(core, 'get_restraint_config', return_value=config):
+            core.reset_compiled_restraint_config()
+            self.addCleanup(core.reset_compiled_restraint_config)
+
+            call_command(
+                'warm_restraint_cache', processes=0, perms=['can_view_stuff'], id_filters=True, stdout=StringIO()
+            )
+            self.assertEqual(id_filter.call_count, 0)
+
+            call_command('warm_restraint_cache', processes=0, id_filters=True, stdout=StringIO())
+            self.assertEqual(id_filter.call_count, 1)
+
+            # The memoized ids are used when filtering
+            core.Restraint(self.users[2]).filter_qset(User.objects.all(), 'can_edit_stuff')
+            self.assertEqual(id_filter.call_count, 1)
+
+    def test_cache_disabled(self):
+        with override_settings(RESTRAINT_CACHE=None):
+            with self.assertRaises(CommandError):
+                call_command('warm_restraint_cache')
+
+    def test_local_memory_cache(self):
+        locmem_cache = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+        with override_settings(CACHES={'default': locmem_cache}):
+            with self.assertRaises(CommandError):
+                call_command('warm_restraint_cache', processes=2)
+
+
+class WarmRestraintCacheProcessesTest(TransactionTestCase):
+    def test_processes(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        file_cache = {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir.name}
+
+        with override_settings(CACHES={'default': file_cache}, RESTRAINT_CACHE='default'):
+            core.update_restraint_db()
+            caches['default'].clear()
+            users = [G(User, is_superuser=False, is_staff=bool(i % 2)) for i in range(6)]
+
+            # More chunks than are queued at a time
+            stdout = StringIO()
+            call_command('warm_restraint_cache', processes=2, chunk_size=1, stdout=stdout)
+            self.assertEqual(stdout.getvalue().splitlines()[-2].split(' (')[0], (
+                f'Warmed 6 of 6 users through pk {users[-1].pk}'
+            ))
+
+            # The workers wrote to the shared cache
+            self.assertIsNotNone(caches['default'].get(cache.get_perm_set_key('staff')))
+            for user in users:
+                self.assertEqual(caches['default'].get(cache.get_individual_key(('auth', 'user', user.pk))), 0)
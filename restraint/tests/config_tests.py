@@ -0,0 +1,199 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.apps import apps
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import Mock, patch
+
+from restraint import constants, core
+from restraint.config import CompiledConfig, get_config_fingerprint, validate_config
+import restraint.tests.configuration as test_configuration
+
+
+class GetConfigFingerprintTest(SimpleTestCase):
+    def test_stable(self):
+        config = test_configuration.get_configuration()
+        fingerprint = get_config_fingerprint(config)
+        self.assertEqual(len(fingerprint), 64)
+
+        # Functions and the order of levels in the default access do not change the fingerprint
+        config['perm_set_getter'] = None
+        config['perms']['can_edit_stuff']['levels']['some_stuff']['id_filter'] = None
+        config['default_access']['staff']['can_edit_stuff'].reverse()
+        self.assertEqual(get_config_fingerprint(config), fingerprint)
+
+    def test_changed(self):
+        fingerprint = get_config_fingerprint(test_configuration.get_configuration())
+        for change in [
+            lambda config: config['perm_sets']['staff'].update(hidden=True),
+            lambda config: config['perms']['can_edit_stuff'].update(display_name='Edit'),
+            lambda config: config['perms']['can_edit_stuff']['levels']['all_stuff'].update(display_name='All'),
+            lambda config: config['perms']['can_edit_stuff']['levels'].pop('all_stuff'),
+            lambda config: config['default_access']['staff'].pop('can_edit_stuff'),
+        ]:
+            config = test_configuration.get_configuration()
+            change(config)
+            self.assertNotEqual(get_config_fingerprint(config), fingerprint)
+
+
+class ValidateConfigTest(SimpleTestCase):
+    def test_valid(self):
+        validate_config(test_configuration.get_configuration())
+
+    def test_invalid(self):
+        for change, message in [
+            (lambda config: config.pop('perms'), "must have a 'perms' dictionary"),
+            (lambda config: config.update(perm_set_getter='perm_sets'), 'perm_set_getter must be callable'),
+            (lambda config: config.update(perm_checker=True), 'perm_checker must be callable'),
+            (lambda config: config['perm_sets'].update({1: {}}), 'perm set name 1 must be a string'),
+            (lambda config: config['perms'].update({'x' * 257: {}}), 'must be a string of at most 256'),
+            (lambda config: config['perms']['can_view_stuff'].update(levels={}), 'must have at least one level'),
+            (
+                lambda config: config['perms']['can_edit_stuff']['levels']['all_stuff'].update(id_filter=[1]),
+                "id_filter of the level 'can_edit_stuff' 'all_stuff' must be callable"
+            ),
+            (
+                lambda config: config['perms']['can_edit_stuff']['levels']['all_stuff'].update(cache_key='key'),
+                'cache_key of the level'
+            ),
+            (lambda config: config['default_access'].update(staf={}), "unknown perm set 'staf'"),
+            (
+                lambda config: config['default_access']['staff'].update(can_edit_stuf=[]),
+                "refers to the unknown perm 'can_edit_stuf'"
+            ),
+            (
+                lambda config: config['default_access']['staff']['can_edit_stuff'].append('all_stuf'),
+                "unknown level 'all_stuf' of the perm 'can_edit_stuff'"
+            ),
+            (
+                lambda config: config['default_access']['staff']['can_edit_stuff'].append('some_stuff'),
+                'lists a level of the perm'
+            ),
+        ]:
+            config = test_configuration.get_configuration()
+            change(config)
+            with self.assertRaisesRegex(ImproperlyConfigured, message):
+                CompiledConfig(config)
+
+
+class AppReadyTest(SimpleTestCase):
+    def setUp(self):
+        core.reset_compiled_restraint_config()
+        self.addCleanup(core.reset_compiled_restraint_config)
+
+    def test_invalid_config(self):
+        with patch('restraint.core.get_restraint_config', return_value={'perm_sets': {}}):
+            with self.assertRaisesRegex(ImproperlyConfigured, "must have a 'perms' dictionary"):
+                apps.get_app_config('restraint').ready()
+
+    @override_settings(RESTRAINT_CONFIGURATION=None)
+    def test_not_configured(self):
+        apps.get_app_config('restraint').ready()
+        self.assertIsNone(core._compiled_config)
+
+
+class CompiledConfigTest(SimpleTestCase):
+    def test_attributes(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        self.assertEqual(config.perm_set_getter, test_configuration.perm_set_getter)
+        self.assertIsNone(config.perm_checker)
+        self.assertEqual(set(config.perm_sets), {'super', 'individual', 'staff', 'locked_and_hidden'})
+        self.assertEqual(config['perm_sets'], test_configuration.get_configuration()['perm_sets'])
+        self.assertIsNone(config.get('perm_checker'))
+
+    def test_id_filters(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        self.assertEqual(
+            config.id_filters['can_edit_stuff'],
+            {
+                'all_stuff': None,
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+                'only_superusers': test_configuration.user_only_super_users_id_filter,
+                'same_first_name': None,
+            }
+        )
+        self.assertIsNone(config.get_id_filter('can_view_stuff', constants.BOOLEAN_LEVELS_NAME))
+
+    def test_id_filter_caches(self):
+        configuration = test_configuration.get_configuration()
+        cache_key = Mock()
+        configuration['perms']['can_edit_stuff']['levels']['some_stuff']['cache_key'] = cache_key
+        configuration['perms']['can_edit_stuff']['levels']['all_stuff'].update(cache_key=cache_key, cache_ttl=60)
+        config = CompiledConfig(configuration)
+
+        self.assertEqual(config.get_id_filter_cache('can_edit_stuff', 'some_stuff'), (cache_key, None))
+        self.assertEqual(config.get_id_filter_cache('can_edit_stuff', 'all_stuff'), (cache_key, 60))
+        self.assertIsNone(config.get_id_filter_cache('can_edit_stuff', 'only_superusers'))
+        self.assertIsNone(config.get_id_filter_cache('unknown_perm', 'unknown_level'))
+
+    def test_q_filters(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        self.assertEqual(
+            config.get_q_filter('can_edit_stuff', 'same_first_name'),
+            test_configuration.user_same_first_name_q_filter
+        )
+        self.assertIsNone(config.get_q_filter('can_edit_stuff', 'some_stuff'))
+        self.assertIsNone(config.get_q_filter('can_edit_stuff', 'unknown_level'))
+        self.assertIsNone(config.get_q_filter('unknown_perm', 'unknown_level'))
+
+    def test_immutable(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        with self.assertRaises(AttributeError):
+            config.perm_checker = None
+        with self.assertRaises(AttributeError):
+            del config.perms
+        with self.assertRaises(TypeError):
+            config.id_filters['can_edit_stuff']['all_stuff'] = test_configuration.user_some_stuff_id_filter
+
+    def test_records(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        perm_record = config.perm_records['can_edit_stuff']
+        self.assertEqual(perm_record.id, 1)
+        self.assertEqual(perm_record.mask, config.perm_masks['can_edit_stuff'])
+
+        level_record = perm_record.levels['some_stuff']
+        self.assertIs(config.level_records[level_record.id], level_record)
+        self.assertEqual(level_record.id, config.level_bits[('can_edit_stuff', 'some_stuff')])
+        self.assertEqual(level_record.perm, 'can_edit_stuff')
+        self.assertEqual(level_record.id_filter, test_configuration.user_some_stuff_id_filter)
+        self.assertIsNone(level_record.q_filter)
+        self.assertIs(config.get_level_record('can_edit_stuff', 'some_stuff'), level_record)
+        self.assertIsNone(config.get_level_record('can_edit_stuff', 'unknown_level'))
+        self.assertIsNone(config.get_level_record('unknown_perm', 'unknown_level'))
+
+        with self.assertRaises(AttributeError):
+            level_record.id_filter = None
+        with self.assertRaises(AttributeError):
+            del perm_record.mask
+        with self.assertRaises(AttributeError):
+            level_record.other = None
+        self.assertEqual(repr(perm_record), '<PermRecord 1: can_edit_stuff>')
+
+    def test_level_bits(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        self.assertEqual(config.bit_levels[0], ('can_access_users_named_foo', ''))
+        self.assertEqual(len(config.bit_levels), 6)
+        self.assertEqual(
+            {config.bit_levels[bit] for bit in config.level_bits.values()},
+            set(config.bit_levels)
+        )
+        self.assertEqual(bin(config.perm_masks['can_edit_stuff']).count('1'), 4)
+
+        # The bits only depend on the names in the config
+        self.assertEqual(config.levels_hash, CompiledConfig(test_configuration.get_configuration()).levels_hash)
+
+    def test_masks(self):
+        config = CompiledConfig(test_configuration.get_configuration())
+        mask = config.get_mask([('can_edit_stuff', 'some_stuff'), ('can_view_stuff', '')])
+        self.assertTrue(config.has_level(mask, 'can_edit_stuff'))
+        self.assertTrue(config.has_level(mask, 'can_edit_stuff', 'some_stuff'))
+        self.assertFalse(config.has_level(mask, 'can_edit_stuff', 'all_stuff'))
+        self.assertFalse(config.has_level(mask, 'can_edit_stuff', 'unknown_level'))
+        self.assertFalse(config.has_level(mask, 'can_access_users_named_foo'))
+        self.assertFalse(config.has_level(mask, 'unknown_perm'))
+        self.assertEqual(mask & config.get_perms_mask(['can_view_stuff', 'unknown_perm']), config.get_mask([
+            ('can_view_stuff', ''),
+        ]))
+        self.assertEqual(config.get_perms(mask), {
+            'can_edit_stuff': {'some_stuff': test_configuration.user_some_stuff_id_filter},
+            'can_view_stuff': {'': None},
+        })
+        self.assertEqual(config.get_perms(0), {})
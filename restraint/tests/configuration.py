@@ -1,4 +1,5 @@
 from django.contrib.auth.models import User
+from django.db.models import Q
 
 from restraint import constants
 
@@ -12,6 +13,14 @@ def perm_set_getter(u):
     return perm_sets
 
 
+def perm_set_users(perm_set_name):
+    return {
+        'individual': User.objects.all(),
+        'super': User.objects.filter(is_superuser=True),
+        'staff': User.objects.filter(is_staff=True),
+    }.get(perm_set_name)
+
+
 def user_some_stuff_id_filter(user):
     return User.objects.filter(id=user.id).values_list('id', flat=True)
 
@@ -20,9 +29,14 @@ def user_only_super_users_id_filter(user):
     return User.objects.filter(is_superuser=True).values_list('id', flat=True)
 
 
+def user_same_first_name_q_filter(user):
+    return Q(first_name=user.first_name)
+
+
 def get_configuration():
     return {
         'perm_set_getter': perm_set_getter,
+        'perm_set_users': perm_set_users,
         'perm_sets': {
             'super': {
                 'display_name': 'Super',
@@ -53,6 +67,11 @@ def get_configuration():
                         'display_name': 'Only Superusers',
                         'id_filter': user_only_super_users_id_filter,
                     },
+                    'same_first_name': {
+                        'display_name': 'Same First Name',
+                        'id_filter': None,
+                        'q_filter': user_same_first_name_q_filter,
+                    },
                 },
             },
             'can_view_stuff': {
@@ -1,15 +1,36 @@
-from django.contrib.auth.models import User
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import Group, User
 from django.contrib.contenttypes.models import ContentType
-from django.test import SimpleTestCase, TestCase
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Exists, OuterRef, Q
+from django.test import SimpleTestCase, TestCase, override_settings
 from django_dynamic_fixture import G
 from unittest.mock import patch, Mock
 from unittest.mock import PropertyMock
 
-from restraint import core, constants
-from restraint.models import PermSet, Perm, PermLevel, PermAccess
+from restraint import cache, core, constants
+from restraint.config import get_config_fingerprint
+from restraint.models import PermSet, Perm, PermLevel, PermAccess, RestraintMetadata
+from restraint.signals import restraint_db_updated
 import restraint.tests.configuration as test_configuration
 
 
+@asynccontextmanager
+async def acapture_on_commit_callbacks(test_case):
+    """
+    Runs the on_commit callbacks of the connection the async ORM uses, which belongs to another thread.
+    """
+    capture = test_case.captureOnCommitCallbacks(execute=True)
+    await sync_to_async(capture.__enter__)()
+    try:
+        yield
+    finally:
+        await sync_to_async(capture.__exit__)(None, None, None)
+
+
 class TestGetRestraintConfig(SimpleTestCase):
     def test_get_configuration(self):
         self.assertEqual(
@@ -18,6 +39,26 @@ class TestGetRestraintConfig(SimpleTestCase):
         )
 
 
+class TestGetCompiledRestraintConfig(SimpleTestCase):
+    def setUp(self):
+        core.reset_compiled_restraint_config()
+
+    def tearDown(self):
+        core.reset_compiled_restraint_config()
+
+    @patch.object(core, 'get_restraint_config', wraps=core.get_restraint_config)
+    def test_compiled_once(self, mock_get_restraint_config):
+        config = core.get_compiled_restraint_config()
+        self.assertIs(core.get_compiled_restraint_config(), config)
+        self.assertIs(core.Restraint(Mock())._config, config)
+        self.assertEqual(mock_get_restraint_config.call_count, 1)
+
+    def test_reloaded_on_restraint_db_updated(self):
+        config = core.get_compiled_restraint_config()
+        restraint_db_updated.send(sender=None, config=config.raw)
+        self.assertIsNot(core.get_compiled_restraint_config(), config)
+
+
 class TestRestraintLoadPerms(TestCase):
     def setUp(self):
         core.update_restraint_db()
@@ -92,63 +133,359 @@ class TestRestraintLoadPerms(TestCase):
             }
         )
 
+    def test_has_perm_loads_missing_perms(self):
+        user = G(User, is_superuser=True)
+        r = core.Restraint(user, ['can_edit_stuff'])
+        with self.assertNumQueries(1):
+            self.assertTrue(r.has_perm('can_edit_stuff', 'all_stuff'))
+
+        # Only the missing perm is loaded, once
+        with self.assertNumQueries(1):
+            self.assertTrue(r.has_perm('can_view_stuff'))
+            self.assertTrue(r.has_perm('can_view_stuff'))
+            self.assertTrue(r.has_perm('can_edit_stuff'))
+        self.assertEqual(set(r.perms), {'can_edit_stuff', 'can_view_stuff'})
+
+    def test_has_perm_before_loading(self):
+        user = G(User, is_superuser=True)
+        r = core.Restraint(user, ['can_edit_stuff'])
+
+        # The perms are loaded together the first time
+        with self.assertNumQueries(1):
+            self.assertTrue(r.has_perm('can_view_stuff'))
+            self.assertTrue(r.has_perm('can_edit_stuff', 'all_stuff'))
+
+    def test_has_perms_loads_missing_perms_in_one_query(self):
+        user = G(User, is_superuser=True)
+        r = core.Restraint(user, ['can_edit_stuff'])
+        r.perms
+
+        with self.assertNumQueries(1):
+            self.assertEqual(r.has_perms(['can_view_stuff', 'can_access_users_named_foo', 'can_view_stuff']), {
+                'can_view_stuff': True,
+                'can_access_users_named_foo': True,
+            })
+        with self.assertNumQueries(0):
+            self.assertTrue(r.has_any_perm(['can_view_stuff', ('can_edit_stuff', 'all_stuff')]))
+            self.assertTrue(r.has_all_perms(['can_view_stuff', ('can_edit_stuff', 'all_stuff')]))
+
+    def test_filter_qset_loads_missing_perms(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        r = core.Restraint(user, ['can_view_stuff'])
+        r.perms
+
+        filtered_qset = r.filter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual(set(filtered_qset), {user})
+        self.assertEqual(set(r.perms['can_edit_stuff']), {'some_stuff', 'only_superusers'})
+
+    def test_load_all_perms(self):
+        user = G(User, is_superuser=True)
+        r = core.Restraint(user, ['can_edit_stuff'])
+        r.perms
+
+        r.load_perms()
+        self.assertEqual(set(r.perms), {'can_edit_stuff', 'can_view_stuff', 'can_access_users_named_foo'})
+        with self.assertNumQueries(0):
+            self.assertTrue(r.has_perm('can_view_stuff'))
+
+
+class TestRestraintPermLevelsQuery(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        self.user = G(User, is_superuser=False, is_staff=True)
+        pa = G(PermAccess, perm_user_id=self.user.id, perm_user_type=ContentType.objects.get_for_model(self.user))
+        pa.perm_levels.add(PermLevel.objects.get(name='all_stuff'), PermLevel.objects.get(name='some_stuff'))
+
+    def test_union(self):
+        qset = core.Restraint(self.user)._get_perm_levels_qset(None, ['individual', 'staff'])
+        self.assertEqual(sorted(qset), [
+            ('can_edit_stuff', 'all_stuff'),
+            ('can_edit_stuff', 'only_superusers'),
+            ('can_edit_stuff', 'some_stuff'),
+        ])
+
+    def test_union_which_perms(self):
+        qset = core.Restraint(self.user)._get_perm_levels_qset(['can_view_stuff'], ['individual', 'staff'])
+        self.assertEqual(list(qset), [])
+
+    def test_individual_access(self):
+        qset = core.Restraint(self.user)._get_perm_levels_qset(None)
+        self.assertEqual(sorted(qset), [('can_edit_stuff', 'all_stuff'), ('can_edit_stuff', 'some_stuff')])
+
+
+class UsersWithPermTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        ContentType.objects.get_for_model(User)
+        self.user = G(User, is_superuser=False, is_staff=False)
+        self.staff = G(User, is_superuser=False, is_staff=True)
+        self.superuser = G(User, is_superuser=True, is_staff=False)
+
+    def test_level(self):
+        self.assertEqual(set(core.users_with_perm('can_edit_stuff', 'all_stuff')), {self.superuser})
+
+        PermAccess.objects.add_individual_access(self.staff, 'can_edit_stuff', 'all_stuff')
+        self.assertEqual(set(core.users_with_perm('can_edit_stuff', 'all_stuff')), {self.staff, self.superuser})
+        self.assertEqual(set(core.users_with_perm('can_edit_stuff', 'only_superusers')), {self.staff})
+        self.assertEqual(set(core.users_with_perm('can_edit_stuff', 'same_first_name')), set())
+
+    def test_any_level(self):
+        self.assertEqual(set(core.users_with_perm('can_view_stuff')), {self.superuser})
+        self.assertEqual(set(core.users_with_perm('can_edit_stuff')), {self.user, self.staff, self.superuser})
+
+    def test_lazy(self):
+        # The perm sets with access are read up front and the users are read with one query
+        with self.assertNumQueries(1):
+            users = core.users_with_perm('can_edit_stuff', 'some_stuff')
+        with self.assertNumQueries(1):
+            self.assertEqual(len(list(users.iterator())), 3)
+
+    def test_perm_set_without_users(self):
+        config = test_configuration.get_configuration()
+        config['perm_set_users'] = lambda perm_set_name: None
+        with patch.object(core, 'get_restraint_config', return_value=config):
+            core.reset_compiled_restraint_config()
+            self.addCleanup(core.reset_compiled_restraint_config)
+
+            PermAccess.objects.add_individual_access(self.user, 'can_view_stuff', '')
+            self.assertEqual(set(core.users_with_perm('can_view_stuff', '')), {self.user})
+
+    def test_not_configured(self):
+        config = test_configuration.get_configuration()
+        config.pop('perm_set_users')
+        with patch.object(core, 'get_restraint_config', return_value=config):
+            core.reset_compiled_restraint_config()
+            self.addCleanup(core.reset_compiled_restraint_config)
+
+            with self.assertRaises(ImproperlyConfigured):
+                core.users_with_perm('can_view_stuff')
+
+
+class TestRestraintForUsers(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+
+    def test_no_users(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(core.Restraint.for_users([]), [])
+
+    def test_for_users(self):
+        individual = G(User, is_superuser=False, is_staff=False)
+        staff = G(User, is_superuser=False, is_staff=True)
+        superuser = G(User, is_superuser=True, is_staff=False)
+        PermAccess.objects.add_individual_access(staff, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+
+        # The users, the perm set access and the individual access are each loaded with one query
+        with self.assertNumQueries(3):
+            restraints = core.Restraint.for_users(
+                User.objects.filter(id__in=[individual.id, staff.id, superuser.id]).order_by('id')
+            )
+
+        expected_perms = [core.Restraint(user).perms for user in [individual, staff, superuser]]
+        with self.assertNumQueries(0):
+            self.assertEqual([r._user for r in restraints], [individual, staff, superuser])
+            self.assertEqual([r.perms for r in restraints], expected_perms)
+            self.assertTrue(restraints[1].has_perm('can_view_stuff'))
+            self.assertFalse(restraints[0].has_perm('can_view_stuff'))
+
+    def test_for_users_which_perms(self):
+        individual = G(User, is_superuser=False, is_staff=False)
+        superuser = G(User, is_superuser=True, is_staff=False)
+        PermAccess.objects.add_individual_access(individual, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+
+        restraints = core.Restraint.for_users([individual, superuser], ['can_view_stuff'])
+        self.assertEqual(
+            [r.perms for r in restraints],
+            [{'can_view_stuff': {'': None}}, {'can_view_stuff': {'': None}}]
+        )
+
+    @override_settings(RESTRAINT_CACHE='default')
+    def test_for_users_cached(self):
+        caches['default'].clear()
+        individual = G(User, is_superuser=False, is_staff=False)
+        superuser = G(User, is_superuser=True, is_staff=False)
+        with self.captureOnCommitCallbacks(execute=True):
+            core.Restraint.for_users([individual, superuser])
+
+        # The perm sets and individual access of both users are read from the cache
+        with self.assertNumQueries(0):
+            restraints = core.Restraint.for_users([individual, superuser], ['can_view_stuff'])
+        self.assertEqual([r.perms for r in restraints], [{}, {'can_view_stuff': {'': None}}])
+
 
 class TestRestraintHasPerms(SimpleTestCase):
-    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
-    def test_has_perm_w_level_true(self, mock_perms):
-        mock_perms.return_value = {
-            'can_view_stuff': {
-                '': None,
-            },
-            'can_edit_stuff': {
-                'all_stuff': None,
-                'some_stuff': None,
-            }
-        }
+    def get_mask(self):
+        return core.get_compiled_restraint_config().get_mask([
+            ('can_view_stuff', ''),
+            ('can_edit_stuff', 'all_stuff'),
+            ('can_edit_stuff', 'some_stuff'),
+        ])
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perm_w_level_true(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
         r = core.Restraint(Mock())
         self.assertTrue(r.has_perm('can_edit_stuff', 'all_stuff'))
 
-    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
-    def test_has_perm_w_level_false(self, mock_perms):
-        mock_perms.return_value = {
-            'can_view_stuff': {
-                '': None,
-            },
-            'can_edit_stuff': {
-                'all_stuff': None,
-                'some_stuff': None,
-            }
-        }
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perm_w_level_false(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
         r = core.Restraint(Mock())
         self.assertFalse(r.has_perm('can_edit_stuff', 'no_stuff'))
+        self.assertFalse(r.has_perm('can_edit_stuff', 'only_superusers'))
 
-    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
-    def test_has_perm_wo_level_true(self, mock_perms):
-        mock_perms.return_value = {
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perm_wo_level_true(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        r = core.Restraint(Mock())
+        self.assertTrue(r.has_perm('can_edit_stuff'))
+        self.assertTrue(r.has_perm('can_view_stuff', constants.BOOLEAN_LEVELS_NAME))
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perm_wo_level_false(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        r = core.Restraint(Mock())
+        self.assertFalse(r.has_perm('can_mess_with_stuff'))
+        self.assertFalse(r.has_perm('can_access_users_named_foo'))
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_perms_derived_from_mask(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        r = core.Restraint(Mock())
+        self.assertEqual(r.perms, {
             'can_view_stuff': {
                 '': None,
             },
             'can_edit_stuff': {
                 'all_stuff': None,
-                'some_stuff': None,
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
             }
-        }
+        })
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perm_custom_checker(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        perm_checker = Mock(return_value=True)
         r = core.Restraint(Mock())
+        r._permission_checkers = [perm_checker]
+
         self.assertTrue(r.has_perm('can_edit_stuff'))
+        self.assertFalse(perm_checker.called)
+        self.assertTrue(r.has_perm('can_mess_with_stuff', 'all_stuff'))
+        perm_checker.assert_called_once_with(
+            user=r._user,
+            user_permissions=r.perms,
+            permission='can_mess_with_stuff',
+            level='all_stuff'
+        )
 
-    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
-    def test_has_perm_wo_level_false(self, mock_perms):
-        mock_perms.return_value = {
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perms(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        r = core.Restraint(Mock())
+        self.assertEqual(r.has_perms([
+            'can_view_stuff',
+            'can_mess_with_stuff',
+            ('can_edit_stuff', 'all_stuff'),
+            ('can_edit_stuff', 'only_superusers'),
+        ]), {
+            'can_view_stuff': True,
+            'can_mess_with_stuff': False,
+            ('can_edit_stuff', 'all_stuff'): True,
+            ('can_edit_stuff', 'only_superusers'): False,
+        })
+        self.assertEqual(r.has_perms([]), {})
+
+        # Pairs given as lists are keyed on tuples
+        self.assertEqual(r.has_perms([['can_edit_stuff', 'all_stuff']]), {('can_edit_stuff', 'all_stuff'): True})
+        self.assertTrue(r.has_all_perms([['can_edit_stuff', 'all_stuff'], 'can_view_stuff']))
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_any_perm(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        perm_checker = Mock(return_value=False)
+        r = core.Restraint(Mock())
+        r._permission_checkers = [perm_checker]
+
+        self.assertTrue(r.has_any_perm(['can_mess_with_stuff', ('can_edit_stuff', 'some_stuff')]))
+        self.assertFalse(perm_checker.called)
+        self.assertFalse(r.has_any_perm(['can_mess_with_stuff', ('can_edit_stuff', 'only_superusers')]))
+        self.assertEqual(perm_checker.call_count, 2)
+        self.assertFalse(r.has_any_perm([]))
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_all_perms(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        r = core.Restraint(Mock())
+        self.assertTrue(r.has_all_perms(['can_view_stuff', ('can_edit_stuff', 'some_stuff')]))
+        self.assertFalse(r.has_all_perms(['can_view_stuff', ('can_edit_stuff', 'only_superusers')]))
+        self.assertTrue(r.has_all_perms([]))
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perms_custom_checker(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        first_checker = Mock(side_effect=lambda permission, **kwargs: permission == 'can_mess_with_stuff')
+        second_checker = Mock(return_value=True)
+        r = core.Restraint(Mock())
+        r._permission_checkers = [first_checker, second_checker]
+
+        self.assertEqual(r.has_perms(['can_view_stuff', 'can_mess_with_stuff', 'can_do_things']), {
+            'can_view_stuff': True,
+            'can_mess_with_stuff': True,
+            'can_do_things': True,
+        })
+
+        # The checkers are only called for the perms that have not passed yet
+        self.assertEqual(first_checker.call_count, 2)
+        second_checker.assert_called_once_with(
+            user=r._user,
+            user_permissions=r.perms,
+            permission='can_do_things',
+            level=None
+        )
+
+    @patch.object(core.Restraint, 'perm_mask', new_callable=PropertyMock)
+    def test_has_perms_batch_checker(self, mock_perm_mask):
+        mock_perm_mask.return_value = self.get_mask()
+        perm_checker = Mock(return_value=[True, False])
+        perm_checker.accepts_batch = True
+        r = core.Restraint(Mock())
+        r._permission_checkers = [perm_checker]
+
+        perms = ['can_view_stuff', 'can_mess_with_stuff', ('can_edit_stuff', 'only_superusers')]
+        self.assertEqual(r.has_perms(perms), {
+            'can_view_stuff': True,
+            'can_mess_with_stuff': True,
+            ('can_edit_stuff', 'only_superusers'): False,
+        })
+        perm_checker.assert_called_once_with(
+            user=r._user,
+            user_permissions=r.perms,
+            permissions=[('can_mess_with_stuff', None), ('can_edit_stuff', 'only_superusers')]
+        )
+
+        # Single checks call batch checkers with one permission
+        perm_checker.return_value = [True]
+        self.assertTrue(r.has_perm('can_mess_with_stuff'))
+        perm_checker.assert_called_with(
+            user=r._user,
+            user_permissions=r.perms,
+            permissions=[('can_mess_with_stuff', None)]
+        )
+
+    def test_has_permission(self):
+        user_permissions = {
             'can_view_stuff': {
                 '': None,
             },
             'can_edit_stuff': {
                 'all_stuff': None,
-                'some_stuff': None,
             }
         }
-        r = core.Restraint(Mock())
-        self.assertFalse(r.has_perm('can_mess_with_stuff'))
+        self.assertTrue(core.has_permission(None, user_permissions, 'can_edit_stuff', 'all_stuff'))
+        self.assertTrue(core.has_permission(None, user_permissions, 'can_view_stuff', ''))
+        self.assertFalse(core.has_permission(None, user_permissions, 'can_edit_stuff', 'some_stuff'))
+        self.assertFalse(core.has_permission(None, user_permissions, 'can_mess_with_stuff', None))
 
 
 class TestRestraintFilterQSet(TestCase):
@@ -188,13 +525,88 @@ class TestRestraintFilterQSet(TestCase):
         filtered_qset = r.filter_qset(User.objects.all(), 'can_edit_stuff')
         self.assertEqual(set(filtered_qset), set([u, u2]))
 
+    def test_filter_qset_lazy_id_filters(self):
+        # Make a user that is staff so that both of the levels have queryset id filters
+        u = G(User, is_superuser=False, is_staff=True)
+        G(User)
+        u2 = G(User, is_superuser=True)
+        r = core.Restraint(u)
+        r.perms
+
+        # The id filters are subqueries of the single query that is executed
+        with self.assertNumQueries(1):
+            self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), set([u, u2]))
+
+    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
+    def test_filter_qset_materialized_id_filters(self, mock_perms):
+        u = G(User)
+        u2 = G(User)
+        u3 = G(User)
+        evaluated_qset = User.objects.filter(id=u2.id).values_list('id', flat=True)
+        list(evaluated_qset)
+        mock_perms.return_value = {
+            'can_edit_stuff': {
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+                'list_stuff': lambda user: [u3.id],
+                'evaluated_stuff': lambda user: evaluated_qset,
+            }
+        }
+        r = core.Restraint(u)
+        r.perm_mask
+
+        with self.assertNumQueries(1):
+            self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), set([u, u2, u3]))
+
+    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
+    def test_filter_qset_empty_id_filters(self, mock_perms):
+        u = G(User)
+        mock_perms.return_value = {
+            'can_edit_stuff': {
+                'no_stuff': lambda user: [],
+            }
+        }
+        r = core.Restraint(u)
+
+        self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), set())
+
+    def test_filter_qset_q_filter(self):
+        u = G(User, first_name='foo', is_superuser=False, is_staff=False)
+        u2 = G(User, first_name='foo')
+        G(User, first_name='bar')
+        PermAccess.objects.set_default('individual', 'can_edit_stuff', ['same_first_name'])
+        r = core.Restraint(u)
+        r.perms
+
+        with self.assertNumQueries(1):
+            self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), set([u, u2]))
+
+    def test_perms_q_filter(self):
+        u = G(User, is_superuser=False, is_staff=False)
+        PermAccess.objects.set_default('individual', 'can_edit_stuff', ['same_first_name'])
+        self.assertEqual(core.Restraint(u, ['can_edit_stuff']).perms, {
+            'can_edit_stuff': {
+                'same_first_name': test_configuration.user_same_first_name_q_filter,
+            }
+        })
+
+    def test_filter_qset_q_filter_and_id_filter(self):
+        u = G(User, first_name='foo', is_superuser=False, is_staff=True)
+        u2 = G(User, first_name='foo')
+        u3 = G(User, first_name='bar', is_superuser=True)
+        G(User, first_name='bar')
+        PermAccess.objects.add_individual_access(u, 'can_edit_stuff', 'same_first_name')
+        r = core.Restraint(u)
+
+        filtered_qset = r.filter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual(set(filtered_qset), set([u, u2, u3]))
+
     def test_filter_qset_no_perms(self):
         # Make a user that is staff
         u = G(User, is_superuser=False, is_staff=True)
-        # Load permissions that will not give them access to edit any accounts
+        # Load permissions that will not give them access to view any accounts
         r = core.Restraint(u, ['bad_perm'])
 
-        filtered_qset = r.filter_qset(User.objects.all(), 'can_edit_stuff')
+        filtered_qset = r.filter_qset(User.objects.all(), 'can_view_stuff')
         self.assertEqual(set(filtered_qset), set([]))
 
     def test_filter_qset_restrict_subset(self):
@@ -227,8 +639,260 @@ class TestRestraintFilterQSet(TestCase):
             User.objects.all(), 'can_access_users_named_foo', restrict_kwargs={'first_name': 'foo'})
         self.assertEqual(set(filtered_qset), set([models[1]] + [u]))
 
+    def test_filter_qset_path_id_filters(self):
+        u = G(User, is_superuser=False, is_staff=True)
+        u2 = G(User, is_superuser=True)
+        u3 = G(User)
+        group = G(Group)
+        u.groups.add(group)
+        u2.groups.add(group)
+        u3.groups.add(group)
+        user_groups = User.groups.through.objects.all()
+        r = core.Restraint(u)
+        r.perms
+
+        # The id filters are subqueries on the user ids of the memberships
+        with self.assertNumQueries(1):
+            filtered_qset = r.filter_qset(user_groups, 'can_edit_stuff', path='user_id')
+            self.assertEqual({membership.user_id for membership in filtered_qset}, {u.id, u2.id})
+
+        self.assertEqual(
+            set(r.filter_qset(Group.objects.all(), 'can_edit_stuff', path='user__pk').distinct()), {group}
+        )
+
+    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
+    def test_filter_qset_path_materialized_id_filters(self, mock_perms):
+        u = G(User)
+        u2 = G(User)
+        mock_perms.return_value = {
+            'can_edit_stuff': {
+                'list_stuff': lambda user: [u2.id],
+            }
+        }
+        r = core.Restraint(u)
+        G(PermAccess, perm_user_id=u.id)
+        access = G(PermAccess, perm_user_id=u2.id)
+
+        self.assertEqual(set(r.filter_qset(PermAccess.objects.all(), 'can_edit_stuff', path='perm_user_id')), {access})
+
+    def test_filter_qset_path_q_filter(self):
+        u = G(User, first_name='foo', is_superuser=False, is_staff=False)
+        u2 = G(User, first_name='foo')
+        u3 = G(User, first_name='bar')
+        for user in [u, u2, u3]:
+            user.groups.add(G(Group))
+        PermAccess.objects.set_default('individual', 'can_edit_stuff', ['same_first_name', 'some_stuff'])
+        r = core.Restraint(u)
+        r.perms
+
+        for path in ['user', 'user_id', 'user__id', 'user__pk']:
+            with self.assertNumQueries(1):
+                filtered_qset = r.filter_qset(User.groups.through.objects.all(), 'can_edit_stuff', path=path)
+                self.assertEqual({membership.user_id for membership in filtered_qset}, {u.id, u2.id})
+
+        # Q filters cannot be applied through a column that is not a relation
+        with self.assertRaises(ValueError):
+            r.filter_qset(PermAccess.objects.all(), 'can_edit_stuff', path='perm_user_id')
+
+    @patch.object(core.CompiledConfig, 'get_q_filter')
+    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
+    def test_filter_qset_path_nested_q_filter(self, mock_perms, mock_get_q_filter):
+        u = G(User, first_name='foo', last_name='bar')
+        u2 = G(User, first_name='baz', last_name='bar')
+        u3 = G(User, first_name='foo', last_name='qux')
+        for user in [u, u2, u3]:
+            user.groups.add(G(Group))
+        mock_perms.return_value = {'can_edit_stuff': {'nested': None}}
+        mock_get_q_filter.return_value = lambda user: Q(last_name='bar') & ~Q(first_name='foo') | Q(last_name='qux')
+        r = core.Restraint(u)
+
+        filtered_qset = r.filter_qset(User.groups.through.objects.all(), 'can_edit_stuff', path='user_id')
+        self.assertEqual({membership.user_id for membership in filtered_qset}, {u2.id, u3.id})
+
+    @patch.object(core.CompiledConfig, 'get_q_filter')
+    @patch.object(core.Restraint, 'perms', new_callable=PropertyMock)
+    def test_filter_qset_path_q_filter_expression(self, mock_perms, mock_get_q_filter):
+        u = G(User)
+        mock_perms.return_value = {'can_edit_stuff': {'exists': None}}
+        mock_get_q_filter.return_value = lambda user: Q(Exists(User.objects.filter(id=OuterRef('id'), pk=user.id)))
+        r = core.Restraint(u)
+
+        # Expressions are applied to the model the permission is about, but cannot be rewritten for a path
+        self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), {u})
+        with self.assertRaises(ValueError):
+            r.filter_qset(User.groups.through.objects.all(), 'can_edit_stuff', path='user_id')
+
+    def test_filter_qset_path_restrict_subset(self):
+        u = G(User, is_superuser=False)
+        u2 = G(User, first_name='foo')
+        u3 = G(User, first_name='bar')
+        for user in [u, u2, u3]:
+            user.groups.add(G(Group, name=user.first_name or 'none'))
+        r = core.Restraint(u)
+
+        filtered_qset = r.filter_qset(
+            User.groups.through.objects.all(), 'can_access_users_named_foo', restrict_kwargs={'group__name': 'foo'},
+            path='user_id'
+        )
+        self.assertEqual({membership.user_id for membership in filtered_qset}, {u.id, u3.id})
+
+
+class TestRestraintAsync(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+
+    async def test_aperms(self):
+        user = await User.objects.acreate(username='individual')
+        r = core.Restraint(user)
+        self.assertEqual(await r.aperms(), {
+            'can_edit_stuff': {
+                'some_stuff': test_configuration.user_some_stuff_id_filter
+            }
+        })
+
+        # The loaded perms are shared with the perms property
+        self.assertIs(await r.aperms(), r.perms)
+
+    async def test_aperms_which_perms(self):
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        self.assertEqual(await core.Restraint(user, ['can_view_stuff']).aperms(), {'can_view_stuff': {'': None}})
+
+    @override_settings(RESTRAINT_CACHE='default')
+    async def test_aperms_cached(self):
+        await caches['default'].aclear()
+        user = await User.objects.acreate(username='staff', is_staff=True)
+        async with acapture_on_commit_callbacks(self):
+            self.assertEqual(await core.Restraint(user).aperms(), {
+                'can_edit_stuff': {
+                    'some_stuff': test_configuration.user_some_stuff_id_filter,
+                    'only_superusers': test_configuration.user_only_super_users_id_filter,
+                }
+            })
+
+        # The perm sets are read from the cache the second time
+        self.assertEqual(
+            await caches['default'].aget(cache.get_perm_set_key('staff')),
+            core.get_compiled_restraint_config().get_mask([
+                ('can_edit_stuff', 'some_stuff'),
+                ('can_edit_stuff', 'only_superusers'),
+            ])
+        )
+        perms = await core.Restraint(user).aperms()
+        self.assertEqual(set(perms['can_edit_stuff']), {'some_stuff', 'only_superusers'})
+
+    async def test_ahas_perm(self):
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        r = core.Restraint(user)
+        self.assertTrue(await r.ahas_perm('can_view_stuff'))
+        self.assertTrue(await r.ahas_perm('can_edit_stuff', 'all_stuff'))
+        self.assertFalse(await r.ahas_perm('can_edit_stuff', 'only_superusers'))
+
+    async def test_async_loads_missing_perms(self):
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        r = core.Restraint(user, ['can_edit_stuff'])
+        self.assertTrue(await r.ahas_perm('can_edit_stuff', 'all_stuff'))
+
+        self.assertTrue(await r.ahas_perm('can_view_stuff'))
+        self.assertTrue(await r.ahas_any_perm(['can_access_users_named_foo']))
+        self.assertEqual(set(r.perms), {'can_edit_stuff', 'can_view_stuff', 'can_access_users_named_foo'})
+
+        await r.aload_perms()
+        self.assertIsNone(r._which_perms)
+
+        r = core.Restraint(user, ['can_view_stuff'])
+        await r.aperms()
+        filtered_qset = await r.afilter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual({u async for u in filtered_qset}, {user})
+
+    async def test_ahas_perms(self):
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        perms = await core.Restraint(user).ahas_perms(['can_view_stuff', ('can_edit_stuff', 'only_superusers')])
+        self.assertEqual(perms, {
+            'can_view_stuff': True,
+            ('can_edit_stuff', 'only_superusers'): False,
+        })
+        self.assertTrue(await core.Restraint(user).ahas_any_perm(['can_view_stuff', 'can_mess_with_stuff']))
+        self.assertFalse(await core.Restraint(user).ahas_all_perms(['can_view_stuff', 'can_mess_with_stuff']))
+
+    async def test_afilter_qset(self):
+        user = await User.objects.acreate(username='staff', is_staff=True)
+        superuser = await User.objects.acreate(username='super', is_superuser=True)
+        await User.objects.acreate(username='other')
+        r = core.Restraint(user)
+
+        filtered_qset = await r.afilter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual({u async for u in filtered_qset}, {user, superuser})
+
+    async def test_afilter_qset_path(self):
+        user = await User.objects.acreate(username='staff', is_staff=True)
+        other = await User.objects.acreate(username='other')
+        group = await Group.objects.acreate(name='group')
+        await User.groups.through.objects.acreate(user=user, group=group)
+        await User.groups.through.objects.acreate(user=other, group=group)
+        r = core.Restraint(user)
+
+        filtered_qset = await r.afilter_qset(User.groups.through.objects.all(), 'can_edit_stuff', path='user_id')
+        self.assertEqual({membership.user_id async for membership in filtered_qset}, {user.id})
+
+    async def test_afilter_qset_unfiltered(self):
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        other = await User.objects.acreate(username='other')
+        r = core.Restraint(user)
+
+        filtered_qset = await r.afilter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual({u async for u in filtered_qset}, {user, other})
+        filtered_qset = await r.afilter_qset(User.objects.all(), 'can_do_nothing')
+        self.assertEqual({u async for u in filtered_qset}, set())
+
+    async def test_afilter_qset_coroutine_id_filters(self):
+        user = await User.objects.acreate(username='user')
+        other = await User.objects.acreate(username='other')
+        await User.objects.acreate(username='another')
+
+        async def other_id_filter(user):
+            return [u.id async for u in User.objects.filter(username='other')]
+
+        r = core.Restraint(user)
+        r.perms = {
+            'can_edit_stuff': {
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+                'other_stuff': other_id_filter,
+            }
+        }
+
+        filtered_qset = await r.afilter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual({u async for u in filtered_qset}, {user, other})
+
 
 class UpdateRestraintDbTest(TestCase):
+    def test_skipped_when_config_unchanged(self):
+        core.update_restraint_db()
+        self.assertEqual(
+            RestraintMetadata.objects.get(name=constants.CONFIG_FINGERPRINT_METADATA_NAME).value,
+            get_config_fingerprint(test_configuration.get_configuration())
+        )
+
+        with patch.object(PermSet.objects, 'sync_perm_sets', spec_set=True) as mock_sync_perm_sets:
+            # Only the fingerprint is read, wrapped in a savepoint
+            with self.assertNumQueries(3):
+                core.update_restraint_db()
+            self.assertFalse(mock_sync_perm_sets.called)
+
+            # Forcing or flushing the default access always updates
+            core.update_restraint_db(force=True)
+            core.update_restraint_db(flush_default_access=True)
+            self.assertEqual(mock_sync_perm_sets.call_count, 2)
+
+    @patch.object(core, 'get_restraint_config')
+    def test_updated_when_config_changed(self, mock_get_restraint_config):
+        config = test_configuration.get_configuration()
+        mock_get_restraint_config.return_value = config
+        core.update_restraint_db()
+
+        config['perm_sets']['staff']['display_name'] = 'Staff Members'
+        core.update_restraint_db()
+        self.assertEqual(PermSet.objects.get(name='staff').display_name, 'Staff Members')
+
     def add_custom_permission_set(self):
         # Setup a custom permission set
         custom_permission_set = PermSet.objects.create(
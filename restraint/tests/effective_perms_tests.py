@@ -0,0 +1,196 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import patch
+
+from restraint import constants, core
+from restraint.managers import EffectivePermLevelManager
+from restraint.models import EffectivePermLevel, EffectivePermSet, PermAccess, PermLevel, PermSet
+import restraint.tests.configuration as test_configuration
+
+
+@override_settings(RESTRAINT_EFFECTIVE_PERMS=True)
+class EffectivePermLevelTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+
+    def get_effective_perm_levels(self, user):
+        return set(EffectivePermLevel.objects.filter(
+            perm_user_type=ContentType.objects.get_for_model(user),
+            perm_user_id=user.id,
+            perm_level__isnull=False
+        ).values_list('perm_level__perm__name', 'perm_level__name'))
+
+    def test_refresh_users(self):
+        individual = G(User, is_superuser=False, is_staff=False)
+        staff = G(User, is_superuser=False, is_staff=True)
+        PermAccess.objects.add_individual_access(individual, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+
+        EffectivePermLevel.objects.refresh_users([individual, staff])
+        self.assertEqual(self.get_effective_perm_levels(individual), {
+            ('can_edit_stuff', 'some_stuff'),
+            ('can_view_stuff', ''),
+        })
+        self.assertEqual(self.get_effective_perm_levels(staff), {
+            ('can_edit_stuff', 'some_stuff'),
+            ('can_edit_stuff', 'only_superusers'),
+        })
+        self.assertEqual(
+            set(EffectivePermSet.objects.filter(perm_user_id=staff.id).values_list('perm_set__name', flat=True)),
+            {'individual', 'staff'}
+        )
+
+        # Refreshing again replaces the rows, including the row marking each user as materialized
+        EffectivePermLevel.objects.refresh_users([individual])
+        self.assertEqual(EffectivePermLevel.objects.count(), 6)
+        self.assertEqual(EffectivePermLevel.objects.filter(perm_level__isnull=True).count(), 2)
+
+    def test_refresh_no_users(self):
+        EffectivePermLevel.objects.refresh_users([])
+        self.assertFalse(EffectivePermLevel.objects.exists())
+
+    def test_restraint_reads_effective_perms(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(core.Restraint(user).perms, {
+                'can_edit_stuff': {
+                    'some_stuff': test_configuration.user_some_stuff_id_filter
+                }
+            })
+        self.assertEqual(core.Restraint(user, ['can_view_stuff']).perms, {})
+
+    def test_restraint_reads_empty_effective_perms(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        # The user is materialized without the perm, so the perm sets are not loaded
+        with self.assertNumQueries(1):
+            self.assertEqual(core.Restraint(user, ['can_view_stuff']).perms, {})
+
+        PermLevel.objects.all().delete()
+        with self.assertNumQueries(1):
+            self.assertEqual(core.Restraint(user).perms, {})
+
+    def test_restraint_falls_back_without_effective_perms(self):
+        user = G(User, is_superuser=True)
+        self.assertEqual(core.Restraint(user, ['can_view_stuff']).perms, {'can_view_stuff': {'': None}})
+
+    async def test_restraint_reads_effective_perms_async(self):
+        user = await User.objects.acreate(username='individual')
+        await sync_to_async(EffectivePermLevel.objects.refresh_users)([user])
+
+        self.assertEqual(await core.Restraint(user).aperms(), {
+            'can_edit_stuff': {
+                'some_stuff': test_configuration.user_some_stuff_id_filter
+            }
+        })
+        self.assertEqual(await core.Restraint(user, ['can_view_stuff']).aperms(), {})
+        user = await User.objects.acreate(username='super', is_superuser=True)
+        self.assertEqual(await core.Restraint(user, ['can_view_stuff']).aperms(), {'can_view_stuff': {'': None}})
+
+    def test_individual_access_changed(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        PermAccess.objects.add_individual_access(user, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+        self.assertIn(('can_view_stuff', ''), self.get_effective_perm_levels(user))
+
+        PermAccess.objects.remove_individual_access(user, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+        self.assertNotIn(('can_view_stuff', ''), self.get_effective_perm_levels(user))
+
+    def test_bulk_individual_access_changed(self):
+        users = [G(User, is_superuser=False, is_staff=False) for i in range(2)]
+        EffectivePermLevel.objects.refresh_users(users)
+
+        PermAccess.objects.bulk_add_individual_access([
+            (user, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+            for user in users
+        ])
+        for user in users:
+            self.assertIn(('can_view_stuff', ''), self.get_effective_perm_levels(user))
+
+        PermAccess.objects.bulk_remove_individual_access([(users[0], 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)])
+        self.assertNotIn(('can_view_stuff', ''), self.get_effective_perm_levels(users[0]))
+        self.assertIn(('can_view_stuff', ''), self.get_effective_perm_levels(users[1]))
+
+    def test_perm_set_access_changed(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        other = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user, other])
+
+        PermAccess.objects.set_default('staff', 'can_view_stuff', [constants.BOOLEAN_LEVELS_NAME])
+        self.assertIn(('can_view_stuff', ''), self.get_effective_perm_levels(user))
+        self.assertNotIn(('can_view_stuff', ''), self.get_effective_perm_levels(other))
+
+        PermAccess.objects.set_default('staff', 'can_view_stuff')
+        self.assertEqual(self.get_effective_perm_levels(user), {('can_edit_stuff', 'some_stuff')})
+
+    def test_perm_set_access_updated(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        PermAccess.objects.update_perm_set_access(
+            {'staff': {'can_view_stuff': [constants.BOOLEAN_LEVELS_NAME]}}, [], flush_previous_config=True
+        )
+        # The individual perm set is flushed since it is not in the config
+        self.assertEqual(self.get_effective_perm_levels(user), {('can_view_stuff', '')})
+
+    def test_perm_levels_changed_in_reverse(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        PermLevel.objects.get(name='some_stuff').permaccess_set.clear()
+        self.assertEqual(self.get_effective_perm_levels(user), set())
+
+    def test_perm_set_deleted(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        EffectivePermLevel.objects.refresh_users([user])
+
+        PermSet.objects.get(name='staff').delete()
+        self.assertEqual(self.get_effective_perm_levels(user), {('can_edit_stuff', 'some_stuff')})
+
+    def test_restraint_db_updated(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        EffectivePermLevel.objects.refresh_users([user])
+        EffectivePermLevel.objects.all().delete()
+
+        core.update_restraint_db(force=True)
+        self.assertEqual(self.get_effective_perm_levels(user), {('can_edit_stuff', 'some_stuff')})
+
+    def test_restraint_db_updated_refreshes_once(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        EffectivePermLevel.objects.refresh_users([user])
+        PermAccess.objects.set_default('staff', 'can_view_stuff', [constants.BOOLEAN_LEVELS_NAME])
+
+        # Flushing the default access changes the staff perm set, whose users are refreshed with everyone else
+        with patch.object(
+            EffectivePermLevelManager, 'refresh_perm_sets', autospec=True
+        ) as refresh_perm_sets, patch.object(
+            EffectivePermLevelManager, 'refresh_all', autospec=True, side_effect=EffectivePermLevelManager.refresh_all
+        ) as refresh_all:
+            core.update_restraint_db(flush_default_access=True)
+        refresh_perm_sets.assert_not_called()
+        self.assertEqual(refresh_all.call_count, 1)
+        self.assertEqual(self.get_effective_perm_levels(user), {
+            ('can_edit_stuff', 'some_stuff'),
+            ('can_edit_stuff', 'only_superusers'),
+        })
+
+    def test_disabled(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        with override_settings(RESTRAINT_EFFECTIVE_PERMS=False):
+            PermAccess.objects.add_individual_access(user, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+            PermSet.objects.get(name='staff').delete()
+            core.update_restraint_db(force=True)
+        self.assertFalse(EffectivePermLevel.objects.exists())
+
+    def test_update_effective_perms_command(self):
+        users = [G(User, is_superuser=False, is_staff=False) for i in range(3)]
+        call_command('update_effective_perms', chunk_size=2)
+        for user in users:
+            self.assertEqual(self.get_effective_perm_levels(user), {('can_edit_stuff', 'some_stuff')})
@@ -0,0 +1,94 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django_dynamic_fixture import G
+
+from restraint import core, executor
+
+
+def get_thread_id(value):
+    return value, threading.get_ident()
+
+
+class IsConcurrentTest(TransactionTestCase):
+    def test_disabled(self):
+        self.assertFalse(executor.is_concurrent(10))
+
+    @override_settings(RESTRAINT_ID_FILTER_THREADS=4)
+    def test_enabled(self):
+        self.assertFalse(executor.is_concurrent(1))
+        self.assertTrue(executor.is_concurrent(2))
+
+        with override_settings(RESTRAINT_ID_FILTER_THREADS_MIN_LEVELS=3):
+            self.assertFalse(executor.is_concurrent(2))
+            self.assertTrue(executor.is_concurrent(3))
+
+    @override_settings(RESTRAINT_ID_FILTER_THREADS=4)
+    def test_atomic(self):
+        with transaction.atomic():
+            self.assertFalse(executor.is_concurrent(10))
+
+
+class GetExecutorTest(TransactionTestCase):
+    def test_resized(self):
+        with override_settings(RESTRAINT_ID_FILTER_THREADS=2):
+            pool = executor.get_executor()
+            self.assertIs(executor.get_executor(), pool)
+            self.assertEqual(pool._max_workers, 2)
+
+        with override_settings(RESTRAINT_ID_FILTER_THREADS=3):
+            self.assertEqual(executor.get_executor()._max_workers, 3)
+
+
+@override_settings(RESTRAINT_ID_FILTER_THREADS=4)
+class MapCallsTest(TransactionTestCase):
+    def test_concurrent(self):
+        results = executor.map_calls(get_thread_id, [(i,) for i in range(4)])
+        self.assertEqual([value for value, thread_id in results], [0, 1, 2, 3])
+        self.assertNotIn(threading.get_ident(), {thread_id for value, thread_id in results})
+
+    def test_serial(self):
+        results = executor.map_calls(get_thread_id, iter([(0,)]))
+        self.assertEqual(results, [(0, threading.get_ident())])
+
+
+class FilterQsetConcurrentTest(TransactionTestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        self.thread_ids = set()
+
+    def id_filter(self, user_ids):
+        def id_filter(user):
+            self.thread_ids.add(threading.get_ident())
+            return list(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+        return id_filter
+
+    @override_settings(RESTRAINT_ID_FILTER_THREADS=2)
+    def test_filter_qset(self):
+        users = [G(User) for i in range(3)]
+        r = core.Restraint(users[0])
+        r.perm_mask = r._config.get_mask([('can_edit_stuff', 'some_stuff')])
+        r.perms = {
+            'can_edit_stuff': {
+                'some_stuff': self.id_filter([users[0].id]),
+                'only_superusers': self.id_filter([users[1].id]),
+            }
+        }
+
+        self.assertEqual(set(r.filter_qset(User.objects.all(), 'can_edit_stuff')), set(users[:2]))
+        self.assertNotIn(threading.get_ident(), self.thread_ids)
+
+
+@override_settings(RESTRAINT_ID_FILTER_THREADS=2)
+class FilterQsetAtomicTest(TestCase):
+    def test_filter_qset(self):
+        core.update_restraint_db()
+        user = G(User, is_superuser=False, is_staff=True)
+        superuser = G(User, is_superuser=True)
+
+        # The test case runs in a transaction, so the id filters are called serially
+        self.assertEqual(set(core.Restraint(user).filter_qset(User.objects.all(), 'can_edit_stuff')), {
+            user, superuser
+        })
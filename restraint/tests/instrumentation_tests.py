@@ -0,0 +1,189 @@
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import SimpleTestCase, TestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import Mock
+
+from restraint import core, signals
+from restraint.instrumentation import Aggregator, Histogram, get_num_ids, instrument
+
+
+class InstrumentTest(TestCase):
+    def test_no_receivers(self):
+        with instrument(signals.perms_loaded, num_users=1) as event:
+            User.objects.count()
+        self.assertEqual(event, {})
+
+    def test_sends_signal(self):
+        receiver = Mock()
+        signals.perms_loaded.connect(receiver)
+        self.addCleanup(signals.perms_loaded.disconnect, receiver)
+
+        with instrument(signals.perms_loaded, num_users=1) as event:
+            User.objects.count()
+            User.objects.count()
+            event['which_perms'] = None
+
+        receiver.assert_called_once_with(
+            signal=signals.perms_loaded,
+            sender=None,
+            duration=receiver.call_args[1]['duration'],
+            queries=2,
+            num_users=1,
+            which_perms=None
+        )
+        self.assertGreater(receiver.call_args[1]['duration'], 0)
+
+    def test_without_query_count(self):
+        receiver = Mock()
+        signals.perms_loaded.connect(receiver)
+        self.addCleanup(signals.perms_loaded.disconnect, receiver)
+
+        with instrument(signals.perms_loaded, count_queries=False):
+            User.objects.count()
+        self.assertIsNone(receiver.call_args[1]['queries'])
+
+    def test_get_num_ids(self):
+        G(User)
+        self.assertEqual(get_num_ids([1, 2]), 2)
+        self.assertIsNone(get_num_ids(User.objects.values_list('id', flat=True)))
+
+        qset = User.objects.values_list('id', flat=True)
+        list(qset)
+        self.assertEqual(get_num_ids(qset), 1)
+        self.assertIsNone(get_num_ids(pk for pk in [1, 2]))
+
+
+class HistogramTest(SimpleTestCase):
+    def test_percentile(self):
+        histogram = Histogram()
+        for i in range(99):
+            histogram.add(0.000001)
+        histogram.add(0.01)
+        histogram.add(0)
+
+        self.assertEqual(histogram.count, 101)
+        self.assertEqual(histogram.max, 0.01)
+        self.assertAlmostEqual(histogram.total, 0.010099)
+        self.assertEqual(histogram.percentile(50), 0.000001)
+        self.assertEqual(histogram.percentile(99), 0.000001)
+
+        # The largest bucket is capped by the largest duration
+        self.assertEqual(histogram.percentile(100), 0.01)
+
+    def test_percentile_empty(self):
+        self.assertEqual(Histogram().percentile(50), 0)
+
+
+class AggregatorTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        self.aggregator = Aggregator()
+        self.aggregator.connect()
+        self.addCleanup(self.aggregator.disconnect)
+
+    def test_perms_loaded(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        core.Restraint(user).perms
+        core.Restraint.for_users([user])
+
+        stats = self.aggregator.get_stats()
+        self.assertEqual(stats[('perms_loaded',)]['count'], 2)
+        self.assertEqual(stats[('perms_loaded',)]['queries'], 3)
+
+    @override_settings(RESTRAINT_CACHE='default')
+    def test_perm_set_cache_read(self):
+        caches['default'].clear()
+        user = G(User, is_superuser=False, is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            core.Restraint(user).perms
+        core.Restraint(user).perms
+
+        self.assertEqual(self.aggregator.get_stats()[('perm_set_cache_read',)]['count'], 2)
+        self.assertEqual(self.aggregator.cache_hits, 2)
+        self.assertEqual(self.aggregator.cache_misses, 2)
+
+    def test_filter_qset(self):
+        user = G(User, is_superuser=False, is_staff=True)
+        list(core.Restraint(user).filter_qset(User.objects.all(), 'can_edit_stuff'))
+
+        stats = self.aggregator.get_stats()
+        self.assertEqual(stats[('filter_qset', 'can_edit_stuff')]['count'], 1)
+        self.assertEqual(stats[('id_filter', 'can_edit_stuff', 'some_stuff')]['count'], 1)
+        self.assertEqual(stats[('id_filter', 'can_edit_stuff', 'only_superusers')]['count'], 1)
+
+        # The id filters return lazy querysets that do not run queries
+        self.assertEqual(stats[('id_filter', 'can_edit_stuff', 'some_stuff')]['queries'], 0)
+        self.assertEqual(stats[('id_filter', 'can_edit_stuff', 'some_stuff')]['ids'], 0)
+
+    def test_id_filter_num_ids(self):
+        receiver = Mock()
+        signals.id_filter_called.connect(receiver)
+        self.addCleanup(signals.id_filter_called.disconnect, receiver)
+        user = G(User)
+        r = core.Restraint(user)
+        r.perms = {'can_edit_stuff': {'some_stuff': lambda user: [user.id, 0]}}
+
+        r.filter_qset(User.objects.all(), 'can_edit_stuff')
+        self.assertEqual(receiver.call_args[1]['num_ids'], 2)
+        self.assertEqual(self.aggregator.get_stats()[('id_filter', 'can_edit_stuff', 'some_stuff')]['ids'], 2)
+
+    def test_id_filter_generator(self):
+        user = G(User)
+        G(User)
+        r = core.Restraint(user)
+        r.perms = {'can_edit_stuff': {'some_stuff': lambda user: (pk for pk in [user.id])}}
+
+        # The ids of the generator are not counted, so they are left for the filter
+        self.assertEqual(list(r.filter_qset(User.objects.all(), 'can_edit_stuff')), [user])
+        self.assertEqual(self.aggregator.get_stats()[('id_filter', 'can_edit_stuff', 'some_stuff')]['count'], 1)
+
+    async def test_afilter_qset(self):
+        user = await User.objects.acreate(username='staff', is_staff=True)
+
+        async def id_filter(user):
+            return [user.id]
+
+        r = core.Restraint(user)
+        r.perms = {'can_edit_stuff': {'some_stuff': id_filter}}
+        r.perm_mask = r._config.get_mask([('can_edit_stuff', 'some_stuff')])
+        await r.afilter_qset(User.objects.all(), 'can_edit_stuff')
+
+        stats = self.aggregator.get_stats()
+        self.assertEqual(stats[('filter_qset', 'can_edit_stuff')]['queries'], 0)
+        self.assertEqual(stats[('id_filter', 'can_edit_stuff', 'some_stuff')]['ids'], 1)
+
+    def test_perm_checkers_called(self):
+        receiver = Mock()
+        signals.perm_checkers_called.connect(receiver)
+        self.addCleanup(signals.perm_checkers_called.disconnect, receiver)
+        r = core.Restraint(G(User, is_superuser=False, is_staff=False))
+        r._permission_checkers = [Mock(return_value=True)]
+
+        self.assertTrue(r.has_perm('can_mess_with_stuff'))
+        self.assertEqual(receiver.call_args[1]['perm_levels'], [('can_mess_with_stuff', None)])
+        self.assertEqual(receiver.call_args[1]['results'], [True])
+        self.assertEqual(self.aggregator.get_stats()[('perm_checkers',)]['count'], 1)
+
+    def test_restraint_db_update_phases(self):
+        core.update_restraint_db(force=True)
+
+        stats = self.aggregator.get_stats()
+        self.assertEqual({key[1] for key in stats if key[0] == 'update_restraint_db'}, {
+            'fingerprint',
+            'sync_perm_sets',
+            'sync_perms',
+            'sync_perm_levels',
+            'update_perm_set_access',
+            'restraint_db_updated',
+        })
+        self.assertEqual(stats[('update_restraint_db', 'fingerprint')]['queries'], 1)
+
+    def test_reset_and_disconnect(self):
+        core.update_restraint_db(force=True)
+        self.aggregator.reset()
+        self.assertEqual(self.aggregator.get_stats(), {})
+
+        self.aggregator.disconnect()
+        core.update_restraint_db(force=True)
+        self.assertEqual(self.aggregator.get_stats(), {})
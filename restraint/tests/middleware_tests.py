@@ -0,0 +1,111 @@
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django_dynamic_fixture import G
+
+from restraint import constants, core
+from restraint.middleware import RestraintMiddleware, get_restraint
+from restraint.models import PermAccess
+import restraint.tests.configuration as test_configuration
+
+
+class GetRestraintTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        self.request = RequestFactory().get('/')
+        self.request.user = G(User, is_superuser=True)
+
+    def test_one_restraint_per_request(self):
+        restraint = get_restraint(self.request)
+        self.assertEqual(restraint._user, self.request.user)
+        self.assertIs(get_restraint(self.request), restraint)
+        self.assertIs(get_restraint(self.request, ['can_view_stuff']), restraint)
+
+        # The permissions are only loaded once
+        restraint.perms
+        with self.assertNumQueries(0):
+            self.assertTrue(get_restraint(self.request, ['can_view_stuff']).has_perm('can_view_stuff'))
+
+    def test_new_restraint_for_new_user(self):
+        restraint = get_restraint(self.request)
+        self.request.user = G(User)
+        self.assertIsNot(get_restraint(self.request), restraint)
+        self.assertIs(get_restraint(self.request)._user, self.request.user)
+
+    def test_load_missing_perms(self):
+        restraint = get_restraint(self.request, ['can_view_stuff'])
+        self.assertEqual(restraint.perms, {'can_view_stuff': {'': None}})
+
+        # Only the missing perm is loaded
+        with self.assertNumQueries(1):
+            self.assertIs(get_restraint(self.request, ['can_view_stuff', 'can_edit_stuff']), restraint)
+        self.assertEqual(restraint.perms, {
+            'can_view_stuff': {'': None},
+            'can_edit_stuff': {
+                'all_stuff': None,
+                'some_stuff': test_configuration.user_some_stuff_id_filter,
+            },
+        })
+
+        with self.assertNumQueries(0):
+            get_restraint(self.request, ['can_edit_stuff'])
+
+    def test_load_all_perms(self):
+        restraint = get_restraint(self.request, ['can_view_stuff'])
+        restraint.perms
+
+        get_restraint(self.request)
+        self.assertEqual(set(restraint.perms), {'can_view_stuff', 'can_edit_stuff', 'can_access_users_named_foo'})
+        with self.assertNumQueries(0):
+            get_restraint(self.request, ['can_edit_stuff'])
+
+    def test_load_perms_before_loading(self):
+        restraint = get_restraint(self.request, ['can_view_stuff'])
+        get_restraint(self.request, ['can_edit_stuff'])
+        with self.assertNumQueries(1):
+            self.assertEqual(set(restraint.perms), {'can_view_stuff', 'can_edit_stuff'})
+
+    def test_load_all_perms_before_loading(self):
+        restraint = get_restraint(self.request, ['can_view_stuff'])
+        get_restraint(self.request)
+        self.assertEqual(set(restraint.perms), {'can_view_stuff', 'can_edit_stuff', 'can_access_users_named_foo'})
+
+    def test_load_individual_perms(self):
+        user = G(User, is_superuser=False, is_staff=False)
+        PermAccess.objects.add_individual_access(user, 'can_view_stuff', constants.BOOLEAN_LEVELS_NAME)
+        self.request.user = user
+        restraint = get_restraint(self.request, ['can_edit_stuff'])
+        restraint.perms
+
+        self.assertTrue(get_restraint(self.request, ['can_view_stuff']).has_perm('can_view_stuff'))
+
+
+class RestraintMiddlewareTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+
+    def test_middleware(self):
+        request = RequestFactory().get('/')
+        request.user = G(User, is_superuser=True)
+
+        def get_response(request):
+            self.assertTrue(request.restraint.has_perm('can_view_stuff'))
+            self.assertIs(get_restraint(request, ['can_view_stuff']), request._restraint)
+            return HttpResponse()
+
+        with self.assertNumQueries(1):
+            RestraintMiddleware(get_response)(request)
+
+    async def test_async_middleware(self):
+        request = RequestFactory().get('/')
+        request.user = await User.objects.acreate(username='super', is_superuser=True)
+
+        async def get_response(request):
+            self.assertTrue(await request.restraint.ahas_perm('can_view_stuff'))
+            self.assertIs(get_restraint(request), request._restraint)
+            return HttpResponse()
+
+        middleware = RestraintMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual((await middleware(request)).status_code, 200)
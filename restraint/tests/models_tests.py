@@ -47,6 +47,50 @@ class PermAccessTest(TestCase):
         pa = PermAccess.objects.get(perm_user_id=0, perm_user_type=None, perm_set=permission_set)
         self.assertEqual(list(pa.perm_levels.all()), [])
 
+    def test_update_perm_set_access_num_queries(self):
+        """
+        Tests that updating the access of perm sets runs a fixed number of queries
+        """
+        perm_sets = [G(PermSet, name=f'set_{i}', is_private=True) for i in range(10)]
+        perms = [G(Perm, name=f'perm_{i}') for i in range(10)]
+        for perm in perms:
+            G(PermLevel, perm=perm, name='level_1')
+            G(PermLevel, perm=perm, name='level_2')
+        config = {
+            perm_set.name: {
+                perm.name: ['level_1', 'level_2']
+                for perm in perms
+            }
+            for perm_set in perm_sets
+        }
+
+        # Select the perm sets and their access, create the access, select the levels and the current levels,
+        # and insert the new levels
+        with self.assertNumQueries(6):
+            PermAccess.objects.update_perm_set_access(config, perms)
+        for perm_set in perm_sets:
+            self.assertEqual(PermAccess.objects.get(perm_set=perm_set).perm_levels.count(), 20)
+
+        # Nothing is written when the levels are up to date
+        with self.assertNumQueries(4):
+            PermAccess.objects.update_perm_set_access(config, perms)
+
+    def test_update_perm_set_access_flush_previous_config(self):
+        """
+        Tests that flushing removes levels that are not in the config and keeps the rest
+        """
+        perm_set = G(PermSet, name='my_set', is_private=True)
+        level_1 = G(PermLevel, perm=F(name='my_perm'), name='level_1')
+        level_2 = G(PermLevel, perm=level_1.perm, name='level_2')
+        PermAccess.objects.set_default('my_set', 'my_perm', ['level_1', 'level_2'])
+
+        # Existing perms are not changed without flushing
+        PermAccess.objects.update_perm_set_access({'my_set': {'my_perm': ['level_1']}}, [])
+        self.assertEqual(set(PermAccess.objects.get(perm_set=perm_set).perm_levels.all()), {level_1, level_2})
+
+        PermAccess.objects.update_perm_set_access({'my_set': {'my_perm': ['level_2']}}, [], True)
+        self.assertEqual(list(PermAccess.objects.get(perm_set=perm_set).perm_levels.all()), [level_2])
+
     def test_add_individual_access_level_exists(self):
         """
         Tests adding an individual permission to a user.
@@ -73,3 +117,74 @@ class PermAccessTest(TestCase):
 
         pa = PermAccess.objects.get(perm_user_id=u.id, perm_user_type=ContentType.objects.get_for_model(u))
         self.assertEqual(list(pa.perm_levels.all()), [])
+
+    def test_bulk_add_individual_access(self):
+        """
+        Tests adding individual permissions to many users at once.
+        """
+        users = [G(User) for i in range(5)]
+        pl1 = G(PermLevel, perm=F(name='my_perm'), name='my_level')
+        pl2 = G(PermLevel, perm=pl1.perm, name='my_other_level')
+        PermAccess.objects.add_individual_access(users[0], 'my_perm', 'my_level')
+
+        # Select the levels and the perm access, create the perm access and insert the levels
+        with self.assertNumQueries(6):
+            PermAccess.objects.bulk_add_individual_access(
+                [(u, 'my_perm', 'my_level') for u in users] + [(users[1], 'my_perm', 'my_other_level')]
+            )
+
+        self.assertEqual(PermAccess.objects.filter(perm_user_type=ContentType.objects.get_for_model(User)).count(), 5)
+        for u in users:
+            pa = PermAccess.objects.get(perm_user_id=u.id, perm_user_type=ContentType.objects.get_for_model(u))
+            self.assertEqual(set(pa.perm_levels.all()), {pl1, pl2} if u == users[1] else {pl1})
+
+    def test_bulk_add_individual_access_level_does_not_exist(self):
+        """
+        Tests that nothing is added when a level does not exist.
+        """
+        u = G(User)
+        G(PermLevel, perm=F(name='my_perm'), name='my_level')
+
+        with self.assertRaises(PermLevel.DoesNotExist):
+            PermAccess.objects.bulk_add_individual_access([(u, 'my_perm', 'my_level'), (u, 'my_perm', 'invalid')])
+        self.assertFalse(PermAccess.objects.exists())
+
+    def test_bulk_add_individual_access_empty(self):
+        """
+        Tests that only the savepoint of the transaction is run without any levels.
+        """
+        with self.assertNumQueries(2):
+            PermAccess.objects.bulk_add_individual_access([])
+
+    def test_bulk_remove_individual_access(self):
+        """
+        Tests removing individual permissions from many users at once.
+        """
+        users = [G(User) for i in range(5)]
+        pl1 = G(PermLevel, perm=F(name='my_perm'), name='my_level')
+        pl2 = G(PermLevel, perm=pl1.perm, name='my_other_level')
+        PermAccess.objects.bulk_add_individual_access(
+            [(u, 'my_perm', 'my_level') for u in users[:4]] + [(u, 'my_perm', 'my_other_level') for u in users[:4]]
+        )
+
+        # Users without individual access are ignored
+        with self.assertNumQueries(5):
+            PermAccess.objects.bulk_remove_individual_access(
+                [(u, 'my_perm', 'my_level') for u in users] + [(users[0], 'my_perm', 'my_other_level')]
+            )
+
+        for u in users[:4]:
+            pa = PermAccess.objects.get(perm_user_id=u.id, perm_user_type=ContentType.objects.get_for_model(u))
+            self.assertEqual(set(pa.perm_levels.all()), set() if u == users[0] else {pl2})
+        self.assertFalse(PermAccess.objects.filter(perm_user_id=users[4].id).exists())
+
+    def test_bulk_remove_individual_access_no_access(self):
+        """
+        Tests that nothing is deleted when none of the users have individual access.
+        """
+        u = G(User)
+        G(PermLevel, perm=F(name='my_perm'), name='my_level')
+
+        # Select the levels and the perm access
+        with self.assertNumQueries(4):
+            PermAccess.objects.bulk_remove_individual_access([(u, 'my_perm', 'my_level')])
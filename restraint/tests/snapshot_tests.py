@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django_dynamic_fixture import G
+
+from restraint import cache, constants, core, snapshot
+from restraint.models import PermAccess, PermSet, RestraintMetadata
+
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        caches['default'].clear()
+
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.path = os.path.join(snapshot_dir.name, 'restraint.json')
+
+        settings_override = override_settings(RESTRAINT_CACHE='default', RESTRAINT_SNAPSHOT=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_build_snapshot(self):
+        built = snapshot.build_snapshot()
+        self.assertEqual(built['format'], snapshot.SNAPSHOT_FORMAT)
+        self.assertEqual(built['version'], snapshot.get_version())
+        self.assertEqual(built['perm_sets'], {
+            'super': {
+                'can_access_users_named_foo': [''],
+                'can_edit_stuff': ['all_stuff', 'some_stuff'],
+                'can_view_stuff': [''],
+            },
+            'individual': {
+                'can_edit_stuff': ['some_stuff'],
+            },
+            'staff': {
+                'can_edit_stuff': ['only_superusers', 'some_stuff'],
+            },
+            'locked_and_hidden': {},
+        })
+
+    def test_load_snapshot(self):
+        snapshot.write_snapshot()
+
+        # The version is checked with one query
+        with self.assertNumQueries(1):
+            self.assertTrue(snapshot.load_snapshot())
+
+        # Only the individual access of the user is loaded from the database
+        user = G(User, is_superuser=False, is_staff=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(set(core.Restraint(user).perms['can_edit_stuff']), {'some_stuff', 'only_superusers'})
+
+    def test_load_snapshot_stale(self):
+        snapshot.write_snapshot()
+        PermAccess.objects.set_default('staff', 'can_edit_stuff', ['all_stuff'])
+        self.assertFalse(snapshot.load_snapshot())
+
+        # A new snapshot has the changed access
+        snapshot.write_snapshot()
+        self.assertTrue(snapshot.load_snapshot())
+        config = core.get_compiled_restraint_config()
+        self.assertEqual(
+            caches['default'].get(cache.get_perm_set_key('staff')),
+            config.get_mask([('can_edit_stuff', 'all_stuff')])
+        )
+
+    def test_version_bumped(self):
+        snapshot.write_snapshot()
+        versions = {snapshot.get_version()}
+
+        G(PermSet, name='new_perm_set')
+        versions.add(snapshot.get_version())
+        PermSet.objects.get(name='new_perm_set').delete()
+        versions.add(snapshot.get_version())
+        PermAccess.objects.get(perm_set__name='staff').delete()
+        versions.add(snapshot.get_version())
+        PermAccess.objects.update_perm_set_access(core.get_restraint_config()['default_access'])
+        versions.add(snapshot.get_version())
+        core.update_restraint_db(force=True)
+        versions.add(snapshot.get_version())
+
+        self.assertEqual(len(versions), 6)
+
+    def test_version_not_bumped_by_individual_access(self):
+        snapshot.write_snapshot()
+        version = snapshot.get_version()
+        user = G(User)
+        PermAccess.objects.add_individual_access(user, 'can_edit_stuff', 'all_stuff')
+        PermAccess.objects.get(perm_user_id=user.id).delete()
+        self.assertEqual(snapshot.get_version(), version)
+
+    def test_version_not_stored_when_disabled(self):
+        with override_settings(RESTRAINT_SNAPSHOT=None):
+            snapshot.write_snapshot(self.path)
+            version = snapshot.get_version()
+            PermAccess.objects.set_default('staff', 'can_edit_stuff', ['all_stuff'])
+            self.assertEqual(snapshot.get_version(), version)
+
+    def test_not_loaded(self):
+        # The snapshot does not exist yet
+        self.assertFalse(snapshot.load_snapshot())
+
+        snapshot.write_snapshot()
+        with override_settings(RESTRAINT_CACHE=None):
+            self.assertFalse(snapshot.load_snapshot())
+
+        with open(self.path) as f:
+            written = json.load(f)
+        with open(self.path, 'w') as f:
+            json.dump(dict(written, format=0), f)
+        self.assertFalse(snapshot.load_snapshot())
+
+        # The snapshot has a level that is not in the config
+        written['perm_sets']['staff']['can_edit_stuff'].append('missing')
+        with open(self.path, 'w') as f:
+            json.dump(written, f)
+        self.assertFalse(snapshot.load_snapshot())
+
+        with open(self.path, 'w') as f:
+            f.write('not json')
+        self.assertFalse(snapshot.load_snapshot())
+
+    def test_command(self):
+        output = os.path.join(os.path.dirname(self.path), 'other.json')
+        call_command('write_restraint_snapshot', output=output)
+        self.assertTrue(snapshot.load_snapshot(output))
+        self.assertTrue(RestraintMetadata.objects.filter(name=constants.SNAPSHOT_VERSION_METADATA_NAME).exists())
+
+    def test_command_without_path(self):
+        with override_settings(RESTRAINT_SNAPSHOT=None):
+            with self.assertRaises(CommandError):
+                call_command('write_restraint_snapshot')
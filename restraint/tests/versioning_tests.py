@@ -0,0 +1,203 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django_dynamic_fixture import G
+from unittest.mock import Mock, patch
+
+from restraint import cache, core, versioning
+from restraint.middleware import RestraintMiddleware
+from restraint.models import PermAccess, PermLevel, PermSet, RestraintVersion
+from restraint.signals import restraint_version_changed
+
+
+@override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60)
+class BumpVersionTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+
+    def assertBumped(self, func):
+        version = versioning.get_version()
+        func()
+        self.assertGreater(versioning.get_version(), version)
+
+    def test_bumped(self):
+        user = G(User)
+        self.assertBumped(lambda: G(PermSet, name='new_perm_set'))
+        self.assertBumped(lambda: PermSet.objects.get(name='new_perm_set').delete())
+        self.assertBumped(lambda: PermAccess.objects.set_default('staff', 'can_edit_stuff', ['all_stuff']))
+        self.assertBumped(lambda: PermAccess.objects.add_individual_access(user, 'can_view_stuff', ''))
+        self.assertBumped(lambda: PermAccess.objects.bulk_add_individual_access([
+            (user, 'can_edit_stuff', 'all_stuff'),
+        ]))
+        self.assertBumped(lambda: PermAccess.objects.bulk_remove_individual_access([
+            (user, 'can_edit_stuff', 'all_stuff'),
+        ]))
+        self.assertBumped(lambda: PermLevel.objects.get(name='same_first_name').delete())
+        self.assertBumped(lambda: core.update_restraint_db(force=True))
+
+    def test_not_bumped_without_changes(self):
+        version = versioning.get_version()
+        PermAccess.objects.update_perm_set_access(core.get_restraint_config()['default_access'])
+        PermAccess.objects.bulk_remove_individual_access([(G(User), 'can_edit_stuff', 'all_stuff')])
+        self.assertEqual(versioning.get_version(), version)
+
+    def test_not_bumped_when_disabled(self):
+        version = versioning.get_version()
+        with override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=None):
+            G(PermSet, name='new_perm_set')
+        self.assertEqual(versioning.get_version(), version)
+
+    def test_row_deleted(self):
+        RestraintVersion.objects.all().delete()
+        self.assertEqual(versioning.get_version(), 0)
+        versioning.bump_version()
+        self.assertEqual(versioning.get_version(), 1)
+
+    def test_single_update(self):
+        with self.assertNumQueries(1):
+            versioning.bump_version()
+
+
+class CheckVersionTest(TestCase):
+    def setUp(self):
+        core.update_restraint_db()
+        versioning.reset()
+        self.addCleanup(versioning.reset)
+        self.receiver = Mock()
+        restraint_version_changed.connect(self.receiver)
+        self.addCleanup(restraint_version_changed.disconnect, self.receiver)
+
+    def bump(self):
+        with override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60):
+            versioning.bump_version()
+
+    def test_disabled(self):
+        with self.assertNumQueries(0):
+            versioning.check_version()
+            versioning.check_version(per_request=True)
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60)
+    def test_interval(self):
+        with patch('restraint.versioning.time.monotonic', return_value=1000):
+            # The first check only records the version
+            with self.assertNumQueries(1):
+                versioning.check_version()
+            self.bump()
+
+            with self.assertNumQueries(0):
+                versioning.check_version()
+                versioning.check_version(per_request=True)
+            self.receiver.assert_not_called()
+
+        with patch('restraint.versioning.time.monotonic', return_value=1060):
+            versioning.check_version()
+            versioning.check_version()
+        self.receiver.assert_called_once_with(
+            signal=restraint_version_changed, sender=None, version=versioning.get_version()
+        )
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60)
+    def test_checked_by_another_thread(self):
+        class CheckedWhileWaiting(object):
+            def __enter__(self):
+                versioning._checked_at = 1000
+
+            def __exit__(self, *args):
+                pass
+
+        with patch.object(versioning, '_check_lock', CheckedWhileWaiting()):
+            with patch('restraint.versioning.time.monotonic', return_value=1000):
+                with self.assertNumQueries(0):
+                    versioning.check_version()
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=0)
+    def test_per_request(self):
+        with self.assertNumQueries(0):
+            versioning.check_version()
+
+        versioning.check_version(per_request=True)
+        self.bump()
+        with self.assertNumQueries(1):
+            versioning.check_version(per_request=True)
+        self.assertEqual(self.receiver.call_count, 1)
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=0)
+    def test_middleware(self):
+        versioning.check_version(per_request=True)
+        self.bump()
+
+        request = RequestFactory().get('/')
+        RestraintMiddleware(Mock())(request)
+        self.assertEqual(self.receiver.call_count, 1)
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=0)
+    async def test_async_middleware(self):
+        await sync_to_async(versioning.check_version)(per_request=True)
+        await sync_to_async(self.bump)()
+
+        async def get_response(request):
+            return HttpResponse()
+
+        await RestraintMiddleware(get_response)(RequestFactory().get('/'))
+        self.assertEqual(self.receiver.call_count, 1)
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=0, RESTRAINT_CACHE='default')
+    def test_drops_caches(self):
+        caches['default'].clear()
+        config = core.get_compiled_restraint_config()
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_perm_set_masks(['staff'])
+        versioning.check_version(per_request=True)
+
+        self.bump()
+
+        # Only the version is read. The cached entries become unreachable instead of being listed and deleted
+        with self.assertNumQueries(1):
+            versioning.check_version(per_request=True)
+        self.assertIsNone(caches['default'].get(cache.get_perm_set_key('staff')))
+
+        # The compiled config does not depend on the database, so it is kept
+        self.assertIs(core.get_compiled_restraint_config(), config)
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60, RESTRAINT_CACHE='default')
+    def test_checked_when_perm_sets_read(self):
+        caches['default'].clear()
+        user = G(User, is_staff=True)
+        with patch('restraint.versioning.time.monotonic', return_value=1000):
+            # Building Restraint objects does not read the version
+            with self.assertNumQueries(0):
+                r = core.Restraint(user)
+            r.perms
+            # Another process changed the access of the perm set, which this process has cached
+            caches['default'].set(cache.get_perm_set_key('staff'), 0)
+            self.bump()
+
+        with patch('restraint.versioning.time.monotonic', return_value=1060):
+            perms = core.Restraint(user).perms
+        self.assertEqual(self.receiver.call_count, 1)
+        self.assertEqual(set(perms['can_edit_stuff']), {'some_stuff', 'only_superusers'})
+
+    @override_settings(RESTRAINT_VERSION_CHECK_INTERVAL=60, RESTRAINT_CACHE='default')
+    async def test_async(self):
+        await caches['default'].aclear()
+        user = await User.objects.acreate(username='staff', is_staff=True)
+        with patch('restraint.versioning.time.monotonic', return_value=1000):
+            r = core.Restraint(user)
+            self.assertTrue(await r.ahas_perm('can_edit_stuff', 'some_stuff'))
+            await sync_to_async(self.bump)()
+
+        with patch('restraint.versioning.time.monotonic', return_value=1060):
+            r = core.Restraint(user)
+            self.assertTrue(await r.ahas_perm('can_edit_stuff', 'some_stuff'))
+        self.assertEqual(self.receiver.call_count, 1)
+
+    @override_settings(RESTRAINT_CACHE='default')
+    def test_shared_cache_kept(self):
+        caches['default'].clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.get_perm_set_masks(['staff'])
+        with patch.object(cache, 'get_cache', return_value=Mock()):
+            cache.invalidate_local_perm_sets(sender=None)
+        self.assertIsNotNone(caches['default'].get(cache.get_perm_set_key('staff')))
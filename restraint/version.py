@@ -1 +1 @@
-__version__ = '2.3.1'
+__version__ = '2.4.0'
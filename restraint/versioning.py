@@ -0,0 +1,134 @@
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F
+
+from restraint.signals import restraint_version_changed
+
+
+# The version this process last read and when it read it, on the time.monotonic clock
+_checked_version = None
+_checked_at = None
+_check_lock = threading.Lock()
+
+
+def get_check_interval():
+    """
+    Returns the number of seconds between checks of the restraint version, set with the
+    RESTRAINT_VERSION_CHECK_INTERVAL setting. The version is not kept when it is None, the default,
+    and is only checked by RestraintMiddleware at the start of each request when it is 0.
+    """
+    return getattr(settings, 'RESTRAINT_VERSION_CHECK_INTERVAL', None)
+
+
+def is_enabled():
+    return get_check_interval() is not None
+
+
+def get_version():
+    """
+    Returns the restraint version in the database with a single row read.
+    """
+    from restraint.models import RestraintVersion
+    return RestraintVersion.objects.order_by('pk').values_list('version', flat=True).first() or 0
+
+
+def bump_version():
+    """
+    Increments the restraint version in the current transaction, so that other processes drop their
+    in-process caches once the change is committed.
+    """
+    from restraint.models import RestraintVersion
+
+    if is_enabled() and not RestraintVersion.objects.update(version=F('version') + 1):
+        # The row created by the migration was deleted, for example by flushing the database
+        RestraintVersion.objects.create(version=1)
+
+
+async def aget_version():
+    """
+    The async version of get_version.
+    """
+    from restraint.models import RestraintVersion
+    return await RestraintVersion.objects.order_by('pk').values_list('version', flat=True).afirst() or 0
+
+
+def _claim_check(per_request):
+    """
+    Returns true if the check interval has passed since the version was last read, and records that it
+    is being read now so that other threads skip their checks in the meantime.
+    """
+    global _checked_at
+
+    interval = get_check_interval()
+    if interval is None or (interval == 0 and not per_request):
+        return False
+
+    now = time.monotonic()
+    if _checked_at is not None and now - _checked_at < interval:
+        return False
+    with _check_lock:
+        # Another thread may have checked while this one waited for the lock
+        if _checked_at is not None and now - _checked_at < interval:
+            return False
+        _checked_at = now
+    return True
+
+
+def _record_version(version):
+    """
+    Records the version that was read and returns true if it changed since the last check.
+    """
+    global _checked_version
+
+    with _check_lock:
+        previous_version, _checked_version = _checked_version, version
+    return previous_version is not None and version != previous_version
+
+
+def check_version(per_request=False):
+    """
+    Reads the restraint version if the check interval has passed since it was last read, and sends
+    restraint_version_changed if it changed. The first check only records the version. When the
+    interval is 0 the version is only checked by RestraintMiddleware, which passes per_request.
+    """
+    if _claim_check(per_request) and _record_version(get_version()):
+        restraint_version_changed.send(sender=None, version=_checked_version)
+
+
+async def acheck_version(per_request=False):
+    """
+    The async version of check_version. The version is read with the async ORM and the receivers of
+    restraint_version_changed are called in a thread, since they may use the sync ORM.
+    """
+    if _claim_check(per_request) and _record_version(await aget_version()):
+        await sync_to_async(restraint_version_changed.send)(sender=None, version=_checked_version)
+
+
+def reset():
+    """
+    Forgets the version this process last read, so that the next check only records it.
+    """
+    global _checked_version, _checked_at
+    with _check_lock:
+        _checked_version = None
+        _checked_at = None
+
+
+def version_changed(sender, **kwargs):
+    """
+    Bumps the restraint version. This is connected to the signals of changes to the restraint tables
+    and to restraint_db_updated.
+    """
+    bump_version()
+
+
+def perm_levels_changed(sender, action, **kwargs):
+    """
+    Bumps the restraint version when the levels of a PermAccess change. This is connected to the
+    m2m_changed signal of PermAccess.perm_levels.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_version()
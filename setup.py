@@ -33,7 +33,7 @@ setup(
     author='Wes Kendall',
     author_email='opensource@ambition.com',
     keywords='Django, Permission',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     classifiers=[
         'Programming Language :: Python',
         'Programming Language :: Python :: 3.7',